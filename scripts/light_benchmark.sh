@@ -0,0 +1,9 @@
+# cd to rootpath
+SCRIPT_DIR=$(dirname "$(realpath "$0")")
+cd "$SCRIPT_DIR/.."
+
+# run the light latency benchmark, on the simulator by default (lights=gardasoft_sim or microtec_sim)
+# INTERVAL_MS paces the switches, faster than the serial line rate they queue up on the wire
+LIGHTS=${1:-gardasoft_sim}
+INTERVAL_MS=${2:-0}
+uv run ./src/light_benchmark.py --config-path ../configs --config-name collector_default cameras=none lights=$LIGHTS +switches=500 +interval_ms=$INTERVAL_MS
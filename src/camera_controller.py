@@ -1,6 +1,7 @@
 from pathlib import Path
 from logging import Logger
 from abc import ABC, abstractmethod
+import asyncio
 import importlib
 from omegaconf import DictConfig
 from utils_ema.log import get_logger_default
@@ -67,6 +68,79 @@ class CameraControllerAbstract(ABC):
         pass
 
 
+class CameraControllerAsync:
+    """
+    asyncio interface over the shared ring of a camera controller.
+    Subclasses provide start_grabbing, stop_grabbing, get_frame_id and
+    get_frameset, and expose cfg.buffer_size.
+    """
+
+    frames_dropped: int = 0
+
+    def end_of_stream(self) -> bool:
+        """
+        True once a finite source produced its last frame set, live cameras never end
+        """
+        return False
+
+    async def astart(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.start_grabbing)
+
+    async def astop(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.stop_grabbing)
+
+    async def stream(self, mode: str = "latest", poll_interval: float = 0.001):
+        """
+        async for images, frame_id, meta in controller.stream(mode="latest"):
+
+        latest: always the newest frame set, older ones are skipped
+        all: every frame set in order, frame sets overwritten in the ring before
+             being consumed are counted in frames_dropped
+
+        Frame sets are read from the ring only when the consumer asks for the
+        next one, so a slow consumer never makes frames pile up in memory.
+        """
+        if mode not in ["latest", "all"]:
+            raise ValueError(f"{mode} is not a known stream mode (latest, all)")
+
+        loop = asyncio.get_running_loop()
+        self.frames_dropped = 0
+        last_id = None
+        while True:
+            # read before the ring, the last frame set is published before the end
+            ended = self.end_of_stream()
+            latest_id = await loop.run_in_executor(None, self.get_frame_id)
+
+            # nothing new in the ring (a smaller id means the index was reset)
+            if latest_id is None or latest_id == last_id:
+                if ended:
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+
+            if mode == "latest" or last_id is None or latest_id < last_id:
+                next_id = latest_id
+            else:
+                next_id = last_id + 1
+
+                # keep one slot of margin, the oldest one may be under overwrite
+                oldest_id = max(latest_id - self.cfg.buffer_size + 2, 0)
+                if next_id < oldest_id:
+                    self.frames_dropped += oldest_id - next_id
+                    next_id = oldest_id
+
+            images, frame_id, meta = await loop.run_in_executor(
+                None, self.get_frameset, next_id
+            )
+            if images is None or frame_id != next_id:
+                continue
+
+            last_id = frame_id
+            yield images, frame_id, meta
+
+
 def get_camera_controller(cfg: DictConfig, logger: Logger = None):
 
     # null camera controller
@@ -17,10 +17,13 @@ import queue
 # local imports
 sys.path.append(Path(__file__).parents[2].as_posix())
 sys.path.append(Path(__file__).parent.as_posix())
-from camera_controller import CameraControllerAbstract
+from camera_controller import CameraControllerAbstract, CameraControllerAsync
 from utils_basler import fps2microseconds
-from synchronization import synchronize_cameras
+from synchronization import synchronize_cameras, synchronize_camera, synchronize_devices
 from circular_buffer import SharedCircularBuffer
+from grab_statistics import CameraStatistics
+from lanes import FrameSetAssembler, split_devices, set_cpu_affinity
+from preprocessing import Preprocessing, bin_image, convert_raw, debayer_downsample
 from multiprocessing import Value
 
 
@@ -33,7 +36,7 @@ class StoppableThread(threading.Thread):
         self.stop_event.set()
 
 
-class CameraController:
+class CameraController(CameraControllerAsync):
     def __init__(self, logger: Logger, cfg: DictConfig):
         self.cfg = cfg
         self.logger = logger
@@ -44,6 +47,7 @@ class CameraController:
         tlf = pylon.TlFactory.GetInstance()
         devices = tlf.EnumerateDevices([pylon.DeviceInfo()])
         self.num_cameras = len(devices)
+        self.serials = [device.GetSerialNumber() for device in devices]
 
         if self.num_cameras == 0:
             raise ValueError("No cameras detected")
@@ -55,9 +59,20 @@ class CameraController:
             self.cfg.buffer_size, self.num_cameras
         )
 
+        # low-res preview ring, slots aligned with the full-res ring
+        self.preview_buffer = None
+        if self.cfg.preview.do:
+            self.preview_buffer = SharedCircularBuffer(
+                self.cfg.buffer_size, self.num_cameras
+            )
+
         self.buffer_id = mp.Value("i", 0)
         self.lock = mp.Lock()
 
+        # per-camera statistics published by the worker
+        self.manager = mp.Manager()
+        self.stats = self.manager.dict()
+
         # --------------------------------------------------
         # 3️⃣ IPC primitives
         # --------------------------------------------------
@@ -68,9 +83,20 @@ class CameraController:
         self.event_stop_grabbing = mp.Event()
         self.event_reset_index = mp.Event()
 
+        # runtime parameter changes, one command queue per grab process
+        self.command_queues = []
+        self.replies = mp.Queue()
+        self.command_id = 0
+
         # --------------------------------------------------
         # 4️⃣ Start worker process
         # --------------------------------------------------
+        self.lane_processes = []
+        if self.cfg.grab_processes.do:
+            self.__start_lanes(event_init, pipe_child, pipe_parent)
+            return
+
+        self.command_queues = [mp.Queue()]
         self.process = mp.Process(
             target=self.init_worker,
             daemon=True,
@@ -83,6 +109,10 @@ class CameraController:
                 self.circular_buffer,
                 self.buffer_id,
                 self.lock,
+                self.stats,
+                self.command_queues[0],
+                self.replies,
+                self.preview_buffer,
             ),
         )
 
@@ -94,6 +124,141 @@ class CameraController:
         # Receive devices info from worker
         self.devices_info = pipe_parent.recv()
 
+    def __start_lanes(self, event_init: mp.Event, pipe_child, pipe_parent) -> None:
+        """
+        One grab process per camera group, each writing its own lane,
+        plus an assembler process building the frame sets in the ring
+        """
+        cfg_lanes = self.cfg.grab_processes
+        groups = split_devices(self.num_cameras, cfg_lanes.cameras_per_process)
+        affinity = cfg_lanes.cpu_affinity
+        if affinity is not None and len(affinity) < len(groups):
+            error_msg = f"cpu_affinity has {len(affinity)} entries, {len(groups)} grab processes needed"
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        # one PTP domain for all the cameras, the lanes do not renegotiate it
+        if self.cfg.synch and not synchronize_devices(self.serials, self.logger):
+            error_msg = "Cameras could not be synchronized"
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        # assembler process
+        lane_queues = [mp.Queue() for _ in groups]
+        self.process = mp.Process(
+            target=self.init_assembler,
+            daemon=True,
+            args=(
+                lane_queues,
+                self.event_start_grabbing,
+                self.event_stop_grabbing,
+                self.event_reset_index,
+                self.circular_buffer,
+                self.buffer_id,
+                self.lock,
+                self.stats,
+                self.preview_buffer,
+            ),
+        )
+        self.process.start()
+
+        # grab processes, initialized one at a time to keep enumeration sequential
+        self.devices_info = {}
+        for i, device_ids in enumerate(groups):
+            if i > 0:
+                event_init = mp.Event()
+                pipe_child, pipe_parent = mp.Pipe()
+            cores = None if affinity is None else list(affinity[i])
+            self.command_queues.append(mp.Queue())
+            p = mp.Process(
+                target=self.init_lane,
+                daemon=True,
+                args=(
+                    event_init,
+                    pipe_child,
+                    device_ids,
+                    cores,
+                    lane_queues[i],
+                    self.event_start_grabbing,
+                    self.event_stop_grabbing,
+                    self.circular_buffer,
+                    self.stats,
+                    self.command_queues[i],
+                    self.replies,
+                    self.preview_buffer,
+                ),
+            )
+            p.start()
+            event_init.wait()
+            self.devices_info.update(pipe_parent.recv())
+            self.lane_processes.append(p)
+
+        self.logger.info(f"{len(groups)} grab processes started for lanes {groups}")
+
+    def init_lane(
+        self,
+        event_init: mp.Event,
+        pipe_child,
+        device_ids,
+        cores,
+        lane_queue,
+        event_start_grabbing,
+        event_stop_grabbing,
+        circular_buffer,
+        stats,
+        commands,
+        replies,
+        preview_buffer,
+    ) -> None:
+        set_cpu_affinity(cores, self.logger)
+        serials = [self.serials[i] for i in device_ids]
+        worker = CameraControllerWorker(
+            self.logger,
+            self.cfg,
+            event_init,
+            pipe_child,
+            device_ids=device_ids,
+            serials=serials,
+            synchronized=True,
+        )
+        worker.run(
+            event_start_grabbing,
+            event_stop_grabbing,
+            None,
+            circular_buffer,
+            None,
+            None,
+            stats,
+            commands=commands,
+            replies=replies,
+            lane_queue=lane_queue,
+            preview_buffer=preview_buffer,
+        )
+
+    def init_assembler(
+        self,
+        lane_queues,
+        event_start_grabbing,
+        event_stop_grabbing,
+        event_reset_index,
+        circular_buffer,
+        buffer_id,
+        lock,
+        stats,
+        preview_buffer,
+    ) -> None:
+        assembler = FrameSetAssembler(self.logger, self.cfg, lane_queues)
+        assembler.run(
+            event_start_grabbing,
+            event_stop_grabbing,
+            event_reset_index,
+            circular_buffer,
+            buffer_id,
+            lock,
+            stats,
+            preview_buffer,
+        )
+
     def init_worker(
         self,
         event_init: mp.Event,
@@ -104,6 +269,10 @@ class CameraController:
         circular_buffer,
         buffer_id,
         lock,
+        stats,
+        commands,
+        replies,
+        preview_buffer,
     ) -> None:
         worker = CameraControllerWorker(self.logger, self.cfg, event_init, pipe_child)
         worker.run(
@@ -113,6 +282,10 @@ class CameraController:
             circular_buffer,
             buffer_id,
             lock,
+            stats,
+            commands=commands,
+            replies=replies,
+            preview_buffer=preview_buffer,
         )
 
     def start_grabbing(self) -> None:
@@ -122,15 +295,24 @@ class CameraController:
     def stop_grabbing(self) -> None:
         self.event_start_grabbing.clear()
         self.event_stop_grabbing.set()
+        for p in self.lane_processes:
+            p.join()
         self.process.join()
 
     def close(self):
         self.circular_buffer.close()
+        if self.preview_buffer is not None:
+            self.preview_buffer.close()
+        for p in self.lane_processes:
+            p.join()
         self.process.join()
+        self.manager.shutdown()
 
     def reset_buffer_id(self):
         self.buffer_id.value = 0
         self.circular_buffer.reset_index()
+        if self.preview_buffer is not None:
+            self.preview_buffer.reset_index()
         self.event_reset_index.set()
 
     def get_images(self) -> Tuple[List[Image], int]:
@@ -138,12 +320,123 @@ class CameraController:
             id = self.buffer_id.value
         images = self.circular_buffer.get_buffer(id)
         if images is not None:
-            images = [Image(img) for img in images]
+            images = [None if img is None else Image(img) for img in images]
         return images, id
 
+    def get_frame_id(self) -> Optional[int]:
+        with self.lock:
+            id = self.buffer_id.value
+        return self.circular_buffer.get_slot_id(id)
+
+    def get_frameset(
+        self, frame_id: Optional[int] = None
+    ) -> Tuple[Optional[List[Image]], Optional[int], Optional[Dict]]:
+        """
+        returns (images, frame_id, meta) of the latest frame set, or of frame_id if given
+        """
+        if frame_id is None:
+            with self.lock:
+                id = self.buffer_id.value
+        else:
+            id = frame_id % self.cfg.buffer_size
+        slot_id, images, meta = self.circular_buffer.get_slot(id)
+        if images is not None:
+            images = [None if img is None else Image(img) for img in images]
+        return images, slot_id, meta
+
+    def get_preview(
+        self, frame_id: Optional[int] = None
+    ) -> Tuple[Optional[List[Image]], Optional[int]]:
+        """
+        returns (images, frame_id) of the low-res preview of the latest frame set,
+        or of frame_id if given; (None, None) when the preview is disabled
+        """
+        if self.preview_buffer is None:
+            return None, None
+        if frame_id is None:
+            with self.lock:
+                id = self.buffer_id.value
+        else:
+            id = frame_id % self.cfg.buffer_size
+        slot_id, images, _ = self.preview_buffer.get_slot(id)
+        if images is not None:
+            images = [None if img is None else Image(img) for img in images]
+        return images, slot_id
+
     def get_devices_info(self):
         return self.devices_info
 
+    def get_stats(self) -> Dict:
+        """
+        Latest per-camera transport and frame-loss statistics, keyed by camera name
+        """
+        return {k: v for k, v in self.stats.items()}
+
+    def set_camera_params(
+        self,
+        cam_ids: Optional[List[int]] = None,
+        wait: bool = True,
+        timeout: float = 5.0,
+        **params,
+    ) -> Optional[Dict]:
+        """
+        Change camera parameters while grabbing, applied by the worker between frames.
+        params: exposure_time, gain, gamma, fps (live, all cameras only), crop_slot or
+        roi=[offset_x, offset_y, width, height] (restart the stream of the camera).
+        Returns the updated devices info of the cameras if wait is True.
+        """
+        unknown = set(params) - set(CameraControllerWorker.params_live) - set(
+            CameraControllerWorker.params_restart
+        )
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown camera parameters: {unknown}")
+
+        # the frame period is shared by the synchronized cameras
+        if "fps" in params and cam_ids is not None:
+            if set(cam_ids) != set(range(self.num_cameras)):
+                raise ValueError("fps applies to all cameras, set it with cam_ids=None")
+
+        # replies of commands sent without waiting
+        self.__merge_replies(self.__drain_replies())
+
+        self.command_id += 1
+        command = {"id": self.command_id, "cam_ids": cam_ids, "params": params}
+        for q in self.command_queues:
+            q.put(command)
+        if not wait:
+            return None
+
+        # one reply per grab process
+        replies = []
+        time_end = time.monotonic() + timeout
+        while len([r for r in replies if r["id"] == command["id"]]) < len(
+            self.command_queues
+        ):
+            try:
+                reply = self.replies.get(timeout=max(time_end - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f"Camera parameters not applied in {timeout} s")
+            replies.append(reply)
+        return self.__merge_replies(replies)
+
+    def __drain_replies(self) -> List[Dict]:
+        replies = []
+        while True:
+            try:
+                replies.append(self.replies.get_nowait())
+            except queue.Empty:
+                return replies
+
+    def __merge_replies(self, replies: List[Dict]) -> Dict:
+        updated = {}
+        for reply in replies:
+            updated.update(reply["devices_info"])
+            if len(reply["errors"]) > 0:
+                self.logger.error(f"Camera parameters not applied: {reply['errors']}")
+        for cam_name, info in updated.items():
+            self.devices_info[cam_name].update(info)
+        return updated
+
 
 class CameraControllerWorker(CameraControllerAbstract):
     def __init__(
@@ -152,12 +445,26 @@ class CameraControllerWorker(CameraControllerAbstract):
         cfg: DictConfig,
         event_init: mp.Event,
         pipe_child,
+        device_ids: Optional[List[int]] = None,
+        serials: Optional[List[str]] = None,
+        synchronized: bool = False,
     ) -> None:
+        """
+        synchronized: PTP already set up for all the cameras by the parent (lanes)
+        """
         self.cfg = cfg
         self.logger = logger
+        self.device_ids = device_ids
+        self.serials = serials
+        self.synchronized = synchronized
         self.load_devices()
         self.cam_results = None
         self.cam_ids = None
+        self.statistics = [CameraStatistics() for _ in range(self.n_devices)]
+        self.degraded = [False] * self.n_devices
+        self.block_id_offsets = [0] * self.n_devices
+        self.resync = [False] * self.n_devices
+        self.paused = [False] * self.n_devices
         event_init.set()
         time.sleep(1)
         pipe_child.send(self.get_devices_info())
@@ -172,8 +479,17 @@ class CameraControllerWorker(CameraControllerAbstract):
         circular_buffer: SharedCircularBuffer,
         buffer_id: mp.Value,
         lock: mp.Lock,
+        stats: Optional[Dict] = None,
+        commands: Optional[mp.Queue] = None,
+        replies: Optional[mp.Queue] = None,
+        lane_queue: Optional[mp.Queue] = None,
+        preview_buffer: Optional[SharedCircularBuffer] = None,
         verbose: bool = True,
     ) -> None:
+        """
+        grab loop, frame sets are written to the ring or, when running as a lane
+        of a per-camera grab process, sent to the assembler through lane_queue
+        """
 
         self.logger.info("Camera worker waiting to start grabbing...")
         event_start.wait()
@@ -184,24 +500,141 @@ class CameraControllerWorker(CameraControllerAbstract):
         self.logger.info("Camera worker started grabbing...")
 
         counter = 0
+        time_stats = time.monotonic()
         while not event_stop.is_set():
 
-            if event_reset_index.is_set():
+            if event_reset_index is not None and event_reset_index.is_set():
                 buffer_id.value = 0
                 counter = 0
                 event_reset_index.clear()
 
+            # runtime parameter changes, between frames
+            if commands is not None:
+                self.apply_commands(commands, replies)
+
             images = self.grab_images()
-            id = counter % self.cfg.buffer_size
-            circular_buffer.append(images, id)
-            with lock:
-                buffer_id.value = id
-            counter += 1
+
+            # lane: copy to shared memory here, the assembler builds the frame set
+            if lane_queue is not None:
+                image_metas = [circular_buffer.create_image_shm(img) for img in images]
+                preview_metas = None
+                if preview_buffer is not None:
+                    preview_metas = [
+                        preview_buffer.create_image_shm(img) for img in self.previews
+                    ]
+                lane_queue.put(
+                    (self.block_ids, image_metas, self.frame_meta, preview_metas)
+                )
+
+            else:
+                id = counter % self.cfg.buffer_size
+                circular_buffer.append(images, counter, self.frame_meta)
+                if preview_buffer is not None:
+                    preview_buffer.append(self.previews, counter)
+                with lock:
+                    buffer_id.value = id
+                counter += 1
+
+            # publish statistics
+            if stats is not None:
+                if time.monotonic() - time_stats > self.cfg.stats.interval:
+                    self.publish_stats(stats)
+                    time_stats = time.monotonic()
 
         self.stop_grabbing()
-        circular_buffer.close()
+        if stats is not None:
+            self.publish_stats(stats)
+        if lane_queue is None:
+            circular_buffer.close()
+            if preview_buffer is not None:
+                preview_buffer.close()
         self.logger.info("Camera worker stopped grabbing...")
 
+    # parameters applied while grabbing, and the ones needing a stream restart
+    params_live = ["exposure_time", "gain", "gamma", "fps"]
+    params_restart = ["crop_slot", "roi"]
+
+    def apply_commands(self, commands: mp.Queue, replies: mp.Queue) -> None:
+        while True:
+            try:
+                command = commands.get_nowait()
+            except queue.Empty:
+                return
+            reply = self.apply_command(command)
+            if replies is not None:
+                replies.put(reply)
+
+    def apply_command(self, command: Dict) -> Dict:
+        params = command["params"]
+        cam_ids = command["cam_ids"]
+        if cam_ids is None:
+            cam_ids = self.device_ids
+
+        devices_info = {}
+        errors = []
+        for i, device_id in enumerate(self.device_ids):
+            if device_id not in cam_ids:
+                continue
+            cam = self.cam_array[i]
+            try:
+                restart = any(k in self.params_restart for k in params)
+                if restart:
+                    self.__pause_camera(i)
+                if "exposure_time" in params:
+                    cam.ExposureTime.SetValue(params["exposure_time"])
+                if "gain" in params:
+                    cam.Gain.Value = params["gain"]
+                if "gamma" in params:
+                    cam.Gamma.Value = params["gamma"]
+                if "fps" in params:
+                    self.set_camera_period(cam, params["fps"])
+                if "crop_slot" in params:
+                    self.set_camera_crop(cam, slot=params["crop_slot"])
+                if "roi" in params:
+                    self.set_camera_roi(cam, params["roi"])
+                if restart:
+                    self.__resume_camera(i)
+            except Exception as e:
+                errors.append(f"camera {device_id}: {e}")
+                if self.paused[i]:
+                    try:
+                        self.__resume_camera(i)
+                    except Exception as e_resume:
+                        # left to the reconnection of the grab thread
+                        self.logger.error(f"Camera {device_id} not restarted: {e_resume}")
+                        errors.append(f"camera {device_id} degraded: {e_resume}")
+                        self.degraded[i] = True
+                        self.statistics[i].set_degraded(True)
+                        self.paused[i] = False
+            else:
+                self.logger.info(f"Camera {device_id} parameters changed: {params}")
+            cam_name = "cam_" + str(device_id).zfill(3)
+            devices_info[cam_name] = self.get_camera_crop_info(i)
+
+        return {"id": command["id"], "devices_info": devices_info, "errors": errors}
+
+    def __pause_camera(self, cam_id: int) -> None:
+        """
+        stop the stream of a single camera, its frames are missing meanwhile
+        """
+        self.paused[cam_id] = True
+        self.cam_array[cam_id].StopGrabbing()
+        while not self.queues[cam_id].empty():
+            self.queues[cam_id].get_nowait().Release()
+
+    def __resume_camera(self, cam_id: int) -> None:
+        self.cam_array[cam_id].StartGrabbing(getattr(pylon, self.strategy))
+        self.resync[cam_id] = True
+        self.statistics[cam_id].reset_block_id()
+        self.paused[cam_id] = False
+
+    def publish_stats(self, stats: Dict) -> None:
+        for i, statistics in enumerate(self.statistics):
+            cam_name = "cam_" + str(self.device_ids[i]).zfill(3)
+            if hasattr(self, "queues"):
+                statistics.set_queue_depth(self.queues[i].qsize())
+            stats[cam_name] = statistics.snapshot(self.cam_array[i])
+
     @property
     def num_cameras(self) -> int:
         return self.n_devices
@@ -211,19 +644,23 @@ class CameraControllerWorker(CameraControllerAbstract):
         self.n_devices = val
 
     def load_features(self):
-        for i, cam in enumerate(self.cam_array):
-            device = self.devices[i]
-            sn = device.GetSerialNumber()
-            mn = device.GetModelName()
-            iden = f"{mn}_{sn}"
-            path = Path(self.cfg.pfs_dir) / f"{iden}.pfs"
-            os.makedirs(self.cfg.pfs_dir, exist_ok=True)
-            if path.exists():
-                self.logger.info(f"Loading features for camera {iden}")
-                pylon.FeaturePersistence_Load(str(path), cam.GetNodeMap(), True)
-            else:
-                self.logger.info(f"Saving features for camera {iden}")
-                pylon.FeaturePersistence_Save(str(path), cam.GetNodeMap())
+        for i in range(self.n_devices):
+            self.load_camera_features(i)
+
+    def load_camera_features(self, cam_id: int):
+        cam = self.cam_array[cam_id]
+        device = self.devices[cam_id]
+        sn = device.GetSerialNumber()
+        mn = device.GetModelName()
+        iden = f"{mn}_{sn}"
+        path = Path(self.cfg.pfs_dir) / f"{iden}.pfs"
+        os.makedirs(self.cfg.pfs_dir, exist_ok=True)
+        if path.exists():
+            self.logger.info(f"Loading features for camera {iden}")
+            pylon.FeaturePersistence_Load(str(path), cam.GetNodeMap(), True)
+        else:
+            self.logger.info(f"Saving features for camera {iden}")
+            pylon.FeaturePersistence_Save(str(path), cam.GetNodeMap())
 
     def load_devices(self) -> None:
         # get devices
@@ -233,7 +670,14 @@ class CameraControllerWorker(CameraControllerAbstract):
                 pylon.DeviceInfo(),
             ]
         )
+
+        # restrict to the cameras of this lane
+        if self.serials is not None:
+            devices = {device.GetSerialNumber(): device for device in self.devices}
+            self.devices = [devices[sn] for sn in self.serials if sn in devices]
         self.n_devices = len(self.devices)
+        if self.device_ids is None:
+            self.device_ids = list(range(self.n_devices))
         if self.n_devices == 0:
             error_msg = "No devices detected!"
             self.logger.error(error_msg)
@@ -248,6 +692,10 @@ class CameraControllerWorker(CameraControllerAbstract):
         self.converter = pylon.ImageFormatConverter()
         self.converter.OutputPixelFormat = getattr(pylon, self.cfg.converter.val)
 
+        # reducing operations applied before the shared memory copy
+        self.preprocessing = Preprocessing(self.cfg.preprocessing)
+        self.previews = None
+
         # logger
         self.logger.info(f"{self.n_devices} Basler camera detected")
 
@@ -257,6 +705,9 @@ class CameraControllerWorker(CameraControllerAbstract):
         self.get_devices_info()
         self.set_cameras_config()
 
+        # raw pixel formats, the preview demosaics Bayer data itself
+        self.pixel_formats = [cam.PixelFormat.GetValue() for cam in self.cam_array]
+
     def set_camera_fps(self, cam: pylon.InstantCamera, fps: float) -> None:
         cam.AcquisitionFrameRateEnable.Value = True
         cam.AcquisitionFrameRate.Value = fps
@@ -270,6 +721,10 @@ class CameraControllerWorker(CameraControllerAbstract):
         cam.TriggerSource.Value = "PeriodicSignal1"
         cam.TriggerMode.Value = "On"
 
+    def set_camera_period(self, cam: pylon.InstantCamera, fps: float) -> None:
+        cam.AcquisitionFrameRate.Value = fps
+        cam.BslPeriodicSignalPeriod = fps2microseconds(fps)
+
     def set_trigger_ouput(self, cam: pylon.InstantCamera) -> None:
         cam.BslPeriodicSignalDelay.Value = 0
         cam.LineSelector.Value = self.cfg.trigger.line
@@ -291,20 +746,35 @@ class CameraControllerWorker(CameraControllerAbstract):
                 return True
             wasexposing = isexposing
 
-    def set_camera_crop(self) -> None:
-        if self.cfg.crop.do:
+    def set_camera_crop(
+        self, cam: pylon.InstantCamera, slot: Optional[int] = None
+    ) -> None:
+        if slot is None and self.cfg.crop.do:
             slot = self.cfg.crop.slot
-            for cam in self.cam_array:
-                cam.BslMultipleROIRowsEnable.Value = True
-                cam.BslMultipleROIColumnsEnable.Value = True
-                cam.BslMultipleROIColumnSelector.Value = "Column" + str(slot)
-                cam.BslMultipleROIRowSelector.Value = "Row" + str(slot)
+        if slot is not None:
+            cam.BslMultipleROIRowsEnable.Value = True
+            cam.BslMultipleROIColumnsEnable.Value = True
+            cam.BslMultipleROIColumnSelector.Value = "Column" + str(slot)
+            cam.BslMultipleROIRowSelector.Value = "Row" + str(slot)
         else:
-            for cam in self.cam_array:
-                cam.BslMultipleROIRowsEnable.Value = False
-                cam.BslMultipleROIColumnsEnable.Value = False
-                cam.Height.Value = cam.SensorHeight.Value
-                cam.Width.Value = cam.SensorWidth.Value
+            cam.BslMultipleROIRowsEnable.Value = False
+            cam.BslMultipleROIColumnsEnable.Value = False
+            cam.Height.Value = cam.SensorHeight.Value
+            cam.Width.Value = cam.SensorWidth.Value
+
+    def set_camera_roi(self, cam: pylon.InstantCamera, roi: List[int]) -> None:
+        """
+        single ROI: roi = [offset_x, offset_y, width, height]
+        """
+        offset_x, offset_y, width, height = roi
+        cam.BslMultipleROIRowsEnable.Value = False
+        cam.BslMultipleROIColumnsEnable.Value = False
+        cam.OffsetX.Value = 0
+        cam.OffsetY.Value = 0
+        cam.Width.Value = width
+        cam.Height.Value = height
+        cam.OffsetX.Value = offset_x
+        cam.OffsetY.Value = offset_y
 
     # def check_real_fps(self):
     #     self.logger.info("Checking real fps...")
@@ -326,22 +796,50 @@ class CameraControllerWorker(CameraControllerAbstract):
     def set_cameras_config(self) -> bool:
         # fps = self.check_real_fps()
 
-        for i, cam in enumerate(self.cam_array):
-
-            # self.set_camera_fps(cam, fps)
-            self.set_camera_fps(cam, self.cfg.trigger.fps)
-            cam.BslColorSpace.Value = "Off"
-            cam.Gain.Value = self.cfg.gain
-            cam.Gamma.Value = self.cfg.gamma
-            cam.BslColorSpace.Value = self.cfg.color_space.val
-            cam.PixelFormat.SetValue(self.cfg.pixel_format.val)
-            cam.ExposureTime.SetValue(self.cfg.exposure_time)
-            self.set_camera_crop()
-            self.set_trigger_ouput(cam)  # set output trigger from master
-            cam.SetCameraContext(i)
+        for i in range(self.n_devices):
+            self.set_camera_config(i)
 
         return True
 
+    def set_camera_config(self, cam_id: int) -> None:
+        cam = self.cam_array[cam_id]
+
+        # self.set_camera_fps(cam, fps)
+        self.set_camera_fps(cam, self.cfg.trigger.fps)
+        cam.BslColorSpace.Value = "Off"
+        cam.Gain.Value = self.cfg.gain
+        cam.Gamma.Value = self.cfg.gamma
+        cam.BslColorSpace.Value = self.cfg.color_space.val
+        cam.PixelFormat.SetValue(self.cfg.pixel_format.val)
+        cam.ExposureTime.SetValue(self.cfg.exposure_time)
+        self.set_camera_crop(cam)
+        self.set_trigger_ouput(cam)  # set output trigger from master
+        self.set_camera_chunks(cam)
+        cam.SetCameraContext(cam_id)
+
+    def set_camera_chunks(self, cam: pylon.InstantCamera) -> None:
+        """
+        embed per-frame data (exposure, gain, line status, timestamp, counter)
+        in the image stream, no control channel traffic needed to read it
+        """
+        if not self.cfg.chunks.do:
+            return
+        cam.ChunkModeActive.Value = True
+        for selector in self.cfg.chunks.selectors:
+            cam.ChunkSelector.Value = selector
+            cam.ChunkEnable.Value = True
+
+    def read_chunks(self, grabResult: Optional[pylon.GrabResult]) -> Optional[Dict]:
+        if grabResult is None or not grabResult.GrabSucceeded():
+            return None
+        chunks = {}
+        for selector in self.cfg.chunks.selectors:
+            try:
+                chunks[selector] = getattr(grabResult, "Chunk" + selector).Value
+            except Exception:
+                chunks[selector] = None
+        return chunks
+
     def open_cameras(self) -> None:
         if not self.cam_array.IsOpen():
             self.cam_array.Open()
@@ -386,18 +884,51 @@ class CameraControllerWorker(CameraControllerAbstract):
         # cam_ids = []
 
         for i, q in enumerate(self.queues):
-            results[i] = q.get()
+            self.statistics[i].set_queue_depth(q.qsize())
+            results[i] = self.__get_result(i, q)
+
+        # BlockIDs restart after a reconnection, compare them net of an offset
+        # against the offset-adjusted ids of the cameras not resyncing
+        reference = [
+            results[i].GetBlockID() - self.block_id_offsets[i]
+            for i in camera_ids
+            if results[i] is not None and not self.resync[i]
+        ]
+        for i in camera_ids:
+            if results[i] is None:
+                continue
+            if self.resync[i] and len(reference) > 0:
+                self.block_id_offsets[i] = results[i].GetBlockID() - min(reference)
+                self.resync[i] = False
 
         for i in camera_ids:
             #     res = self.__grab_image_base(self.cam_array)
-            id = results[i].GetBlockID()
+            if results[i] is None:
+                continue
+            id = results[i].GetBlockID() - self.block_id_offsets[i]
             ids.append(id)
         #     cam_id = res.GetCameraContext()
         #     self.logger.info(f"Grabbed image ID {id} from camera {cam_id}")
         #     cam_ids.append(cam_id)
         #     results[cam_id] = res
         # self.logger.info(ids)
+        self.block_ids = ids
+        self.frame_meta = {
+            "timestamp": time.time(),
+            "block_ids": [
+                None if results[i] is None else results[i].GetBlockID()
+                for i in camera_ids
+            ],
+            "camera_timestamps": [
+                None if results[i] is None else results[i].GetTimeStamp()
+                for i in camera_ids
+            ],
+        }
+        if self.cfg.chunks.do:
+            self.frame_meta["chunks"] = [self.read_chunks(results[i]) for i in camera_ids]
         if len(set(ids)) > 1:
+            for statistics in self.statistics:
+                statistics.add_mismatch()
             self.logger.warning(
                 f"Grabbed images have different IDs: {ids}, possible synchronization issue, try to reduce fps"
             )
@@ -408,23 +939,43 @@ class CameraControllerWorker(CameraControllerAbstract):
         # ]
         return results
 
+    def __get_result(self, cam_id: int, q: queue.Queue) -> Optional[pylon.GrabResult]:
+        """
+        next result of a camera, None while the camera is degraded
+        """
+        if self.degraded[cam_id]:
+            # results left from the lost stream are stale
+            while not q.empty():
+                q.get_nowait().Release()
+            return None
+        while True:
+            if self.paused[cam_id] and q.empty():
+                return None
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.degraded[cam_id]:
+                    return None
+
     def __start_base(self, strategy: str, synch: bool, verbose: bool = True) -> None:
         self.open_cameras()
+        self.strategy = strategy
+        self.synch = synch
 
-        if synch:
+        if synch and not self.synchronized:
             success = synchronize_cameras(self.cam_array, self.logger)
             if not success:
                 error_msg = "Cameras could not be synchronized"
                 self.logger.error(error_msg)
                 raise ValueError(error_msg)
 
-        self.queues = [queue.Queue() for _ in range(self.n_devices)]
+        self.queues = [queue.Queue(maxsize=self.cfg.queue_size) for _ in range(self.n_devices)]
         stop_event = threading.Event()
         self.threads = [
             StoppableThread(
                 stop_event=stop_event,
                 target=self.__grab_image_base,
-                args=(stop_event, self.cam_array[i], self.queues[i]),
+                args=(stop_event, i),
                 daemon=True,
             )
             for i in range(self.n_devices)
@@ -475,23 +1026,140 @@ class CameraControllerWorker(CameraControllerAbstract):
     def start_cameras_synchronous_oneByOne(self, verbose: bool = True) -> None:
         self.__start_base(synch=True, strategy="GrabStrategy_OneByOne", verbose=verbose)
 
-    def __grab_image_base(self, stop_event, cam: pylon.InstantCamera, queue) -> Image:
+    def __grab_image_base(self, stop_event, cam_id: int) -> Image:
+        cam = self.cam_array[cam_id]
+        q = self.queues[cam_id]
+        statistics = self.statistics[cam_id]
+        timeouts = 0
         while not stop_event.is_set():
-            grabResult = cam.RetrieveResult(
-                self.cfg.timeout, pylon.TimeoutHandling_ThrowException
-            )
+            try:
+                grabResult = cam.RetrieveResult(
+                    self.cfg.timeout, pylon.TimeoutHandling_ThrowException
+                )
+            except pylon.TimeoutException:
+                if self.paused[cam_id]:
+                    continue
+                statistics.add_timeout()
+                timeouts += 1
+                if self.cfg.reconnect.do and (
+                    timeouts >= self.cfg.reconnect.max_timeouts
+                    or cam.IsCameraDeviceRemoved()
+                ):
+                    self.__reconnect_camera(stop_event, cam_id)
+                    timeouts = 0
+                continue
+            except Exception as e:
+                # stream stopped on purpose for a parameter change
+                if self.paused[cam_id]:
+                    time.sleep(0.01)
+                    continue
+                if not self.cfg.reconnect.do:
+                    raise
+                self.logger.error(f"Camera {self.device_ids[cam_id]} grab error: {e}")
+                self.__reconnect_camera(stop_event, cam_id)
+                timeouts = 0
+                continue
+            timeouts = 0
             if grabResult is not None:
-                queue.put(grabResult)
+                statistics.add_result(grabResult)
+                # consumer behind (another camera degraded): drop the oldest
+                if q.full():
+                    try:
+                        q.get_nowait().Release()
+                        statistics.add_dropped()
+                    except queue.Empty:
+                        pass
+                q.put(grabResult)
+
+    def __reconnect_camera(self, stop_event, cam_id: int) -> None:
+        """
+        mark the camera degraded and reopen it, runs in the grab thread of the
+        camera so the other cameras keep grabbing
+        """
+        self.degraded[cam_id] = True
+        self.statistics[cam_id].set_degraded(True)
+        self.logger.warning(f"Camera {self.device_ids[cam_id]} degraded, reconnecting")
+
+        cam = self.cam_array[cam_id]
+        while not stop_event.is_set():
+            try:
+                if cam.IsGrabbing():
+                    cam.StopGrabbing()
+                if cam.IsPylonDeviceAttached():
+                    cam.DestroyDevice()
+                cam.Attach(self.tlf.CreateDevice(self.devices[cam_id]))
+                cam.Open()
+                self.load_camera_features(cam_id)
+                self.set_camera_config(cam_id)
+                if self.synch:
+                    synchronize_camera(cam)
+                cam.StartGrabbing(getattr(pylon, self.strategy))
+                break
+            except Exception as e:
+                self.logger.warning(
+                    f"Camera {self.device_ids[cam_id]} reconnection failed: {e}"
+                )
+                stop_event.wait(self.cfg.reconnect.interval)
+
+        if stop_event.is_set():
+            return
+
+        self.resync[cam_id] = True
+        self.statistics[cam_id].reset_block_id()
+        self.statistics[cam_id].set_degraded(False)
+        self.degraded[cam_id] = False
+        self.logger.info(f"Camera {self.device_ids[cam_id]} reconnected")
+
+    def __process_preview(self, grabResult: pylon.GrabResult, cam_id: int):
+        """
+        low-res image straight from the raw buffer, skipping full demosaicing
+        """
+        if grabResult is None or not grabResult.GrabSucceeded():
+            return None
+        raw = grabResult.GetArray()
+        pixel_format = self.pixel_formats[cam_id]
+        if pixel_format.startswith("Bayer"):
+            return debayer_downsample(raw, self.cfg.preview.factor, pixel_format[5:7])
+        return bin_image(raw, self.cfg.preview.factor)
+
+    def __raw_output(self, cam_id: int) -> Optional[str]:
+        """
+        output of the converter when the raw buffer can be cropped before it
+        (8-bit Bayer or mono frames), None otherwise
+        """
+        pixel_format = self.pixel_formats[cam_id]
+        if pixel_format != "Mono8" and not (
+            pixel_format.startswith("Bayer") and pixel_format.endswith("8")
+        ):
+            return None
+        return {
+            "PixelType_RGB8packed": "RGB",
+            "PixelType_Mono8packed": "GRAY",
+            "PixelType_BayerRG8packed": "RAW",
+        }.get(self.cfg.converter.val)
 
     def __process_result(
-        self, grabResult: pylon.GrabResult, dtype=torch.uint8
+        self, grabResult: pylon.GrabResult, cam_id: int, dtype=torch.uint8
     ) -> Image:
+        if grabResult is None:
+            return None
         if grabResult.GrabSucceeded():
+            output = self.__raw_output(cam_id)
+            if self.preprocessing.crops_first() and output is not None:
+                # crop the raw buffer, only the kept pixels are demosaiced
+                pixel_format = self.pixel_formats[cam_id]
+                bayer = pixel_format.startswith("Bayer")
+                raw, roi = self.preprocessing.crop_raw(grabResult.GetArray(), bayer)
+                img = convert_raw(raw, pixel_format[5:7] if bayer else None, output)
+                grabResult.Release()
+                img = self.preprocessing.crop(img, roi)
+                return self.preprocessing.preprocess(img, start=1)
             if self.converter is not None:
                 img = self.converter.Convert(grabResult).GetArray()
             else:
                 img = grabResult.GetArray()
             grabResult.Release()
+            img = self.preprocessing.preprocess(img)
             # img = Image(img=torch.from_numpy(img), dtype=dtype)
             return img
         return None
@@ -502,7 +1170,7 @@ class CameraControllerWorker(CameraControllerAbstract):
             grabResult, _ = self.__grab_image_base(cam)
             if grabResult.GrabSucceeded():
                 break
-        img = self.__process_result(grabResult, dtype)
+        img = self.__process_result(grabResult, cam_id, dtype)
         return img
 
     def grab_images(
@@ -511,7 +1179,16 @@ class CameraControllerWorker(CameraControllerAbstract):
         camera_ids = list(range(self.n_devices)) if camera_ids is None else camera_ids
 
         cam_results = self.__results_collector()
-        images = [self.__process_result(res) for res in cam_results]
+        if self.cfg.preview.do:
+            self.previews = [
+                self.__process_preview(res, i) for i, res in enumerate(cam_results)
+            ]
+        images = [self.__process_result(res, i) for i, res in enumerate(cam_results)]
+
+        # partial frame set: degraded camera or failed grab
+        missing = [self.device_ids[i] for i, img in enumerate(images) if img is None]
+        self.frame_meta["partial"] = len(missing) > 0
+        self.frame_meta["missing"] = missing
         return images
 
     def show_stream(self, cam_id: int) -> None:
@@ -539,7 +1216,7 @@ class CameraControllerWorker(CameraControllerAbstract):
 
         # get cam infos
         for i, device in enumerate(self.devices):
-            cam_name = "cam_" + str(i).zfill(3)
+            cam_name = "cam_" + str(self.device_ids[i]).zfill(3)
             devices_info[cam_name] = {}
 
             for info_key in self.cfg.camera_info:
@@ -551,24 +1228,7 @@ class CameraControllerWorker(CameraControllerAbstract):
                 devices_info[cam_name][info_key] = info
 
             # crop info
-            cam = self.cam_array[i]
-            cam_info = {}
-            cam_info["resolution_native"] = [
-                cam.SensorWidth.GetValue(),
-                cam.SensorHeight.GetValue(),
-            ]
-            cam_info["crop_resolution"] = [
-                cam.BslMultipleROIColumnSize.GetValue(),
-                cam.BslMultipleROIRowSize.GetValue(),
-            ]
-            cam_info["crop_offset"] = [
-                cam.BslMultipleROIColumnOffset.GetValue(),
-                cam.BslMultipleROIRowOffset.GetValue(),
-            ]
-            cam_info["crop_selection"] = [
-                cam.BslMultipleROIColumnsEnable.GetValue(),
-                cam.BslMultipleROIRowsEnable.GetValue(),
-            ]
+            cam_info = self.get_camera_crop_info(i)
             for key in cam_info:
                 devices_info[cam_name][key] = cam_info[key]
 
@@ -582,3 +1242,34 @@ class CameraControllerWorker(CameraControllerAbstract):
             sensor_size = pixelsizes[model_name]
             devices_info[cam_name]["PixelSizeMicrometers"] = sensor_size
         return devices_info
+
+    def get_camera_crop_info(self, cam_id: int) -> Dict:
+        cam = self.cam_array[cam_id]
+        cam_info = {}
+        cam_info["resolution_native"] = [
+            cam.SensorWidth.GetValue(),
+            cam.SensorHeight.GetValue(),
+        ]
+        cam_info["crop_selection"] = [
+            cam.BslMultipleROIColumnsEnable.GetValue(),
+            cam.BslMultipleROIRowsEnable.GetValue(),
+        ]
+        if all(cam_info["crop_selection"]):
+            cam_info["crop_resolution"] = [
+                cam.BslMultipleROIColumnSize.GetValue(),
+                cam.BslMultipleROIRowSize.GetValue(),
+            ]
+            cam_info["crop_offset"] = [
+                cam.BslMultipleROIColumnOffset.GetValue(),
+                cam.BslMultipleROIRowOffset.GetValue(),
+            ]
+        else:
+            cam_info["crop_resolution"] = [cam.Width.GetValue(), cam.Height.GetValue()]
+            cam_info["crop_offset"] = [cam.OffsetX.GetValue(), cam.OffsetY.GetValue()]
+        # exposure of the calibration frames, refreshed on parameter changes
+        cam_info["ExposureTime"] = cam.ExposureTime.GetValue()
+        if self.preprocessing.functions != []:
+            cam_info["preprocessing"] = self.preprocessing.get_info(
+                cam_info["crop_resolution"]
+            )
+        return cam_info
@@ -0,0 +1,117 @@
+from pypylon import pylon
+from collections import deque
+from typing import Dict, Optional
+import time
+
+
+# stream grabber nodes (GigE transport layer), missing nodes are skipped
+STREAM_GRABBER_NODES = {
+    "total_buffers": "Statistic_Total_Buffer_Count",
+    "failed_buffers": "Statistic_Failed_Buffer_Count",
+    "buffer_underruns": "Statistic_Buffer_Underrun_Count",
+    "total_packets": "Statistic_Total_Packet_Count",
+    "failed_packets": "Statistic_Failed_Packet_Count",
+    "resend_requests": "Statistic_Resend_Request_Count",
+    "resend_packets": "Statistic_Resend_Packet_Count",
+}
+
+
+class CameraStatistics:
+    """
+    Transport and frame-loss counters of a single camera.
+    Counters are updated by the grab thread of the camera, snapshots are
+    read by the worker loop and published to the parent process.
+    """
+
+    def __init__(self, fps_window: int = 30):
+        self.frames = 0
+        self.failed_grabs = 0
+        self.retrieve_timeouts = 0
+        self.blockid_gaps = 0
+        self.frames_lost = 0
+        self.frames_dropped = 0
+        self.blockid_mismatches = 0
+        self.queue_depth = 0
+        self.queue_depth_max = 0
+        self.last_block_id = None
+        self.degraded = False
+        self.reconnections = 0
+        self.timestamps = deque(maxlen=fps_window)
+        self.time_start = time.monotonic()
+
+    def add_result(self, grabResult: pylon.GrabResult) -> None:
+        self.timestamps.append(time.monotonic())
+        if not grabResult.GrabSucceeded():
+            self.failed_grabs += 1
+            return
+        self.frames += 1
+
+        # BlockIDs are consecutive on the stream, a jump means lost frames
+        block_id = grabResult.GetBlockID()
+        if self.last_block_id is not None and block_id > self.last_block_id + 1:
+            self.blockid_gaps += 1
+            self.frames_lost += block_id - self.last_block_id - 1
+        self.last_block_id = block_id
+
+    def add_timeout(self) -> None:
+        self.retrieve_timeouts += 1
+
+    def set_degraded(self, degraded: bool) -> None:
+        if self.degraded and not degraded:
+            self.reconnections += 1
+        self.degraded = degraded
+
+    def reset_block_id(self) -> None:
+        self.last_block_id = None
+
+    def add_dropped(self) -> None:
+        self.frames_dropped += 1
+
+    def add_mismatch(self) -> None:
+        self.blockid_mismatches += 1
+
+    def set_queue_depth(self, depth: int) -> None:
+        self.queue_depth = depth
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def effective_fps(self) -> float:
+        if len(self.timestamps) < 2:
+            return 0.0
+        delta = self.timestamps[-1] - self.timestamps[0]
+        if delta <= 0:
+            return 0.0
+        return (len(self.timestamps) - 1) / delta
+
+    def stream_grabber_stats(self, cam: Optional[pylon.InstantCamera]) -> Dict:
+        stats = {}
+        if cam is None:
+            return stats
+        try:
+            nodemap = cam.GetStreamGrabberNodeMap()
+        except Exception:
+            return stats
+        for key, node_name in STREAM_GRABBER_NODES.items():
+            try:
+                stats[key] = int(nodemap.GetNode(node_name).GetValue())
+            except Exception:
+                pass
+        return stats
+
+    def snapshot(self, cam: Optional[pylon.InstantCamera] = None) -> Dict:
+        stats = {
+            "frames": self.frames,
+            "failed_grabs": self.failed_grabs,
+            "retrieve_timeouts": self.retrieve_timeouts,
+            "blockid_gaps": self.blockid_gaps,
+            "frames_lost": self.frames_lost,
+            "frames_dropped": self.frames_dropped,
+            "blockid_mismatches": self.blockid_mismatches,
+            "queue_depth": self.queue_depth,
+            "queue_depth_max": self.queue_depth_max,
+            "degraded": self.degraded,
+            "reconnections": self.reconnections,
+            "fps_effective": round(self.effective_fps(), 3),
+            "uptime": round(time.monotonic() - self.time_start, 3),
+        }
+        stats["stream_grabber"] = self.stream_grabber_stats(cam)
+        return stats
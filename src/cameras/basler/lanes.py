@@ -0,0 +1,149 @@
+import os
+import time
+import queue
+import multiprocessing as mp
+from logging import Logger
+from omegaconf import DictConfig
+from typing import Dict, List, Optional
+from circular_buffer import SharedCircularBuffer
+
+
+def split_devices(n_devices: int, cameras_per_process: int) -> List[List[int]]:
+    """
+    group camera indices in lanes of at most cameras_per_process cameras
+    """
+    if cameras_per_process < 1:
+        raise ValueError("cameras_per_process must be at least 1")
+    return [
+        list(range(i, min(i + cameras_per_process, n_devices)))
+        for i in range(0, n_devices, cameras_per_process)
+    ]
+
+
+def set_cpu_affinity(cores: Optional[List[int]], logger: Logger) -> None:
+    if cores is None:
+        return
+    try:
+        os.sched_setaffinity(0, set(cores))
+        logger.info(f"Process {os.getpid()} pinned to cores {list(cores)}")
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Cannot pin process {os.getpid()} to cores {cores}: {e}")
+
+
+class FrameSetAssembler:
+    """
+    Builds frame sets out of the lanes written by the per-camera grab processes.
+    Each lane sends (block_ids, image_metas, meta, preview_metas) with the images
+    already copied to shared memory, so the assembler only moves shm names into
+    the rings.
+    """
+
+    def __init__(self, logger: Logger, cfg: DictConfig, lane_queues: List[mp.Queue]):
+        self.logger = logger
+        self.cfg = cfg
+        self.lane_queues = lane_queues
+        self.blockid_mismatches = 0
+        self.framesets = 0
+
+    def __get_lane(self, lane_queue: mp.Queue, event_stop: mp.Event):
+        while not event_stop.is_set():
+            try:
+                return lane_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def __discard(self, lane, circular_buffer, preview_buffer) -> None:
+        circular_buffer.discard_metas(lane[1])
+        if lane[3] is not None:
+            preview_buffer.discard_metas(lane[3])
+
+    def __drain(self, circular_buffer: SharedCircularBuffer, preview_buffer) -> None:
+        for lane_queue in self.lane_queues:
+            while True:
+                try:
+                    lane = lane_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.__discard(lane, circular_buffer, preview_buffer)
+
+    def merge_meta(self, lanes: List) -> Dict:
+        metas = [lane[2] for lane in lanes]
+        merged = {"timestamp": min(meta["timestamp"] for meta in metas)}
+        for key in metas[0]:
+            if isinstance(metas[0][key], bool):
+                merged[key] = any(meta[key] for meta in metas)
+            elif isinstance(metas[0][key], list):
+                merged[key] = [v for meta in metas for v in meta[key]]
+        return merged
+
+    def publish_stats(self, stats: Dict) -> None:
+        stats["assembler"] = {
+            "framesets": self.framesets,
+            "blockid_mismatches": self.blockid_mismatches,
+            "lane_queue_depth": [q.qsize() for q in self.lane_queues],
+        }
+
+    def run(
+        self,
+        event_start: mp.Event,
+        event_stop: mp.Event,
+        event_reset_index: mp.Event,
+        circular_buffer: SharedCircularBuffer,
+        buffer_id: mp.Value,
+        lock: mp.Lock,
+        stats: Optional[Dict] = None,
+        preview_buffer: Optional[SharedCircularBuffer] = None,
+    ) -> None:
+
+        self.logger.info("Frame set assembler waiting to start grabbing...")
+        event_start.wait()
+
+        counter = 0
+        time_stats = time.monotonic()
+        while not event_stop.is_set():
+
+            if event_reset_index.is_set():
+                buffer_id.value = 0
+                counter = 0
+                event_reset_index.clear()
+
+            # one item per lane, lanes are ordered by camera index
+            lanes = [self.__get_lane(q, event_stop) for q in self.lane_queues]
+            if any(lane is None for lane in lanes):
+                for lane in lanes:
+                    if lane is not None:
+                        self.__discard(lane, circular_buffer, preview_buffer)
+                break
+
+            ids = [block_id for lane in lanes for block_id in lane[0]]
+            if len(set(ids)) > 1:
+                self.blockid_mismatches += 1
+                self.logger.warning(
+                    f"Grabbed images have different IDs: {ids}, possible synchronization issue, try to reduce fps"
+                )
+
+            image_metas = [meta for lane in lanes for meta in lane[1]]
+            id = counter % self.cfg.buffer_size
+            if preview_buffer is not None:
+                preview_metas = [meta for lane in lanes for meta in lane[3]]
+                preview_buffer.append_metas(preview_metas, counter)
+            circular_buffer.append_metas(image_metas, counter, self.merge_meta(lanes))
+            with lock:
+                buffer_id.value = id
+            counter += 1
+            self.framesets += 1
+
+            # publish statistics
+            if stats is not None:
+                if time.monotonic() - time_stats > self.cfg.stats.interval:
+                    self.publish_stats(stats)
+                    time_stats = time.monotonic()
+
+        self.__drain(circular_buffer, preview_buffer)
+        if stats is not None:
+            self.publish_stats(stats)
+        circular_buffer.close()
+        if preview_buffer is not None:
+            preview_buffer.close()
+        self.logger.info("Frame set assembler stopped...")
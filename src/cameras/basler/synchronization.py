@@ -2,7 +2,7 @@ from pypylon import pylon
 from tqdm import tqdm
 from logging import Logger
 import time
-from typing import Tuple
+from typing import List, Tuple
 
 
 def ip_to_hex(ip: str) -> int:
@@ -64,7 +64,8 @@ def synchronize_cameras(cams: pylon.InstantCameraArray, logger: Logger) -> bool:
         for i, cam in enumerate(cams):
             cam.PtpDataSetLatch.Execute()
             offsets[i] = cam.PtpOffsetFromMaster.Value
-        offset_max = max([o for o in offsets if o != 0])
+        # the master reads 0, a lone master has no slave offsets
+        offset_max = max((abs(o) for o in offsets if o != 0), default=0)
 
     assert check_synchronization(cams)
     return True
@@ -76,6 +77,24 @@ def synchronize_cameras(cams: pylon.InstantCameraArray, logger: Logger) -> bool:
     # return success
 
 
+def synchronize_devices(serials: List[str], logger: Logger) -> bool:
+    """
+    PTP setup and check of all the cameras at once, before the grab processes
+    open their own subsets; the cameras keep their PTP state once closed
+    """
+    tlf = pylon.TlFactory.GetInstance()
+    devices = {device.GetSerialNumber(): device for device in tlf.EnumerateDevices()}
+    cams = pylon.InstantCameraArray(len(serials))
+    for cam, sn in zip(cams, serials):
+        cam.Attach(tlf.CreateDevice(devices[sn]))
+    cams.Open()
+    try:
+        return synchronize_cameras(cams, logger)
+    finally:
+        cams.Close()
+        cams.DestroyDevice()
+
+
 def synchronize_camera(cam: pylon.InstantCamera) -> None:
     # cam.PtpEnable.Value = False
     cam.BslPtpPriority1.Value = 128
@@ -0,0 +1,315 @@
+import sys
+import time
+import cv2
+import numpy as np
+import multiprocessing as mp
+import omegaconf
+from pathlib import Path
+from logging import Logger
+from omegaconf import DictConfig
+from typing import Dict, List, Optional, Tuple
+from utils_ema.image import Image
+
+# local imports
+sys.path.append(Path(__file__).parents[2].as_posix())
+from camera_controller import CameraControllerAsync
+from circular_buffer import SharedCircularBuffer
+
+
+class CameraController(CameraControllerAsync):
+    """
+    Replays a session saved by the Collector through the shared ring,
+    at recorded timing, at a speed multiplier, or as fast as possible.
+    """
+
+    def __init__(self, logger: Logger, cfg: DictConfig):
+        self.cfg = cfg
+        self.logger = logger
+
+        # session content
+        session_dir = Path(self.cfg.session_dir)
+        self.img_paths, self.cam_names = self.load_paths(session_dir)
+        self.timestamps = self.load_timestamps(session_dir, len(self.img_paths[0]))
+        self.devices_info = self.load_devices_info(session_dir)
+        self.num_cameras = len(self.img_paths)
+
+        # shared ring, same layout as the live backends
+        self.circular_buffer = SharedCircularBuffer(
+            self.cfg.buffer_size, self.num_cameras
+        )
+        self.buffer_id = mp.Value("i", 0)
+        self.lock = mp.Lock()
+        self.manager = mp.Manager()
+        self.stats = self.manager.dict()
+
+        self.event_start_grabbing = mp.Event()
+        self.event_stop_grabbing = mp.Event()
+        self.event_reset_index = mp.Event()
+        self.event_end = mp.Event()
+
+        self.process = mp.Process(
+            target=self.init_worker,
+            daemon=True,
+            args=(
+                self.event_start_grabbing,
+                self.event_stop_grabbing,
+                self.event_reset_index,
+                self.circular_buffer,
+                self.buffer_id,
+                self.lock,
+                self.stats,
+                self.event_end,
+            ),
+        )
+        self.process.start()
+
+        self.logger.info(
+            f"Replay of {session_dir}: {self.num_cameras} cameras, {len(self.timestamps)} frame sets"
+        )
+
+    def load_paths(self, session_dir: Path) -> Tuple[List[List[Path]], List[str]]:
+        subdir = "raw" if self.cfg.raw else "postprocessed"
+        dir = session_dir / subdir
+        if not dir.exists():
+            error_msg = f"Cannot replay session, path {str(dir)} does not exist"
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        cam_paths = sorted(p for p in dir.iterdir() if p.is_dir())
+        img_paths = [sorted(cam_path.glob("*.png")) for cam_path in cam_paths]
+        if len(img_paths) == 0 or min(len(p) for p in img_paths) == 0:
+            error_msg = f"No images to replay in {str(dir)}"
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        # frame sets matched by file name, partial ones (a camera missing) are skipped
+        names = set.intersection(*[set(p.stem for p in paths) for paths in img_paths])
+        n_images = len(names)
+        if n_images == 0:
+            error_msg = f"No complete frame set to replay in {str(dir)}"
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
+        if n_images != max(len(p) for p in img_paths):
+            self.logger.warning(
+                f"Cameras have a different number of images, replaying {n_images} frame sets"
+            )
+        img_paths = [[p for p in paths if p.stem in names] for paths in img_paths]
+        return img_paths, [p.name for p in cam_paths]
+
+    def load_timestamps(self, session_dir: Path, n_images: int) -> List[float]:
+        path = session_dir / "metadata.yaml"
+        if path.exists():
+            frames = omegaconf.OmegaConf.load(path).frames
+            # frame sets indexed by their file names
+            timestamps = {
+                f.index: f.timestamp for f in frames if "timestamp" in f and "index" in f
+            }
+            indices = [int(p.stem) for p in self.img_paths[0] if p.stem.isdigit()]
+            if len(indices) == n_images and all(i in timestamps for i in indices):
+                return [timestamps[i] for i in indices]
+            self.logger.warning(f"Incomplete timestamps in {path}")
+
+        self.logger.info(f"No recorded timestamps, replaying at {self.cfg.fps} fps")
+        return [i / self.cfg.fps for i in range(n_images)]
+
+    def load_devices_info(self, session_dir: Path) -> Dict:
+        path = session_dir / "devices_info.yaml"
+        if not path.exists():
+            self.logger.warning(f"Devices info not found in {session_dir}")
+            return {cam_name: {} for cam_name in self.cam_names}
+        return omegaconf.OmegaConf.to_container(omegaconf.OmegaConf.load(path))
+
+    def init_worker(
+        self,
+        event_start_grabbing,
+        event_stop_grabbing,
+        event_reset_index,
+        circular_buffer,
+        buffer_id,
+        lock,
+        stats,
+        event_end,
+    ) -> None:
+        worker = ReplayWorker(self.logger, self.cfg, self.img_paths, self.timestamps)
+        worker.run(
+            event_start_grabbing,
+            event_stop_grabbing,
+            event_reset_index,
+            circular_buffer,
+            buffer_id,
+            lock,
+            stats,
+            event_end,
+        )
+
+    def start_grabbing(self) -> None:
+        self.event_stop_grabbing.clear()
+        self.event_start_grabbing.set()
+
+    def stop_grabbing(self) -> None:
+        self.event_start_grabbing.clear()
+        self.event_stop_grabbing.set()
+        self.process.join()
+
+    def close(self):
+        self.circular_buffer.close()
+        self.process.join()
+        self.manager.shutdown()
+
+    def end_of_stream(self) -> bool:
+        return self.event_end.is_set()
+
+    def reset_buffer_id(self):
+        self.buffer_id.value = 0
+        self.circular_buffer.reset_index()
+        self.event_reset_index.set()
+
+    def get_images(self) -> Tuple[List[Image], int]:
+        with self.lock:
+            id = self.buffer_id.value
+        images = self.circular_buffer.get_buffer(id)
+        if images is not None:
+            images = [Image(img) for img in images]
+        return images, id
+
+    def get_frame_id(self) -> Optional[int]:
+        with self.lock:
+            id = self.buffer_id.value
+        return self.circular_buffer.get_slot_id(id)
+
+    def get_frameset(
+        self, frame_id: Optional[int] = None
+    ) -> Tuple[Optional[List[Image]], Optional[int], Optional[Dict]]:
+        """
+        returns (images, frame_id, meta) of the latest frame set, or of frame_id if given
+        """
+        if frame_id is None:
+            with self.lock:
+                id = self.buffer_id.value
+        else:
+            id = frame_id % self.cfg.buffer_size
+        slot_id, images, meta = self.circular_buffer.get_slot(id)
+        if images is not None:
+            images = [Image(img) for img in images]
+        return images, slot_id, meta
+
+    def get_devices_info(self):
+        return self.devices_info
+
+    def get_stats(self) -> Dict:
+        return {k: v for k, v in self.stats.items()}
+
+
+class ReplayWorker:
+    def __init__(
+        self,
+        logger: Logger,
+        cfg: DictConfig,
+        img_paths: List[List[Path]],
+        timestamps: List[float],
+    ) -> None:
+        self.logger = logger
+        self.cfg = cfg
+        self.img_paths = img_paths
+        self.timestamps = timestamps
+        self.frames = 0
+        self.loops = 0
+        self.lag_max = 0.0
+
+    def read_images(self, i: int) -> List[np.ndarray]:
+        images = []
+        for cam_paths in self.img_paths:
+            img = cv2.imread(str(cam_paths[i]), cv2.IMREAD_UNCHANGED)
+            if img is None:
+                error_msg = f"Cannot read {str(cam_paths[i])}, session changed during replay"
+                self.logger.error(error_msg)
+                raise ValueError(error_msg)
+            # sessions are written by cv2, back to the RGB layout of the converter
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            images.append(img)
+        return images
+
+    def publish_stats(self, stats: Dict) -> None:
+        stats["replay"] = {
+            "frames": self.frames,
+            "loops": self.loops,
+            "lag_max": round(self.lag_max, 6),
+        }
+
+    def run(
+        self,
+        event_start: mp.Event,
+        event_stop: mp.Event,
+        event_reset_index: mp.Event,
+        circular_buffer: SharedCircularBuffer,
+        buffer_id: mp.Value,
+        lock: mp.Lock,
+        stats: Optional[Dict] = None,
+        event_end: Optional[mp.Event] = None,
+    ) -> None:
+        """
+        event_end is set after the last frame set when the session is not looped
+        """
+
+        self.logger.info("Replay worker waiting to start grabbing...")
+        event_start.wait()
+        self.logger.info("Replay worker started grabbing...")
+
+        n_images = len(self.timestamps)
+        counter = 0
+        i = 0
+        finished = False
+        time_stats = time.monotonic()
+        time_start = time.monotonic()
+        while not event_stop.is_set():
+
+            if event_reset_index.is_set():
+                buffer_id.value = 0
+                counter = 0
+                event_reset_index.clear()
+
+            # end of session
+            if i == n_images:
+                if not self.cfg.loop:
+                    if not finished:
+                        self.logger.info("Replay finished")
+                        finished = True
+                        if stats is not None:
+                            self.publish_stats(stats)
+                        if event_end is not None:
+                            event_end.set()
+                    time.sleep(0.01)
+                    continue
+                i = 0
+                self.loops += 1
+                time_start = time.monotonic()
+
+            # read first, then wait for the recorded time of the frame set
+            images = self.read_images(i)
+            if self.cfg.speed is not None:
+                delay = (self.timestamps[i] - self.timestamps[0]) / self.cfg.speed
+                wait = time_start + delay - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    self.lag_max = max(self.lag_max, -wait)
+
+            meta = {"timestamp": time.time(), "replay_index": i}
+            id = counter % self.cfg.buffer_size
+            circular_buffer.append(images, counter, meta)
+            with lock:
+                buffer_id.value = id
+            counter += 1
+            self.frames += 1
+            i += 1
+
+            if stats is not None:
+                if time.monotonic() - time_stats > self.cfg.stats.interval:
+                    self.publish_stats(stats)
+                    time_stats = time.monotonic()
+
+        if stats is not None:
+            self.publish_stats(stats)
+        circular_buffer.close()
+        self.logger.info("Replay worker stopped grabbing...")
@@ -1,6 +1,5 @@
 import numpy as np
 from multiprocessing import Manager, Value, Lock, shared_memory
-import time
 
 
 class SharedCircularBuffer:
@@ -21,7 +20,10 @@ class SharedCircularBuffer:
         with self.lock:
             self.index.value = 0
 
-    def _create_image_shm(self, image: np.ndarray):
+    def create_image_shm(self, image: np.ndarray):
+        # missing image (degraded camera)
+        if image is None:
+            return None
         shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
         shm_arr = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
         shm_arr[:] = image
@@ -31,6 +33,8 @@ class SharedCircularBuffer:
         if slot is None:
             return
         for img_meta in slot["images"]:
+            if img_meta is None:
+                continue
             try:
                 shm = shared_memory.SharedMemory(name=img_meta["shm_name"])
                 shm.close()
@@ -38,14 +42,24 @@ class SharedCircularBuffer:
             except FileNotFoundError:
                 pass
 
-    def append(self, images: list[np.ndarray], slot_id):
+    def append(self, images: list[np.ndarray], slot_id, meta: dict = None):
         """
         images: list of length K, variable resolutions allowed
         slot_id: timestamp or frame index
+        meta: frame set metadata (timestamps, block ids, ...)
         """
         assert len(images) == self.K, "Wrong number of images"
 
-        image_metas = [self._create_image_shm(img) for img in images]
+        image_metas = [self.create_image_shm(img) for img in images]
+        self.append_metas(image_metas, slot_id, meta)
+
+    def append_metas(self, image_metas: list[dict], slot_id, meta: dict = None):
+        """
+        image_metas: list of length K, shared memory already written by the producer
+        slot_id: timestamp or frame index
+        meta: frame set metadata (timestamps, block ids, ...)
+        """
+        assert len(image_metas) == self.K, "Wrong number of images"
 
         with self.lock:
             idx = self.index.value
@@ -54,23 +68,46 @@ class SharedCircularBuffer:
             self._cleanup_slot(self.buffer[idx])
 
             # store new slot
-            self.buffer[idx] = {"id": slot_id, "images": image_metas}
+            self.buffer[idx] = {"id": slot_id, "images": image_metas, "meta": meta}
 
             self.index.value = (idx + 1) % self.N
 
+    def discard_metas(self, image_metas: list[dict]):
+        """
+        release shared memory of images that never made it into a slot
+        """
+        self._cleanup_slot({"images": image_metas})
+
     def get_buffer(self, idx: int):
+        _, images, _ = self.get_slot(idx)
+        return images
+
+    def get_slot(self, idx: int):
+        """
+        returns (slot_id, images, meta) of slot idx, (None, None, None) if the slot is empty
+        """
         with self.lock:
             slot = self.buffer[idx]
             if slot is None:
-                return None
+                return None, None, None
             images = []
             for img_meta in slot["images"]:
+                if img_meta is None:
+                    images.append(None)
+                    continue
                 shm = shared_memory.SharedMemory(name=img_meta["shm_name"])
                 img = np.ndarray(
                     img_meta["shape"], dtype=img_meta["dtype"], buffer=shm.buf
                 )
                 images.append(img.copy())
-            return images
+            return slot["id"], images, slot["meta"]
+
+    def get_slot_id(self, idx: int):
+        with self.lock:
+            slot = self.buffer[idx]
+            if slot is None:
+                return None
+            return slot["id"]
 
     def close(self):
         with self.lock:
@@ -16,12 +16,19 @@ from utils_ema.image import Image
 from camera_controller import get_camera_controller
 from light_controller import get_light_controller
 from postprocessing import Postprocessing
+from exposure_controller import ExposureController
+from frame_cache import FrameCache
+from fusion import FrameFusion
+from quality import QualityGate
+from light_scheduler import LightScheduler, compile_light_plan
+from utils_image import image_to_numpy
 
 
 class Collector:
     def __init__(self, logger: Logger, cfg: DictConfig):
         self.logger = logger
         self.cfg = cfg
+        self.__check_replay_paths()
         self.light_controller = get_light_controller(cfg=self.cfg.lights, logger=logger)
         self.cam_controller = get_camera_controller(cfg=self.cfg.cameras, logger=logger)
         self.preprocessing = Postprocessing(cfg=DictConfig({"functions": None}))
@@ -32,6 +39,56 @@ class Collector:
         self.images = []
         self.images_preprocessed = []
         self.images_postprocessed = []
+        self.frames_meta = []
+        self.frame_meta = None
+
+        # processing stages, computed at most once per frame set
+        self.frame_cache = FrameCache(capacity=self.cfg.cameras.get("buffer_size", 1))
+        self.stages = {
+            "preprocessed": self.__stage_preprocessed,
+            "postprocessed": self.__stage_postprocessed,
+            "preview": self.__stage_preview,
+        }
+
+        # low-res preview stream of the camera controller, if any
+        self.preview = "preview" in self.cfg.cameras and self.cfg.cameras.preview.do
+
+        # closed-loop exposure
+        self.exposure_controller = None
+        if "auto_exposure" in self.cfg.cameras and self.cfg.cameras.auto_exposure.do:
+            self.exposure_controller = ExposureController(
+                logger, self.cfg.cameras, self.cam_controller
+            )
+
+        # several frame sets fused per capture event
+        self.fusion = None
+        if "fusion" in self.cfg and self.cfg.fusion.do:
+            self.fusion = FrameFusion(self.cfg.fusion)
+
+        # light timeline of the light sequence mode
+        self.light_scheduler = None
+
+        # sharpness and clipping scores of the captured frame sets
+        self.quality_gate = None
+        if "quality" in self.cfg and self.cfg.quality.do:
+            self.quality_gate = QualityGate(self.cfg.quality)
+
+    def __check_replay_paths(self):
+        """
+        the camera folders of save_dir are cleared before capturing,
+        a replayed session must not be among them
+        """
+        if self.cfg.cameras.sensor_type != "replay":
+            return
+        save_dir = Path(self.cfg.paths.save_dir).resolve()
+        session_dir = Path(self.cfg.cameras.session_dir).resolve()
+        if save_dir == session_dir or save_dir in session_dir.parents:
+            error_msg = (
+                f"Cannot replay {session_dir} into {save_dir}, "
+                "the session would be overwritten: set paths.save_dir elsewhere"
+            )
+            self.logger.error(error_msg)
+            raise ValueError(error_msg)
 
     # decorator that perform function multiple times
     def collect_function(func):
@@ -87,6 +144,17 @@ class Collector:
         images_preprocessed: Optional[List[Image]] = None,
         images_show: Optional[List[Image]] = None,
     ):
+        # partial frame set (degraded camera): saved without the missing
+        # cameras and flagged in the metadata, unless partial sets are dropped
+        missing = self.__missing_cameras()
+        if len(missing) > 0:
+            if self.cfg.save.drop_partial:
+                self.logger.warning(
+                    f"Frame set is partial, missing cameras {missing}: not collected"
+                )
+                return
+            self.logger.warning(f"Frame set is partial, missing cameras {missing}")
+
         if self.cfg.in_ram:
             self.images.append(images)
             if images_preprocessed is not None:
@@ -99,13 +167,22 @@ class Collector:
             if not os.path.exists(out_dir):
                 os.makedirs(out_dir)
 
-            self.__save(images, dir="raw", verbose=False)
+            self.__save(images, dir="raw", verbose=False, skip=missing)
 
             if images_preprocessed is not None:
-                self.__save(images_preprocessed, dir="preprocessed", verbose=False)
+                self.__save(
+                    images_preprocessed, dir="preprocessed", verbose=False, skip=missing
+                )
 
             if images_show is not None:
-                self.__save(images_show, dir="postprocessed", verbose=False)
+                self.__save(images_show, dir="postprocessed", verbose=False, skip=missing)
+
+        # frame set metadata, saved with the session
+        frame_meta = {} if self.frame_meta is None else dict(self.frame_meta)
+        frame_meta["index"] = self.__counter
+        frame_meta["partial"] = len(missing) > 0
+        frame_meta["missing"] = missing
+        self.frames_meta.append(frame_meta)
 
         self.__counter += 1
         print(f"Images captured (total: {self.__counter} per cam)")
@@ -114,52 +191,267 @@ class Collector:
         if self.callback_collect is not None:
             self.callback_collect()
 
+    def __missing_cameras(self) -> List[int]:
+        """
+        selected cameras missing from the current frame set, the ones not
+        selected may be degraded without affecting the capture
+        """
+        if self.frame_meta is None or not self.frame_meta.get("partial", False):
+            return []
+        return [i for i in self.frame_meta["missing"] if i in self.camera_ids]
+
+    def __capture_event(
+        self,
+        images: List[Image],
+        images_preprocessed: Optional[List[Image]] = None,
+        images_show: Optional[List[Image]] = None,
+    ):
+        if self.quality_gate is not None:
+            scored = self.__score_quality(images, images_preprocessed, images_show)
+            if scored is None:
+                return
+            images, images_preprocessed, images_show = scored
+
+        if self.fusion is None:
+            self.__collect(images, images_preprocessed, images_show)
+        else:
+            self.__collect_fused(images)
+
+    def __score_quality(self, images, images_preprocessed, images_show):
+        """
+        scores stored in the frame metadata; with quality.reject, failing frame
+        sets are retried on the next ones up to quality.retries times
+        """
+        for attempt in range(self.cfg.quality.retries + 1):
+            if attempt > 0:
+                images, images_preprocessed, images_show, _ = (
+                    self.get_images_with_preprocessing(show=False)
+                )
+                if images is None:
+                    return None
+            scores = self.quality_gate.score(images)
+            self.frame_meta = {} if self.frame_meta is None else dict(self.frame_meta)
+            self.frame_meta["quality"] = scores
+            if not self.cfg.quality.reject or self.quality_gate.accept(scores, self.camera_ids):
+                return images, images_preprocessed, images_show
+
+        self.logger.warning(f"Frame set rejected by quality gate: {scores}")
+        return None
+
+    def __collect_fused(self, images: List[Image]):
+        """
+        grab the frame sets of the fusion plan, starting from the current one
+        when averaging, and collect their fusion only
+        """
+        plan = self.fusion.exposure_plan()
+        devices_info = self.cam_controller.get_devices_info()
+        cam_names = ["cam_" + str(cam_id).zfill(3) for cam_id in self.camera_ids]
+        exposures_prev = [devices_info[name].get("ExposureTime") for name in cam_names]
+
+        frames = []
+        frame_ids = []
+        completed = False
+        self.fusion.clear()
+        try:
+            for k, exposure_time in enumerate(plan):
+                if exposure_time is not None:
+                    self.cam_controller.set_camera_params(
+                        cam_ids=self.camera_ids, exposure_time=exposure_time
+                    )
+                    # frames in flight still have the previous exposure
+                    for _ in range(self.cfg.fusion.settle_frames + 1):
+                        images = self.__grab_frameset(update_exposure=False)
+                elif k > 0:
+                    images = self.__grab_frameset(update_exposure=False)
+                if images is None:
+                    self.logger.warning("End of the camera stream: fusion aborted")
+                    return
+
+                missing = self.__missing_cameras()
+                if len(missing) > 0:
+                    self.logger.warning(
+                        f"Frame set is partial, missing cameras {missing}: fusion aborted"
+                    )
+                    return
+                self.fusion.add([image_to_numpy(img) for img in images], exposure_time)
+                frame_ids.append(self.previous_id)
+                if self.cfg.fusion.save_raw:
+                    frames.append(images)
+            completed = True
+        finally:
+            # aborted event, no partial sums left for the next one
+            if not completed:
+                self.fusion.clear()
+            # restore the exposures of the cameras
+            if plan[0] is not None:
+                for cam_id, exposure_time in zip(self.camera_ids, exposures_prev):
+                    if exposure_time is not None:
+                        self.cam_controller.set_camera_params(
+                            cam_ids=[cam_id], exposure_time=exposure_time
+                        )
+
+        for k, images_raw in enumerate(frames):
+            name = str(self.__counter).zfill(3) + f"_{k}"
+            self.__save(images_raw, dir="raw_frames", name=name)
+
+        fused = [Image(img) for img in self.fusion.result()]
+        self.fusion.clear()
+        fused_preprocessed = self.preprocessing.postprocess(fused, self.camera_ids)
+        fused_postprocessed = self.postprocessing.postprocess(
+            fused if fused_preprocessed is None else fused_preprocessed,
+            self.camera_ids,
+        )
+        self.frame_meta = {} if self.frame_meta is None else dict(self.frame_meta)
+        self.frame_meta["fusion"] = {
+            "mode": self.fusion.mode,
+            "frame_ids": frame_ids,
+            "exposures": [e for e in plan if e is not None],
+        }
+        self.__collect(fused, fused_preprocessed, fused_postprocessed)
+
     def __collect_init(self):
         self.images = []
         self.images_preprocessed = []
         self.images_postprocessed = []
+        self.frames_meta = []
         self.__counter = 0
-        self.previous_id = 0
+        self.previous_id = None
+        self.frame_cache.clear()
         self.cam_controller.reset_buffer_id()
+        devices_info = self.cam_controller.get_devices_info()
+        self.preprocessing.set_devices_info(devices_info)
+        self.postprocessing.set_devices_info(devices_info)
+        self.postprocessing.reset_results()
         os.makedirs(self.cfg.paths.save_dir, exist_ok=True)
 
-    def get_images_with_preprocessing(self, show):
-
+    def __grab_frameset(self, update_exposure: bool = True) -> Optional[List[Image]]:
+        """
+        wait for the next frame set of the selected cameras, None at the end
+        of a finite stream (replay)
+        """
         while True:
 
             # grab images and collect them
-            images, id = self.cam_controller.get_images()
-            if id == self.previous_id:
+            ended = self.cam_controller.end_of_stream()
+            images, id, meta = self.cam_controller.get_frameset()
+            if images is None or id == self.previous_id:
+                if ended:
+                    self.logger.info("End of the camera stream")
+                    return None
                 continue
             # filter images with camera ids
             images = [images[i] for i in self.camera_ids]
             self.previous_id = id
+            self.frame_meta = meta
+
+            # exposure correction for the next frames
+            if self.exposure_controller is not None and update_exposure:
+                self.exposure_controller.update(images, self.camera_ids)
+
+            # partial frame set (degraded camera), placeholders for missing images
+            if any(img is None for img in images):
+                images = [
+                    Image(torch.zeros(1, 1, 3)) if img is None else img
+                    for img in images
+                ]
+
+            self.frame_cache.put(id, "raw", images)
+            return images
+
+    def __frame_time(self) -> float:
+        """
+        timestamp of the last frame set on the monotonic clock of the scheduler,
+        the time it was read when the camera controller does not stamp frames
+        """
+        if self.frame_meta is None or "timestamp" not in self.frame_meta:
+            return time.monotonic()
+        return self.frame_meta["timestamp"] + time.monotonic() - time.time()
 
-            # preprocess
-            images_preprocessed = self.preprocessing.postprocess(images)
+    def get_images_with_preprocessing(self, show):
 
-            # postprocess
-            if images_preprocessed is not None:
-                images_postprocessed = self.postprocessing.postprocess(
-                    images_preprocessed
-                )
-            else:
-                images_postprocessed = self.postprocessing.postprocess(images)
+        while True:
+
+            images = self.__grab_frameset()
+            if images is None:
+                return None, None, None, None
+
+            # preprocess and postprocess, shared by preview, triggers and writers
+            images_preprocessed = self.get_stage("preprocessed")
+            images_postprocessed = self.get_stage("postprocessed")
 
             # show images
             key = None
             if show:
-                if images_postprocessed is not None:
-                    images_show = images_postprocessed
-                elif images_preprocessed is not None:
-                    images_show = images_preprocessed
-                else:
-                    images_show = images
-                key = Image.show_multiple_images(images_show, wk=1)
+                key = self.__show(images, images_preprocessed, images_postprocessed)
             break
 
         return images, images_preprocessed, images_postprocessed, key
 
+    def __show(self, images, images_preprocessed=None, images_postprocessed=None):
+        """
+        show the most processed images available, the preview if requested
+        """
+        images_preview = self.get_stage("preview")
+        if images_preview is not None and self.cfg.cameras.preview.show:
+            images_show = images_preview
+        elif images_postprocessed is not None:
+            images_show = images_postprocessed
+        elif images_preprocessed is not None:
+            images_show = images_preprocessed
+        else:
+            images_show = images
+        return Image.show_multiple_images(images_show, wk=1)
+
+    def get_stage(self, stage: str):
+        """
+        result of a processing stage on the current frame set, computed once
+        """
+        if stage not in self.stages and stage != "raw":
+            raise ValueError(f"Unknown processing stage {stage}")
+        return self.frame_cache.get(
+            self.previous_id, stage, lambda: self.stages[stage]()
+        )
+
+    def __stage_preprocessed(self):
+        images = self.get_stage("raw")
+        return self.preprocessing.postprocess(images, self.camera_ids)
+
+    def __stage_postprocessed(self):
+        images = self.get_stage("preprocessed")
+        if images is None:
+            images = self.get_stage("raw")
+        return self.postprocessing.postprocess(images, self.camera_ids)
+
+    def __stage_preview(self):
+        if not self.preview:
+            return None
+        images, _ = self.cam_controller.get_preview(self.previous_id)
+        if images is None:
+            return None
+        images = [images[i] for i in self.camera_ids]
+        return [
+            Image(torch.zeros(1, 1, 3)) if img is None else img for img in images
+        ]
+
+    def trigger_images(self, images):
+        """
+        low-res preview of the frame set when available
+        """
+        images_preview = self.get_stage("preview")
+        return images if images_preview is None else images_preview
+
+    def call_trigger(self, trigger, images) -> bool:
+        """
+        triggers are called as trigger(images); those with a set_camera_ids
+        method are told the selected cameras first, and those setting
+        use_preview get the low-res preview instead of the frame set
+        """
+        if hasattr(trigger, "set_camera_ids"):
+            trigger.set_camera_ids(self.camera_ids)
+        if getattr(trigger, "use_preview", False):
+            images = self.trigger_images(images)
+        return trigger(images)
+
     def preliminary_show(self, trigger=None) -> bool:
         if trigger == None:
             self.logger.info(
@@ -168,9 +460,11 @@ class Collector:
 
         while True:
             images, _, _, key = self.get_images_with_preprocessing(show=True)
+            if images is None:
+                return False
 
             if trigger is not None:
-                if trigger(images):
+                if self.call_trigger(trigger, images):
                     self.logger.info("Trigger condition met, exiting preliminary show.")
                     return True
                 elif key == ord("q"):
@@ -199,14 +493,13 @@ class Collector:
             images, images_preprocessed, images_postprocessed, key = (
                 self.get_images_with_preprocessing(show=True)
             )
-
-            # preprocess
-            images_preprocessed = self.preprocessing.postprocess(images)
+            if images is None:
+                break
 
             if key == ord("q"):
                 break
             if key == 32:
-                self.__collect(
+                self.__capture_event(
                     images,
                     images_preprocessed,
                     images_postprocessed,
@@ -216,6 +509,76 @@ class Collector:
 
         return True
 
+    @collect_function
+    def capture_light_sequence(self) -> bool:
+        """
+        play the light plan of the strategy and collect one frame set per step,
+        exposed once the step has settled, tagged with the lit channels
+        """
+        if self.light_controller is None:
+            raise ValueError("No light controller specified in the config file.")
+        cfg = self.collection_cfg.light_sequence
+        timeline = compile_light_plan(cfg)
+        self.light_scheduler = LightScheduler(
+            self.logger, self.light_controller, timeline, priority=cfg.priority
+        )
+
+        # show fake images
+        fake_imgs = [Image(torch.zeros(1, 1, 3)) for i in range(len(self.camera_ids))]
+        Image.show_multiple_images(fake_imgs, wk=1)
+
+        self.cam_controller.start_grabbing()
+        res = self.preliminary_show()
+        if not res:
+            return False
+
+        self.light_scheduler.start()
+        collected_step = -1
+        active_step = -1
+        while self.light_scheduler.is_running():
+            step, _ = self.light_scheduler.current_step()
+
+            # new step: exposure of its channel while the lights switch
+            if step >= 0 and step != active_step:
+                self.__set_light_channels(list(timeline.channels[step]))
+                active_step = step
+
+            images = self.__grab_frameset()
+            if images is None:
+                break
+
+            # frame set exposed within the settled part of a single step, the
+            # others are shown unprocessed so the stateful functions never see them
+            t_frame = self.__frame_time()
+            step = self.light_scheduler.frame_step(
+                t_frame - cfg.frame_delay_ms / 1000, t_frame, cfg.settle_ms / 1000
+            )
+            settled = step >= 0 and step != collected_step
+            if not settled:
+                if self.__show(images) == ord("q"):
+                    break
+                continue
+
+            # processing tagged with the channels lit in the step
+            channels = list(timeline.channels[step])
+            images_preprocessed = self.get_stage("preprocessed")
+            images_postprocessed = self.get_stage("postprocessed")
+            key = self.__show(images, images_preprocessed, images_postprocessed)
+            if key == ord("q"):
+                break
+
+            self.frame_meta = {} if self.frame_meta is None else dict(self.frame_meta)
+            self.frame_meta["light_step"] = step
+            self.frame_meta["light_channels"] = channels
+            self.__capture_event(images, images_preprocessed, images_postprocessed)
+            collected_step = step
+
+        self.light_scheduler.stop()
+        self.__lights_off()
+        self.logger.info(f"Light schedule statistics: {self.light_scheduler.get_stats()}")
+
+        return True
+
     @collect_function
     def capture_till_q(
         self,
@@ -257,17 +620,19 @@ class Collector:
             images, images_preprocessed, images_postprocessed, key = (
                 self.get_images_with_preprocessing(show=True)
             )
+            if images is None:
+                break
 
             # trigger capture
             if trigger_capture is None:
-                self.__collect(
+                self.__capture_event(
                     images,
                     images_preprocessed,
                     images_postprocessed,
                 )
             else:
-                if trigger_capture(images):
-                    self.__collect(
+                if self.call_trigger(trigger_capture, images):
+                    self.__capture_event(
                         images,
                         images_preprocessed,
                         images_postprocessed,
@@ -277,7 +642,7 @@ class Collector:
             if key == ord("q"):
                 break
             if trigger_exit is not None:
-                if trigger_exit(images):
+                if self.call_trigger(trigger_exit, images):
                     break
 
         self.__lights_off()
@@ -301,16 +666,23 @@ class Collector:
         if self.cfg.in_ram:
             os.makedirs(dir, exist_ok=True)
             for i in tqdm(range(len(self.images))):
-                self.__save(self.images[i], dir="raw", verbose=False)
+                missing = self.frames_meta[i]["missing"]
+                self.__save(self.images[i], dir="raw", verbose=False, skip=missing)
 
                 if self.images_preprocessed != []:
                     self.__save(
-                        self.images_preprocessed[i], dir="preprocessed", verbose=False
+                        self.images_preprocessed[i],
+                        dir="preprocessed",
+                        verbose=False,
+                        skip=missing,
                     )
 
                 if self.images_postprocessed != []:
                     self.__save(
-                        self.images_postprocessed[i], dir="postprocessed", verbose=False
+                        self.images_postprocessed[i],
+                        dir="postprocessed",
+                        verbose=False,
+                        skip=missing,
                     )
                 self.__counter += 1
         #
@@ -359,6 +731,39 @@ class Collector:
         #     rmtree(str(Path(self.cfg.paths.save_dir) / "raw"), ignore_errors=True)
         self.logger.info(f"Devices info saved in {self.cfg.paths.save_dir}")
 
+        # save processing timings
+        timings = {
+            "preprocessing": self.preprocessing.get_timings(),
+            "postprocessing": self.postprocessing.get_timings(),
+        }
+        with open(str(Path(self.cfg.paths.save_dir) / "processing_timings.yaml"), "w") as f:
+            omegaconf.OmegaConf.save(timings, f)
+
+        # save accumulated results (pixel statistics)
+        self.postprocessing.save_results(self.cfg.paths.save_dir)
+
+        # save frame sets metadata
+        with open(str(Path(self.cfg.paths.save_dir) / "metadata.yaml"), "w") as f:
+            omegaconf.OmegaConf.save({"frames": self.frames_meta}, f)
+
+        # save camera statistics
+        if hasattr(self.cam_controller, "get_stats"):
+            stats = self.cam_controller.get_stats()
+            with open(str(Path(self.cfg.paths.save_dir) / "camera_stats.yaml"), "w") as f:
+                omegaconf.OmegaConf.save(stats, f)
+            self.logger.info(f"Camera statistics saved in {self.cfg.paths.save_dir}")
+
+        # save light controller statistics
+        if self.light_controller is not None and hasattr(self.light_controller, "get_stats"):
+            stats = self.light_controller.get_stats()
+            with open(str(Path(self.cfg.paths.save_dir) / "light_stats.yaml"), "w") as f:
+                omegaconf.OmegaConf.save(stats, f)
+
+        # save light timeline jitter and latency
+        if self.light_scheduler is not None:
+            with open(str(Path(self.cfg.paths.save_dir) / "light_schedule.yaml"), "w") as f:
+                omegaconf.OmegaConf.save(self.light_scheduler.get_stats(), f)
+
         # save collection config
         if self.collection_cfg is not None:
             with open(
@@ -371,14 +776,28 @@ class Collector:
 
         return True
 
-    def __save(self, images: List[Image], dir: str, verbose: bool = False):
+    def __save(
+        self,
+        images: List[Image],
+        dir: str,
+        verbose: bool = False,
+        name: Optional[str] = None,
+        skip: Optional[List[int]] = None,
+    ):
+        """
+        skip: ids of the cameras missing from a partial frame set, not written
+        """
         subdir = dir
-        img_name = str(self.__counter).zfill(3) + ".png"
+        if name is None:
+            name = str(self.__counter).zfill(3)
+        img_name = name + ".png"
         if images is not None:
             # for cam_id in range(len(images)):
             processes = []
             for i in range(len(self.camera_ids)):
                 cam_id = self.camera_ids[i]
+                if skip is not None and cam_id in skip:
+                    continue
                 cam_name = "cam_" + str(cam_id).zfill(3)
                 image = images[i]
                 # image.set_type(torch.float32)
@@ -394,6 +813,17 @@ class Collector:
             self.light_controller.leds_off()
             for channel in self.cfg.lights.channels:
                 self.light_controller.led_on(channel)
+            self.__set_light_channels(list(self.cfg.lights.channels))
+
+    def __set_light_channels(self, channels: List[int]):
+        """
+        channels lit for the next frame sets: tag for the per-channel
+        statistics and exposure/gain of the channel, single channels only
+        """
+        channel = channels[0] if len(channels) == 1 else None
+        self.postprocessing.set_light_channel(channel)
+        if self.exposure_controller is not None:
+            self.exposure_controller.set_channel(channel)
 
     def __lights_off(self):
         if self.light_controller is not None:
@@ -401,6 +831,8 @@ class Collector:
 
     def close(self):
         self.cam_controller.close()
+        if self.light_controller is not None and hasattr(self.light_controller, "close"):
+            self.light_controller.close()
 
 
 class CollectorLoader:
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+import omegaconf
+from pathlib import Path
+
+
+class ColorCorrectionLUT:
+    """
+    Per-camera color correction as lookup tables on uint8 RGB data.
+
+    Calibration of camera <serial>, in calibration_dir:
+        <serial>.npy: 3D LUT (N, N, N, 3) uint8 indexed by (r, g, b), any N >= 2
+        <serial>.cube: 3D LUT in the Adobe/Resolve text format (17, 33, 65 points...)
+        <serial>.yaml: matrix (3x3, rgb_out = matrix @ rgb_in) and optional offset (3)
+    3D LUTs are trilinearly interpolated once, at load time, to a full 256^3
+    table (48 MB per camera), so applying them is a single gather.
+    A diagonal matrix is baked in per-channel 1D LUTs, a full matrix in nine
+    1D integer LUTs summed per output channel.
+    """
+
+    # fixed-point fraction bits of the matrix LUTs
+    shift = 4
+
+    def __init__(self, calibration_dir: str):
+        self.calibration_dir = Path(calibration_dir)
+        self.luts = {}
+
+    def get(self, serial: str):
+        if serial not in self.luts:
+            self.luts[serial] = self.build(serial)
+        return self.luts[serial]
+
+    @staticmethod
+    def load_cube(path: Path) -> np.ndarray:
+        """
+        .cube 3D LUT as (N, N, N, 3) indexed by (r, g, b), values in [0, 255]
+        """
+        n = None
+        rows = []
+        for line in path.read_text().splitlines():
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            if line.startswith("LUT_3D_SIZE"):
+                n = int(line.split()[1])
+            elif line[0].isdigit() or line[0] in "-.":
+                rows.append([float(v) for v in line.split()[:3]])
+        if n is None or len(rows) != n**3:
+            raise ValueError(f"3D LUT {path} is not a valid .cube file")
+        # red varies fastest in the file
+        lut = np.array(rows).reshape(n, n, n, 3).transpose(2, 1, 0, 3)
+        return lut * 255
+
+    @staticmethod
+    def interpolation_weights(n: int) -> np.ndarray:
+        """
+        (256, n) linear interpolation weights of the 8-bit values on n grid points
+        """
+        pos = np.arange(256) * (n - 1) / 255
+        i0 = np.minimum(np.floor(pos).astype(np.int64), n - 2)
+        f = pos - i0
+        w = np.zeros((256, n))
+        w[np.arange(256), i0] = 1 - f
+        w[np.arange(256), i0 + 1] = f
+        return w
+
+    def expand_lut3d(self, lut: np.ndarray) -> np.ndarray:
+        """
+        (N, N, N, 3) LUT to the (256^3, 3) uint8 table, trilinear interpolation
+        being separable in three weighted sums along r, g and b
+        """
+        w = self.interpolation_weights(lut.shape[0]).astype(np.float32)
+        lut = lut.astype(np.float32)
+        lut = np.einsum("cl,ijlk->ijck", w, lut, optimize=True)
+        lut = np.einsum("bj,ijck->ibck", w, lut, optimize=True)
+        table = np.empty((256, 256, 256, 3), dtype=np.uint8)
+        for a in range(0, 256, 16):
+            chunk = np.tensordot(w[a : a + 16], lut, axes=(1, 0))
+            np.clip(np.rint(chunk), 0, 255, out=chunk)
+            table[a : a + 16] = chunk
+        return table.reshape(-1, 3)
+
+    def build(self, serial: str):
+        lut = None
+        path_lut = self.calibration_dir / f"{serial}.npy"
+        path_cube = self.calibration_dir / f"{serial}.cube"
+        if path_lut.exists():
+            lut = np.load(path_lut)
+        elif path_cube.exists():
+            path_lut = path_cube
+            lut = self.load_cube(path_cube)
+        if lut is not None:
+            n = lut.shape[0]
+            if lut.shape != (n, n, n, 3) or not 2 <= n <= 256:
+                raise ValueError(f"3D LUT {path_lut} must be (N, N, N, 3), 2 <= N <= 256")
+            return ("lut3d", self.expand_lut3d(lut))
+
+        path = self.calibration_dir / f"{serial}.yaml"
+        if not path.exists():
+            raise FileNotFoundError(f"Color calibration of camera {serial} not found in {self.calibration_dir}")
+        data = omegaconf.OmegaConf.load(path)
+        matrix = np.array(data.matrix, dtype=np.float64).reshape(3, 3)
+        offset = np.zeros(3) if "offset" not in data else np.array(data.offset, dtype=np.float64)
+        values = np.arange(256, dtype=np.float64)
+
+        # white balance: one 1D LUT per channel
+        if np.count_nonzero(matrix - np.diag(np.diag(matrix))) == 0:
+            lut = np.stack([values * matrix[c, c] + offset[c] for c in range(3)], axis=-1)
+            lut = np.clip(np.rint(lut), 0, 255).astype(np.uint8)
+            return ("lut1d", lut.reshape(1, 256, 3))
+
+        # full matrix: luts[i, j, v] = matrix[i, j] * v in fixed point
+        scale = 1 << self.shift
+        luts = np.rint(matrix[:, :, None] * values[None, None, :] * scale).astype(np.int32)
+        luts[:, 0, :] += np.rint(offset * scale).astype(np.int32)[:, None]
+        return ("matrix", luts)
+
+    def apply(self, img: np.ndarray, serial: str) -> np.ndarray:
+        if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3:
+            raise ValueError("Color correction needs uint8 RGB images")
+        lut = self.get(serial)
+
+        if lut[0] == "lut1d":
+            return cv2.LUT(img, lut[1])
+
+        if lut[0] == "lut3d":
+            idx = img[..., 0].astype(np.int32) << 16
+            idx |= img[..., 1].astype(np.int32) << 8
+            idx |= img[..., 2]
+            return lut[1][idx]
+
+        luts = lut[1]
+        out = np.empty_like(img)
+        acc = np.empty(img.shape[:2], dtype=np.int32)
+        for i in range(3):
+            np.take(luts[i, 0], img[..., 0], out=acc)
+            acc += luts[i, 1][img[..., 1]]
+            acc += luts[i, 2][img[..., 2]]
+            acc >>= self.shift
+            np.clip(acc, 0, 255, out=acc)
+            out[..., i] = acc
+        return out
@@ -0,0 +1,141 @@
+import math
+import numpy as np
+from logging import Logger
+from omegaconf import DictConfig
+from typing import Dict, List, Optional
+from utils_image import image_to_numpy, to_uint8
+
+# smallest correction ratio of a single update
+MIN_RATIO = 0.05
+
+
+def luminance_histogram(img: np.ndarray, stride: int) -> np.ndarray:
+    """
+    256 bins histogram of the luminance of a strided pixel subset.
+    RGB luminance is approximated with (R + 2G + B) / 4 in integer math.
+    """
+    sub = to_uint8(img[::stride, ::stride])
+    if sub.ndim == 3 and sub.shape[2] >= 3:
+        sub = sub.astype(np.uint16)
+        lum = (sub[..., 0] + 2 * sub[..., 1] + sub[..., 2]) >> 2
+    elif sub.ndim == 3:
+        lum = sub[..., 0]
+    else:
+        lum = sub
+    return np.bincount(lum.ravel(), minlength=256)[:256]
+
+
+class ExposureController:
+    """
+    Closed-loop exposure and gain control.
+    Each frame set, a luminance histogram is computed per camera on a
+    subsample, and exposure (then gain, once exposure is at its limit) is
+    corrected towards the target mean luminance.
+    """
+
+    def __init__(self, logger: Logger, cfg: DictConfig, cam_controller) -> None:
+        self.logger = logger
+        self.cfg = cfg.auto_exposure
+        self.cam_controller = cam_controller
+        self.channel = None
+
+        n = cam_controller.num_cameras
+        self.exposure = [float(cfg.exposure_time)] * n
+        self.gain = [float(cfg.gain)] * n
+        self.frames_since_update = [self.cfg.settle_frames] * n
+
+        # converged values per light channel, initialized from presets
+        self.channel_params = {}
+        if self.cfg.presets is not None:
+            for channel, preset in self.cfg.presets.items():
+                self.channel_params[int(channel)] = [
+                    dict(preset) for _ in range(n)
+                ]
+
+    def set_channel(self, channel: Optional[int]) -> None:
+        """
+        switch light channel, cameras jump to the known parameters of the channel
+        """
+        if channel == self.channel:
+            return
+
+        # remember where the previous channel converged
+        if self.channel is not None:
+            self.channel_params[self.channel] = [
+                {"exposure_time": e, "gain": g} for e, g in zip(self.exposure, self.gain)
+            ]
+
+        self.channel = channel
+        if channel not in self.channel_params:
+            return
+        # presets may set only one of the two, the other stays as it is
+        for cam_id, params in enumerate(self.channel_params[channel]):
+            exposure = params.get("exposure_time", self.exposure[cam_id])
+            gain = params.get("gain", self.gain[cam_id])
+            self.__apply(cam_id, float(exposure), float(gain))
+
+    def analyze(self, img: np.ndarray) -> Dict:
+        hist = luminance_histogram(img, self.cfg.stride)
+        n = hist.sum()
+        mean = float(np.dot(hist, np.arange(256))) / max(n, 1)
+        return {"mean": mean / 255, "clipped": float(hist[-1]) / max(n, 1)}
+
+    def update(self, images: List, cam_ids: List[int]) -> Dict:
+        """
+        images: frame set filtered by cam_ids, returns the analysis per camera
+        """
+        analysis = {}
+        for img, cam_id in zip(images, cam_ids):
+            self.frames_since_update[cam_id] += 1
+            if img is None or self.frames_since_update[cam_id] < self.cfg.settle_frames:
+                continue
+
+            res = self.analyze(image_to_numpy(img))
+            analysis[cam_id] = res
+
+            # correction ratio, saturated frames are always pulled down,
+            # at most by the floor when the whole frame is blown out
+            ratio = self.cfg.target / max(res["mean"], 1e-3)
+            if res["clipped"] > self.cfg.max_clipped:
+                ratio = min(ratio, max(1 - res["clipped"], MIN_RATIO))
+            elif abs(ratio - 1) < self.cfg.tolerance:
+                continue
+            ratio = ratio**self.cfg.damping
+
+            exposure, gain = self.__split_ratio(cam_id, ratio)
+            self.__apply(cam_id, exposure, gain)
+        return analysis
+
+    def __split_ratio(self, cam_id: int, ratio: float):
+        """
+        exposure first, gain (dB) for what exposure cannot cover
+        """
+        exp_min, exp_max = self.cfg.exposure_range
+        gain_min, gain_max = self.cfg.gain_range
+        exposure = self.exposure[cam_id]
+        gain = self.gain[cam_id]
+
+        # brighter: exposure up to its max, then gain
+        # darker: gain down to its min, then exposure
+        if ratio > 1:
+            new_exposure = min(exposure * ratio, exp_max)
+            rest = ratio * exposure / new_exposure
+            new_gain = min(gain + 20 * math.log10(rest), gain_max)
+        else:
+            new_gain = max(gain + 20 * math.log10(ratio), gain_min)
+            rest = ratio / 10 ** ((new_gain - gain) / 20)
+            new_exposure = max(exposure * rest, exp_min)
+        return new_exposure, new_gain
+
+    def __apply(self, cam_id: int, exposure: float, gain: float) -> None:
+        params = {}
+        if exposure != self.exposure[cam_id]:
+            params["exposure_time"] = exposure
+        if gain != self.gain[cam_id]:
+            params["gain"] = gain
+        if len(params) == 0:
+            return
+        self.exposure[cam_id] = exposure
+        self.gain[cam_id] = gain
+        self.frames_since_update[cam_id] = 0
+        self.cam_controller.set_camera_params(cam_ids=[cam_id], wait=False, **params)
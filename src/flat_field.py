@@ -0,0 +1,196 @@
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from preprocessing import bin_image
+
+
+class FlatFieldCorrection:
+    """
+    Dark-frame subtraction and flat-field gain on uint8/uint16 images, in
+    fixed-point integer math.
+
+    Master frames of camera <serial> with sensor ROI <w>x<h> at (<x>, <y>), in
+    calibration_dir/<serial>/<w>x<h>_<x>_<y>/:
+        dark_<exposure_us>.npy: master dark frames, the closest exposure is used
+        flat.npy: master flat frame, dark already subtracted
+    Frames are memory-mapped read-only, so several processes share the pages.
+    Gain maps are computed once and cached in cache_dir, memory-mapped as well.
+    With worker preprocessing, maps are cropped and binned like the images,
+    and cached and memory-mapped the same way.
+    """
+
+    # fixed-point fraction bits of the gain maps (max gain 16)
+    shift = 12
+
+    def __init__(self, calibration_dir: str, cache_dir: str):
+        self.calibration_dir = Path(calibration_dir)
+        self.cache_dir = Path(cache_dir)
+        self.darks: Dict[Path, Dict[float, np.ndarray]] = {}
+        self.gains: Dict[Path, Optional[np.ndarray]] = {}
+        self.reduced: Dict[Path, np.ndarray] = {}
+        # maps are loaded and cached by the per-camera postprocessing threads
+        self.lock = threading.Lock()
+        # integer accumulators of apply, one per image shape and thread
+        self.scratch = threading.local()
+
+    def frames_dir(self, serial: str, crop_offset, crop_resolution) -> Path:
+        w, h = crop_resolution
+        x, y = crop_offset
+        path = self.calibration_dir / serial / f"{w}x{h}_{x}_{y}"
+        if not path.exists():
+            raise FileNotFoundError(f"Flat-field calibration of camera {serial} not found: {path}")
+        return path
+
+    def get_dark(self, path: Path, exposure_time: float) -> Optional[np.ndarray]:
+        path_dark = self.dark_path(path, exposure_time)
+        return None if path_dark is None else self.darks[path][path_dark]
+
+    def dark_path(self, path: Path, exposure_time: float) -> Optional[Path]:
+        """
+        file of the master dark with the closest exposure
+        """
+        with self.lock:
+            if path not in self.darks:
+                self.darks[path] = {
+                    p: np.load(p, mmap_mode="r") for p in path.glob("dark_*.npy")
+                }
+            darks = self.darks[path]
+        if len(darks) == 0:
+            return None
+        return min(darks, key=lambda p: abs(float(p.stem[len("dark_") :]) - exposure_time))
+
+    def cache_path(self, prefix: str, path: Path) -> Path:
+        return self.cache_dir / (
+            prefix + "_".join(path.relative_to(self.calibration_dir).parts) + ".npy"
+        )
+
+    def save_cached(self, path: Path, m: np.ndarray) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # written aside and renamed, readers never map a partial file
+        path_tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+        np.save(path_tmp, m)
+        os.replace(path_tmp, path)
+
+    def get_gain(self, path: Path) -> Optional[np.ndarray]:
+        with self.lock:
+            return self.__get_gain(path)
+
+    def __get_gain(self, path: Path) -> Optional[np.ndarray]:
+        if path in self.gains:
+            return self.gains[path]
+        path_flat = path / "flat.npy"
+        if not path_flat.exists():
+            self.gains[path] = None
+            return None
+
+        path_gain = self.gain_path(path)
+        if not path_gain.exists() or path_gain.stat().st_mtime < path_flat.stat().st_mtime:
+            # gain = mean(flat) / flat, in fixed point
+            flat = np.load(path_flat, mmap_mode="r").astype(np.float64)
+            flat = np.maximum(flat, 1e-6)
+            gain = np.rint(flat.mean() / flat * (1 << self.shift))
+            gain = np.clip(gain, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+            self.save_cached(path_gain, gain)
+        self.gains[path] = np.load(path_gain, mmap_mode="r")
+        return self.gains[path]
+
+    def gain_path(self, path: Path) -> Path:
+        return self.cache_path("flatfield_", path)
+
+    def reduce(
+        self, m: Optional[np.ndarray], source: Path, preprocessing: Dict
+    ) -> Optional[np.ndarray]:
+        """
+        map of the sensor ROI (loaded from source) reduced to the region and
+        scale kept by the worker preprocessing (devices info "preprocessing")
+        """
+        if m is None:
+            return None
+        x, y = [int(round(v)) for v in preprocessing["offset"]]
+        w, h = [int(round(v)) for v in preprocessing["resolution"]]
+        factor = int(round(1 / preprocessing["scale"]))
+        if source.is_relative_to(self.calibration_dir):
+            path = self.cache_path("reduced_", source.with_suffix(""))
+        else:
+            path = self.cache_dir / f"reduced_{source.stem}.npy"
+        path = path.with_name(f"{path.stem}_{w}x{h}_{x}_{y}_bin{factor}.npy")
+        with self.lock:
+            if path not in self.reduced:
+                if not path.exists() or path.stat().st_mtime < source.stat().st_mtime:
+                    r = np.asarray(m[y : y + h, x : x + w], dtype=np.float32)
+                    if factor > 1:
+                        r = bin_image(r, factor)
+                    if np.issubdtype(m.dtype, np.integer):
+                        r = np.rint(r).astype(m.dtype)
+                    self.save_cached(path, r)
+                self.reduced[path] = np.load(path, mmap_mode="r")
+            return self.reduced[path]
+
+    def get(
+        self,
+        serial: str,
+        crop_offset: Tuple[int, int],
+        crop_resolution: Tuple[int, int],
+        exposure_time: float,
+        preprocessing: Optional[Dict] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        (dark, gain) maps of a camera, None when missing
+        """
+        path = self.frames_dir(serial, crop_offset, crop_resolution)
+        dark, gain = self.get_dark(path, exposure_time), self.get_gain(path)
+        if preprocessing is None:
+            return dark, gain
+        path_dark = self.dark_path(path, exposure_time)
+        return (
+            self.reduce(dark, path_dark, preprocessing),
+            self.reduce(gain, self.gain_path(path), preprocessing),
+        )
+
+    def apply(
+        self,
+        img: np.ndarray,
+        dark: Optional[np.ndarray],
+        gain: Optional[np.ndarray],
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        corrected image written in out (img itself for an in-place correction),
+        a new array if None
+        """
+        if img.dtype not in [np.uint8, np.uint16]:
+            raise ValueError("Flat-field correction needs uint8 or uint16 images")
+        for m in [dark, gain]:
+            if m is not None and m.shape[:2] != img.shape[:2]:
+                raise ValueError(f"Calibration frame {m.shape} does not match image {img.shape}")
+
+        # single-channel maps on color images
+        if dark is not None and dark.ndim < img.ndim:
+            dark = dark[..., None]
+        if gain is not None and gain.ndim < img.ndim:
+            gain = gain[..., None]
+
+        # uint16 * q12 gain overflows int32
+        acc = self.__scratch(img.shape, np.int32 if img.dtype == np.uint8 else np.int64)
+        np.copyto(acc, img)
+        if dark is not None:
+            # master darks may be float means
+            np.subtract(acc, dark, out=acc, casting="unsafe")
+            np.maximum(acc, 0, out=acc)
+        if gain is not None:
+            np.multiply(acc, gain, out=acc, casting="unsafe")
+            np.right_shift(acc, self.shift, out=acc)
+        np.minimum(acc, np.iinfo(img.dtype).max, out=acc)
+        if out is None:
+            out = np.empty_like(img)
+        np.copyto(out, acc, casting="unsafe")
+        return out
+
+    def __scratch(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        buffers = self.scratch.__dict__.setdefault("buffers", {})
+        key = (shape, np.dtype(dtype))
+        if key not in buffers:
+            buffers[key] = np.empty(shape, dtype=dtype)
+        return buffers[key]
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class FrameCache:
+    """
+    Results of the processing stages of the frame sets, keyed by frame id.
+    Each stage is computed at most once per frame set and shared by all the
+    consumers (preview, triggers, writers). Entries are evicted once their
+    frame set has left the ring.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, frame_id: int, stage: str, compute: Optional[Callable] = None) -> Any:
+        """
+        result of stage for frame_id, computed with compute() if missing
+        """
+        entry = self.entries.get(frame_id)
+        if entry is not None and stage in entry:
+            self.hits += 1
+            return entry[stage]
+        if compute is None:
+            raise KeyError(f"Stage {stage} not cached for frame {frame_id}")
+        self.misses += 1
+        result = compute()
+        self.put(frame_id, stage, result)
+        return result
+
+    def put(self, frame_id: int, stage: str, result: Any) -> None:
+        if frame_id not in self.entries:
+            self.evict(frame_id)
+            self.entries[frame_id] = {}
+        self.entries[frame_id][stage] = result
+
+    def contains(self, frame_id: int, stage: str) -> bool:
+        return frame_id in self.entries and stage in self.entries[frame_id]
+
+    def evict(self, latest_id: int) -> None:
+        """
+        drop the frame sets overwritten in the ring, and everything after an index reset
+        """
+        for frame_id in list(self.entries.keys()):
+            if frame_id <= latest_id - self.capacity or frame_id > latest_id:
+                del self.entries[frame_id]
+
+    def clear(self) -> None:
+        self.entries.clear()
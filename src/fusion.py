@@ -0,0 +1,98 @@
+import numpy as np
+from omegaconf import DictConfig
+from typing import List, Optional
+
+
+class FrameFusion:
+    """
+    Fusion of the frame sets of a capture event, in preallocated per-camera
+    accumulators:
+        average: running mean of K frames, same dtype as the input
+        hdr: merge of K exposures weighted by a hat function of the pixel value,
+             radiance in units of the shortest exposure; uint8 inputs give
+             uint16 outputs with 8 extra fraction bits, others float32
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.cfg = cfg
+        self.mode = cfg.mode.val
+        if self.mode not in cfg.mode.valid_options:
+            raise ValueError(f"Fusion mode {self.mode} not in {cfg.mode.valid_options}")
+        self.acc = []
+        self.weights = []
+        self.scratch = []
+        self.count = 0
+        self.exposures = []
+        self.dtype = None
+
+    def exposure_plan(self) -> List[Optional[float]]:
+        """
+        exposure time of each frame set of an event, None keeps the current one
+        """
+        if self.mode == "average":
+            return [None] * self.cfg.frames
+        return list(self.cfg.exposures)
+
+    def reset(self, images: List[np.ndarray]) -> None:
+        # reallocate only when the resolutions change
+        shapes = [img.shape for img in images]
+        if shapes != [a.shape for a in self.acc]:
+            self.acc = [np.zeros(s, dtype=np.float32) for s in shapes]
+            self.weights = [np.zeros(s, dtype=np.float32) for s in shapes]
+            self.scratch = [np.zeros(s, dtype=np.float32) for s in shapes]
+        else:
+            for a, w in zip(self.acc, self.weights):
+                a.fill(0)
+                w.fill(0)
+        self.count = 0
+        self.exposures = []
+        self.dtype = images[0].dtype
+
+    def clear(self) -> None:
+        """
+        drop the frames added so far, the next add starts a new event
+        """
+        self.count = 0
+        self.exposures = []
+
+    def add(self, images: List[np.ndarray], exposure_time: Optional[float] = None) -> None:
+        if self.count == 0:
+            self.reset(images)
+        self.count += 1
+        self.exposures.append(exposure_time)
+
+        if self.mode == "average":
+            for acc, img in zip(self.acc, images):
+                np.add(acc, img, out=acc)
+            return
+
+        dtype = images[0].dtype
+        z_max = float(np.iinfo(dtype).max) if np.issubdtype(dtype, np.integer) else 1.0
+        for acc, wsum, w, img in zip(self.acc, self.weights, self.scratch, images):
+            # hat weights, small floor so saturated-everywhere pixels stay defined
+            np.subtract(z_max, img, out=w)
+            np.minimum(w, img, out=w)
+            w *= 2 / z_max
+            w += 1e-3
+            wsum += w
+            # radiance estimate z / t
+            w *= img
+            w *= 1 / exposure_time
+            acc += w
+
+    def result(self) -> List[np.ndarray]:
+        if self.count == 0:
+            raise ValueError("No frames added to the fusion")
+        results = []
+        for acc, wsum in zip(self.acc, self.weights):
+            if self.mode == "average":
+                out = acc / self.count
+                if np.issubdtype(self.dtype, np.integer):
+                    out = np.rint(out).astype(self.dtype)
+            else:
+                out = acc / wsum
+                out *= min(self.exposures)
+                if self.dtype == np.uint8:
+                    out = np.clip(np.rint(out * 256), 0, 65535).astype(np.uint16)
+            results.append(out)
+        return results
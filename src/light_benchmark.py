@@ -0,0 +1,111 @@
+import os
+import random
+import time
+import hydra
+import numpy as np
+import omegaconf
+from pathlib import Path
+from logging import Logger
+from omegaconf import DictConfig, OmegaConf
+from utils_ema.log import get_logger_default
+from light_controller import get_light_controller
+
+
+def summary(values_ms) -> dict:
+    values_ms = np.array(values_ms, dtype=np.float64)
+    if values_ms.size == 0:
+        return {}
+    return {
+        "mean": round(float(values_ms.mean()), 3),
+        "p50": round(float(np.percentile(values_ms, 50)), 3),
+        "p99": round(float(np.percentile(values_ms, 99)), 3),
+        "max": round(float(values_ms.max()), 3),
+    }
+
+
+def run(cfg: DictConfig, logger: Logger) -> dict:
+    """
+    switch a single random channel on, a different one each time, switches
+    times, and measure the call latency and, with a simulator, the latency
+    until the output switched
+    """
+    lc = get_light_controller(cfg=cfg.lights, logger=logger)
+    if lc is None:
+        raise ValueError("No light controller specified in the config file.")
+    switches = cfg.get("switches", 500)
+    # minimum time between switches, 0 for as fast as the controller accepts them
+    interval = cfg.get("interval_ms", 0.0) / 1000
+    simulator = lc.simulator
+
+    calls = []
+    issued = []
+    channels = []
+    channel = None
+    time_start = time.monotonic()
+    for k in range(switches):
+        while time.monotonic() < time_start + k * interval:
+            pass
+        # always a change, the same channel again would not be seen on the output
+        channel = random.choice([c for c in range(lc.num_leds()) if c != channel])
+        t = time.monotonic()
+        lc.set_channels([channel])
+        if hasattr(lc, "sync"):
+            lc.sync(timeout=1.0)
+        calls.append(1000 * (time.monotonic() - t))
+        issued.append(t)
+        channels.append(channel)
+    elapsed = time.monotonic() - time_start
+    lc.leds_off()
+
+    results = {
+        "switches": switches,
+        "switch_rate_hz": round(switches / elapsed, 1),
+        "call_latency_ms": summary(calls),
+    }
+    if hasattr(lc, "get_stats"):
+        results["controller"] = lc.get_stats()
+
+    # output switch as seen by the simulator, same monotonic clock
+    if simulator is not None:
+        time.sleep(0.5)
+        # in order, a switch is never matched to the output of an earlier one
+        switched = []
+        after = 0.0
+        for ch, t in zip(channels, issued):
+            s = simulator.first_on(ch, max(t, after))
+            switched.append(s)
+            if s is not None:
+                after = s + 1e-9
+        results["switch_latency_ms"] = summary(
+            [1000 * (s - t) for s, t in zip(switched, issued) if s is not None]
+        )
+        results["switches_lost"] = sum(s is None for s in switched)
+        results["simulator"] = simulator.get_stats()
+
+    if hasattr(lc, "close"):
+        lc.close()
+    if simulator is not None:
+        simulator.stop()
+    return results
+
+
+# load conf with hydra and run
+@hydra.main(version_base=None)
+def main(cfg: DictConfig):
+
+    os.environ["ROOT"] = str(os.getcwd())
+    OmegaConf.resolve(cfg)
+
+    logger = get_logger_default(out_path=cfg.paths.log_file)
+    results = run(cfg, logger)
+    logger.info(f"Light benchmark: {results}")
+
+    path = Path(cfg.paths.save_dir).parent / "light_benchmark.yaml"
+    os.makedirs(path.parent, exist_ok=True)
+    with open(str(path), "w") as f:
+        omegaconf.OmegaConf.save(results, f)
+    logger.info(f"Light benchmark saved in {path}")
+
+
+if __name__ == "__main__":
+    main()
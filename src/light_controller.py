@@ -68,6 +68,19 @@ class LightControllerAbstract(ABC):
         """
         pass
 
+    def set_channels(self, channels) -> None:
+        """
+            light exactly the given channels, all LEDs off if empty
+            backends override it with a single command when they can
+        """
+        channels = list(channels)
+        if len(channels) == 0:
+            self.leds_off()
+            return
+        self.led_on(channels[0], only=True)
+        for channel in channels[1:]:
+            self.led_on(channel)
+
     def test_leds(self) -> None:
         """
         Test all LEDs by shifting channels with arrows on keyboard.
@@ -129,12 +142,26 @@ def get_light_controller(cfg: DictConfig, logger: Logger = None):
     if not (module_path).exists():
         raise FileNotFoundError(f"Sensor {sensor_type} not found in {lights_dir}")
 
+    # local simulator standing in for the hardware, it points cfg to itself
+    simulator = None
+    if "simulator" in cfg and cfg.simulator.do:
+        simulator_path = lights_dir / "simulator.py"
+        if not simulator_path.exists():
+            raise FileNotFoundError(f"No simulator for sensor {sensor_type} in {lights_dir}")
+        spec = importlib.util.spec_from_file_location(sensor_type + "_simulator", simulator_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        simulator = getattr(module, "Simulator")(logger=logger, cfg=cfg)
+        simulator.start()
+
     # Load module dynamically
     spec = importlib.util.spec_from_file_location(sensor_type, module_path)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
     cls = getattr(module, "LightController")
-    return cls(logger=logger, cfg=cfg)
+    controller = cls(logger=logger, cfg=cfg)
+    controller.simulator = simulator
+    return controller
 
 
 # executable for debug
@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+import numpy as np
+from logging import Logger
+from omegaconf import DictConfig
+from typing import Dict, List, Optional, Tuple
+from light_controller import LightControllerAbstract
+
+
+class LightTimeline:
+    """
+    Light plan compiled to absolute step offsets: step i lights channels[i]
+    from starts[i] to starts[i] + durations[i], seconds from the timeline start.
+    """
+
+    def __init__(self, channels: List[Tuple[int, ...]], durations: List[float]):
+        self.channels = channels
+        self.durations = np.array(durations, dtype=np.float64)
+        self.starts = np.concatenate([[0.0], np.cumsum(self.durations)[:-1]])
+        self.length = float(self.durations.sum())
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def step_at(self, t: float) -> int:
+        """
+        index of the step running at t seconds, -1 before the start or after the end
+        """
+        if t < 0 or t >= self.length:
+            return -1
+        return int(np.searchsorted(self.starts, t, side="right") - 1)
+
+
+def compile_light_plan(cfg: DictConfig) -> LightTimeline:
+    """
+    light_sequence config: sequence entries are a channel, a list of channels
+    lit together, or {channels, duration_ms, repeat}; the sequence is played
+    rounds times with steps of step_ms by default
+    """
+    channels = []
+    durations = []
+    for entry in cfg.sequence:
+        repeat = 1
+        duration = cfg.step_ms
+        if isinstance(entry, int):
+            chs = (entry,)
+        elif isinstance(entry, DictConfig) or isinstance(entry, dict):
+            chs = entry["channels"]
+            chs = (chs,) if isinstance(chs, int) else tuple(chs)
+            duration = entry.get("duration_ms", duration)
+            repeat = entry.get("repeat", 1)
+        else:
+            chs = tuple(entry)
+        channels += [chs] * repeat
+        durations += [duration / 1000] * repeat
+
+    if len(channels) == 0:
+        raise ValueError("Empty light sequence")
+    return LightTimeline(channels * cfg.rounds, durations * cfg.rounds)
+
+
+class LightScheduler:
+    """
+    Plays a light timeline on a dedicated thread against the monotonic clock:
+    coarse sleep until spin_ms before each step, then busy wait. Records per
+    step the start jitter (command issued - scheduled time) and the command
+    latency of the backend.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        light_controller: LightControllerAbstract,
+        timeline: LightTimeline,
+        priority: Optional[int] = None,
+        spin_ms: float = 2.0,
+    ):
+        self.logger = logger
+        self.light_controller = light_controller
+        self.timeline = timeline
+        self.priority = priority
+        self.spin = spin_ms / 1000
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.t0 = None
+        self.jitter = np.full(len(timeline), np.nan)
+        self.latency = np.full(len(timeline), np.nan)
+
+    def __set_priority(self) -> None:
+        if self.priority is None:
+            return
+        try:
+            # real-time policy for the calling thread
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Cannot set real-time priority of the light scheduler: {e}")
+
+    def __wait_until(self, target: float) -> None:
+        remaining = target - time.monotonic()
+        if remaining > self.spin:
+            if self.stop_event.wait(remaining - self.spin):
+                return
+        while time.monotonic() < target and not self.stop_event.is_set():
+            pass
+
+    def __run(self) -> None:
+        self.__set_priority()
+        for i, channels in enumerate(self.timeline.channels):
+            target = self.t0 + self.timeline.starts[i]
+            self.__wait_until(target)
+            if self.stop_event.is_set():
+                break
+            t_issue = time.monotonic()
+            self.light_controller.set_channels(channels)
+            # backends writing asynchronously: wait for the change on the wire
+            if hasattr(self.light_controller, "sync"):
+                self.light_controller.sync(timeout=self.timeline.durations[i])
+            self.jitter[i] = t_issue - target
+            self.latency[i] = time.monotonic() - t_issue
+        self.__wait_until(self.t0 + self.timeline.length)
+        self.stop_event.set()
+
+    def start(self, lead_ms: float = 10.0) -> None:
+        self.stop_event.clear()
+        self.t0 = time.monotonic() + lead_ms / 1000
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and not self.stop_event.is_set()
+
+    def current_step(self) -> Tuple[int, float]:
+        """
+        (index of the running step, seconds elapsed in it), (-1, 0) when idle
+        """
+        if self.t0 is None:
+            return -1, 0.0
+        t = time.monotonic() - self.t0
+        step = self.timeline.step_at(t)
+        if step < 0:
+            return -1, 0.0
+        return step, t - self.timeline.starts[step]
+
+    def frame_step(self, t_begin: float, t_end: float, settle: float) -> int:
+        """
+        index of the step whose settled part, [start + settle, start + duration],
+        holds a frame exposed between t_begin and t_end (monotonic clock), -1 if none
+        """
+        if self.t0 is None:
+            return -1
+        step = self.timeline.step_at(t_begin - self.t0)
+        if step < 0:
+            return -1
+        start = self.t0 + self.timeline.starts[step]
+        if t_begin < start + settle or t_end > start + self.timeline.durations[step]:
+            return -1
+        return step
+
+    def get_stats(self) -> Dict:
+        """
+        jitter and latency in milliseconds over the executed steps
+        """
+        done = ~np.isnan(self.latency)
+        if not done.any():
+            return {"steps": 0}
+        jitter = self.jitter[done] * 1000
+        latency = self.latency[done] * 1000
+        total = jitter + latency
+        overruns = np.count_nonzero(total > self.timeline.durations[done] * 1000)
+        return {
+            "steps": int(done.sum()),
+            "jitter_ms": {
+                "mean": round(float(jitter.mean()), 3),
+                "p99": round(float(np.percentile(jitter, 99)), 3),
+                "max": round(float(jitter.max()), 3),
+            },
+            "latency_ms": {
+                "mean": round(float(latency.mean()), 3),
+                "p99": round(float(np.percentile(latency, 99)), 3),
+                "max": round(float(latency.max()), 3),
+            },
+            "overruns": int(overruns),
+            # step rate the lights keep up with, 99% of the steps
+            "max_step_rate_hz": round(1000 / max(float(np.percentile(total, 99)), 1e-3), 1),
+        }
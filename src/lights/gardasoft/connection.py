@@ -0,0 +1,160 @@
+import select
+import socket
+import threading
+import time
+from logging import Logger
+from typing import Dict, List, Tuple
+
+
+class CommandLatency:
+    """
+    round-trip latency of the commands, per command code (RS, ST, ...)
+    """
+
+    def __init__(self):
+        self.stats: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+
+    def add(self, code: str, elapsed: float) -> None:
+        with self.lock:
+            s = self.stats.setdefault(code, {"calls": 0, "total": 0.0, "max": 0.0})
+            s["calls"] += 1
+            s["total"] += elapsed
+            s["max"] = max(s["max"], elapsed)
+
+    def snapshot(self) -> Dict:
+        """
+        latency in milliseconds
+        """
+        with self.lock:
+            return {
+                code: {
+                    "calls": s["calls"],
+                    "mean_ms": round(1000 * s["total"] / s["calls"], 3),
+                    "max_ms": round(1000 * s["max"], 3),
+                }
+                for code, s in self.stats.items()
+            }
+
+
+class GardasoftConnection:
+    """
+    Persistent TCP connection to a Gardasoft controller. Each command line is
+    answered by the controller and terminated by its prompt, so several lines
+    can be pipelined in a single send and their replies split afterwards.
+    Reconnects once when the connection drops.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        ip: str,
+        port: int,
+        timeout: float = 1.0,
+        line_end: str = "\r",
+        prompt: str = ">",
+    ):
+        self.logger = logger
+        self.address = (ip, port)
+        self.timeout = timeout
+        self.line_end = line_end
+        self.prompt = prompt.encode()
+        self.sock = None
+        self.lock = threading.Lock()
+        self.latency = CommandLatency()
+        self.reconnections = 0
+
+    def connect(self) -> None:
+        self.close()
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+        self.buffer = b""
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def __recv(self) -> None:
+        data = self.sock.recv(4096)
+        if not data:
+            raise ConnectionError("Connection closed by the light controller")
+        self.buffer += data
+
+    def __split_replies(self, n: int = -1) -> List[str]:
+        replies = []
+        while len(replies) != n:
+            idx = self.buffer.find(self.prompt)
+            if idx < 0:
+                break
+            replies.append(self.buffer[:idx].decode(errors="replace").strip())
+            self.buffer = self.buffer[idx + len(self.prompt) :]
+        return replies
+
+    def __read_replies(self, n: int) -> List[str]:
+        replies = self.__split_replies(n)
+        while len(replies) < n:
+            self.__recv()
+            replies += self.__split_replies(n - len(replies))
+        return replies
+
+    def send_raw(self, lines: List[str]) -> None:
+        """
+        write the command lines without waiting for the replies
+        """
+        if self.sock is None:
+            self.connect()
+        payload = "".join(line + self.line_end for line in lines).encode()
+        self.sock.sendall(payload)
+
+    def poll_replies(self, timeout: float) -> List[str]:
+        """
+        replies completed within timeout seconds, possibly none
+        """
+        if self.sock is None:
+            return []
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if readable:
+            self.__recv()
+        return self.__split_replies()
+
+    def __exchange(self, lines: List[str]) -> List[str]:
+        self.send_raw(lines)
+        return self.__read_replies(len(lines))
+
+    def send(self, lines: List[str]) -> Tuple[List[str], float]:
+        """
+        send the command lines in a single write, returns (replies, elapsed seconds)
+        """
+        with self.lock:
+            time_start = time.perf_counter()
+            try:
+                replies = self.__exchange(lines)
+            except (OSError, ConnectionError) as e:
+                # dropped connection, one retry on a fresh one
+                self.logger.warning(f"Light controller connection lost ({e}), reconnecting")
+                self.reconnections += 1
+                self.connect()
+                replies = self.__exchange(lines)
+            elapsed = time.perf_counter() - time_start
+
+        for line in lines:
+            self.latency.add(line[:2], elapsed / len(lines))
+        return replies, elapsed
+
+
+# one connection per controller address, shared by the light controllers of the process
+_pool: Dict[Tuple[str, int], GardasoftConnection] = {}
+_pool_lock = threading.Lock()
+
+
+def get_connection(logger: Logger, ip: str, port: int, **kwargs) -> GardasoftConnection:
+    with _pool_lock:
+        if (ip, port) not in _pool:
+            _pool[(ip, port)] = GardasoftConnection(logger, ip, port, **kwargs)
+        return _pool[(ip, port)]
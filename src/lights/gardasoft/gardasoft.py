@@ -1,37 +1,120 @@
-from typing import Dict, Optional
+from concurrent.futures import Future
+from typing import Dict, List, Optional
 from utils_ema.net_controller import NetController
 from utils_ema.config_utils import DictConfig, load_yaml
 from pathlib import Path
+import sys
 import time
 from logging import Logger
 from omegaconf import DictConfig
 from light_controller import LightControllerAbstract
 
+sys.path.append(Path(__file__).parent.as_posix())
+from connection import CommandLatency, get_connection
+from pipeline import CommandPipeline
+
 
 class LightController(LightControllerAbstract):
 
+    def __init__(self, logger: Logger, cfg: DictConfig) -> None:
+        super().__init__(logger, cfg)
+
+        # persistent connection, shared with the other controllers at the same address
+        self.connection = None
+        self.latency = CommandLatency()
+        if self.cfg.protocol == "tcp":
+            self.connection = get_connection(
+                logger,
+                self.cfg.ip,
+                self.cfg.port_in,
+                timeout=self.cfg.tcp.timeout,
+                line_end=self.cfg.tcp.line_end,
+                prompt=self.cfg.tcp.prompt,
+            )
+            self.latency = self.connection.latency
+
+        # non-blocking commands, the connection is then used by the pipeline only
+        self.pipeline = None
+        if self.cfg.protocol == "tcp" and self.cfg.tcp.asynchronous:
+            self.pipeline = CommandPipeline(logger, self.connection, self.cfg.tcp.timeout)
+
     def check_reachability(self) -> bool:
         if not NetController.check_reachability(self.cfg.ip):
             return False
         return True
 
 
-    def __send_message(self, message: str, log=False) -> Optional[str]:
-        if self.cfg.protocol == "tcp":
-            res = NetController.send_tcp_message(self.cfg.ip, self.cfg.port_in, message)
+    def __send_messages(
+        self, messages: List[str], log=False, wait=True
+    ) -> Optional[List[str]]:
+        """
+        send the messages pipelined on the persistent connection (tcp) or one
+        by one (udp), returns one reply per message. With the asynchronous
+        pipeline and wait=False, returns the future of the replies instead
+        """
+        if self.pipeline is not None:
+            future = self.pipeline.submit(messages)
+            if not wait:
+                return future
+            try:
+                # the pipeline fails unanswered requests after tcp.timeout
+                res = future.result(timeout=2 * self.cfg.tcp.timeout)
+            except Exception as e:
+                self.logger.error(f"Communication with light controller is not working! {e}")
+                return None
+        elif self.cfg.protocol == "tcp":
+            try:
+                res, _ = self.connection.send(messages)
+            except (OSError, ConnectionError) as e:
+                self.logger.error(f"Communication with light controller is not working! {e}")
+                return None
         elif self.cfg.protocol == "udp":
-            res = NetController.send_udp_message(self.cfg.ip, self.cfg.port_in, message)
+            res = []
+            for message in messages:
+                time_start = time.perf_counter()
+                res.append(NetController.send_udp_message(self.cfg.ip, self.cfg.port_in, message))
+                self.latency.add(message[:2], time.perf_counter() - time_start)
+            if any(r is None for r in res):
+                self.logger.error("Communication with light controller is not working!")
+                return None
         else:
             raise ValueError(f"{self.cfg.protocol} is not a known protocol (tcp, udp)")
 
-        if res is None:
-            self.logger.error("Communication with light controller is not working!")
-            return None
-
         if log:
-            self.logger.info(res)
+            for r in res:
+                self.logger.info(r)
         return res
 
+    def __send_message(self, message: str, log=False) -> Optional[str]:
+        res = self.__send_messages([message], log=log)
+        return None if res is None else res[0]
+
+    def __send_batch(self, commands: List[str], wait=True) -> Optional[Future]:
+        """
+        commands joined with ';' in lines of at most tcp.max_batch commands
+        """
+        n = self.cfg.tcp.max_batch if self.cfg.protocol == "tcp" else 1
+        lines = [";".join(commands[i : i + n]) for i in range(0, len(commands), n)]
+        res = self.__send_messages(lines, wait=wait)
+        return res if isinstance(res, Future) else None
+
+    def get_stats(self) -> Dict:
+        """
+        per-command latency in milliseconds
+        """
+        stats = {"latency": self.latency.snapshot()}
+        if self.connection is not None:
+            stats["reconnections"] = self.connection.reconnections
+        if self.pipeline is not None:
+            stats["pipeline"] = self.pipeline.get_stats()
+        return stats
+
+    def close(self) -> None:
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self.connection is not None:
+            self.connection.close()
+
     # get status
     def log_channel_status(self, channel: int) -> None:
         res = self.__send_message("ST" + str(channel))
@@ -39,8 +122,12 @@ class LightController(LightControllerAbstract):
         return None
 
     def log_status(self):
-        for i in range(self.cfg.n_channels):
-            self.log_channel_status(i)
+        # one reply per channel, pipelined in a single send
+        res = self.__send_messages(["ST" + str(i) for i in range(self.cfg.n_channels)])
+        if res is None:
+            return None
+        for i, r in enumerate(res):
+            self.logger.info("   channel: " + str(i).zfill(2) + r.split("M")[1][:-3])
         return None
 
     # get number of leds
@@ -54,24 +141,38 @@ class LightController(LightControllerAbstract):
         )
         return None
 
-    def leds_on(self) -> None:
-        for i in range(self.cfg.n_channels):
-            self.set_led_continuous(i, amp=self.cfg.ampere_max)
-        return None
+    def set_leds_continuous(self, amps: Dict[int, float], wait=True) -> Optional[Future]:
+        """
+        set several channels with batched commands; with the asynchronous
+        pipeline and wait=False, returns the future of the replies
+        """
+        return self.__send_batch(
+            ["RS" + str(channel) + "," + str(amp) for channel, amp in amps.items()],
+            wait=wait,
+        )
 
-    def leds_off(self) -> None:
-        for i in range(self.cfg.n_channels):
-            self.set_led_continuous(i, amp=0)
-        return None
+    def leds_on(self, wait=True) -> Optional[Future]:
+        return self.set_leds_continuous(
+            {i: self.cfg.ampere_max for i in range(self.cfg.n_channels)}, wait=wait
+        )
 
-    def led_on(self, channel, only=False) -> None:
+    def leds_off(self, wait=True) -> Optional[Future]:
+        return self.set_leds_continuous(
+            {i: 0 for i in range(self.cfg.n_channels)}, wait=wait
+        )
 
-        for i in range(self.cfg.n_channels):
-            if i == channel:
-                self.set_led_continuous(i, amp=self.cfg.ampere_max)
-            elif only:
-                self.led_off(i)
-        return None
+    def led_on(self, channel, only=False, wait=True) -> Optional[Future]:
+        if not only:
+            return self.set_leds_continuous({channel: self.cfg.ampere_max}, wait=wait)
+        # channel on last, after the others are off
+        amps = {i: 0 for i in range(self.cfg.n_channels) if i != channel}
+        amps[channel] = self.cfg.ampere_max
+        return self.set_leds_continuous(amps, wait=wait)
+
+    def set_channels(self, channels, wait=True) -> Optional[Future]:
+        amps = {i: 0 for i in range(self.cfg.n_channels) if i not in channels}
+        amps.update({i: self.cfg.ampere_max for i in channels})
+        return self.set_leds_continuous(amps, wait=wait)
 
     def led_off(self, channel) -> None:
         self.set_led_continuous(channel=channel, amp=0)
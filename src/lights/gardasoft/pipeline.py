@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from logging import Logger
+from typing import Dict, List
+from connection import GardasoftConnection
+
+
+class CommandPipeline:
+    """
+    Non-blocking command queue over a Gardasoft connection. A background I/O
+    thread writes the commands as soon as they are submitted, without waiting
+    for the previous replies, and resolves the futures in order as the replies
+    (one per line, terminated by the prompt) come back. A request not answered
+    within timeout fails with TimeoutError, together with the ones after it,
+    and the connection is reopened so replies cannot be mismatched.
+    """
+
+    def __init__(self, logger: Logger, connection: GardasoftConnection, timeout: float):
+        self.logger = logger
+        self.connection = connection
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        self.in_flight = deque()
+        self.stop_event = threading.Event()
+        self.counts = {"completed": 0, "timeouts": 0, "errors": 0, "error_replies": 0}
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, lines: List[str]) -> Future:
+        """
+        queue the command lines, the future gets their replies
+        """
+        future = Future()
+        self.requests.put((lines, future))
+        return future
+
+    def __fail_in_flight(self, exc: Exception) -> None:
+        while self.in_flight:
+            request = self.in_flight.popleft()
+            if not request["future"].done():
+                request["future"].set_exception(exc)
+
+    def __send(self, lines: List[str], future: Future) -> None:
+        try:
+            try:
+                self.connection.send_raw(lines)
+            except OSError:
+                # dropped connection, whatever was in flight is lost
+                self.__fail_in_flight(ConnectionError("Light controller connection lost"))
+                self.connection.reconnections += 1
+                self.connection.connect()
+                self.connection.send_raw(lines)
+        except OSError as e:
+            self.counts["errors"] += 1
+            future.set_exception(e)
+            return
+        self.in_flight.append(
+            {"lines": lines, "future": future, "replies": [], "time": time.perf_counter()}
+        )
+
+    def __receive(self) -> None:
+        try:
+            replies = self.connection.poll_replies(timeout=0.001)
+        except (OSError, ConnectionError) as e:
+            self.counts["errors"] += len(self.in_flight)
+            self.__fail_in_flight(ConnectionError(f"Light controller connection lost: {e}"))
+            self.connection.close()
+            return
+
+        for reply in replies:
+            if not self.in_flight:
+                self.logger.warning(f"Unexpected reply from light controller: {reply}")
+                continue
+            request = self.in_flight[0]
+            request["replies"].append(reply)
+            if reply.startswith("Err"):
+                self.counts["error_replies"] += 1
+            if len(request["replies"]) == len(request["lines"]):
+                self.in_flight.popleft()
+                elapsed = time.perf_counter() - request["time"]
+                for line in request["lines"]:
+                    self.connection.latency.add(line[:2], elapsed / len(request["lines"]))
+                self.counts["completed"] += 1
+                request["future"].set_result(request["replies"])
+
+        # oldest request unanswered: replies cannot be matched anymore
+        if self.in_flight and time.perf_counter() - self.in_flight[0]["time"] > self.timeout:
+            self.counts["timeouts"] += len(self.in_flight)
+            self.logger.warning(f"Light controller reply timeout, {len(self.in_flight)} commands lost")
+            self.__fail_in_flight(TimeoutError("Light controller reply timeout"))
+            self.connection.reconnections += 1
+            try:
+                self.connection.connect()
+            except OSError as e:
+                self.logger.error(f"Cannot reconnect to the light controller: {e}")
+                self.connection.close()
+
+    def __run(self) -> None:
+        while not self.stop_event.is_set():
+            # block on the queue only when nothing is waiting for a reply
+            try:
+                lines, future = self.requests.get(timeout=0 if self.in_flight else 0.05)
+            except queue.Empty:
+                pass
+            else:
+                self.__send(lines, future)
+                continue
+            if self.in_flight:
+                self.__receive()
+        self.__fail_in_flight(ConnectionError("Command pipeline closed"))
+        while not self.requests.empty():
+            _, future = self.requests.get_nowait()
+            future.set_exception(ConnectionError("Command pipeline closed"))
+
+    def get_stats(self) -> Dict:
+        return {**self.counts, "in_flight": len(self.in_flight), "queued": self.requests.qsize()}
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
@@ -0,0 +1,118 @@
+import random
+import socket
+import socketserver
+import threading
+import time
+from logging import Logger
+from typing import Dict, List, Tuple
+from omegaconf import DictConfig
+
+
+class Simulator:
+    """
+    Local stand-in for a Gardasoft controller: a TCP server answering the
+    RS (set current), ST (status) and CL (clear) commands, one reply plus
+    prompt per line, ';'-separated commands in a line. Replies are delayed by
+    latency_ms (+ uniform jitter_ms), replaced by an error with error_rate
+    probability, or dropped with drop_rate probability.
+    """
+
+    def __init__(self, logger: Logger, cfg: DictConfig):
+        self.logger = logger
+        self.cfg = cfg
+        self.sim = cfg.simulator
+        self.amps = [0.0] * cfg.n_channels
+        self.lock = threading.Lock()
+        self.changes: List[Tuple[float, int, float]] = []
+        self.counts = {"lines": 0, "commands": 0, "errors": 0, "dropped": 0}
+        self.server = None
+
+    def execute(self, command: str) -> str:
+        command = command.strip()
+        code, args = command[:2].upper(), command[2:]
+        try:
+            if code == "RS":
+                channel, amp = args.split(",")[:2]
+                with self.lock:
+                    self.amps[int(channel)] = float(amp)
+                    self.changes.append((time.monotonic(), int(channel), float(amp)))
+                return command
+            if code == "ST":
+                channel = int(args)
+                with self.lock:
+                    amp = self.amps[channel]
+                return f"{command}\r\nMode 0, current {amp:.3f}A\r\n"
+            if code == "CL":
+                with self.lock:
+                    self.amps = [0.0] * self.cfg.n_channels
+                    self.changes.append((time.monotonic(), -1, 0.0))
+                return command
+        except (ValueError, IndexError):
+            pass
+        return "Err 1"
+
+    def answer(self, line: str) -> str:
+        """
+        reply to a line, None if dropped
+        """
+        self.counts["lines"] += 1
+        delay = self.sim.latency_ms + random.uniform(0, self.sim.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self.sim.drop_rate:
+            self.counts["dropped"] += 1
+            return None
+        if random.random() < self.sim.error_rate:
+            self.counts["errors"] += 1
+            return "Err 21"
+        commands = [c for c in line.split(";") if c.strip() != ""]
+        self.counts["commands"] += len(commands)
+        return ";".join(self.execute(c) for c in commands)
+
+    def start(self) -> None:
+        simulator = self
+        line_end = self.cfg.tcp.line_end.encode()
+        prompt = self.cfg.tcp.prompt
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                buffer = b""
+                while True:
+                    data = self.request.recv(4096)
+                    if not data:
+                        return
+                    buffer += data
+                    while line_end in buffer:
+                        line, buffer = buffer.split(line_end, 1)
+                        reply = simulator.answer(line.decode(errors="replace"))
+                        if reply is not None:
+                            self.request.sendall((reply + "\r\n" + prompt).encode())
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", self.sim.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # the controller connects to the simulator
+        self.cfg.ip = "127.0.0.1"
+        self.cfg.port_in = self.server.server_address[1]
+        self.logger.info(f"Gardasoft simulator listening on port {self.cfg.port_in}")
+
+    def first_on(self, channel: int, after: float):
+        """
+        monotonic time the channel was switched on after a given time, None if never
+        """
+        with self.lock:
+            for t, ch, amp in self.changes:
+                if t >= after and ch == channel and amp > 0:
+                    return t
+        return None
+
+    def get_stats(self) -> Dict:
+        return dict(self.counts)
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
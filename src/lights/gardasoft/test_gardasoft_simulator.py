@@ -0,0 +1,78 @@
+import importlib.util
+import logging
+import sys
+from pathlib import Path
+import pytest
+from omegaconf import DictConfig
+sys.path.append(Path(__file__).parent.as_posix())
+from connection import GardasoftConnection
+from pipeline import CommandPipeline
+
+# simulator modules of the backends share their name, load this one by path
+spec = importlib.util.spec_from_file_location(
+    "gardasoft_simulator", Path(__file__).parent / "simulator.py"
+)
+simulator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(simulator)
+
+logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def sim():
+    cfg = DictConfig(
+        {
+            "ip": None,
+            "port_in": None,
+            "n_channels": 4,
+            "tcp": {"line_end": "\r", "prompt": ">"},
+            "simulator": {
+                "port": 0,
+                "latency_ms": 0.0,
+                "jitter_ms": 0.0,
+                "error_rate": 0.0,
+                "drop_rate": 0.0,
+            },
+        }
+    )
+    sim = simulator.Simulator(logger, cfg)
+    sim.start()
+    yield sim
+    sim.stop()
+
+
+def test_batched_commands(sim):
+    connection = GardasoftConnection(logger, sim.cfg.ip, sim.cfg.port_in, timeout=1.0)
+    replies, _ = connection.send(["RS0,0.5;RS1,0", "ST0", "XX"])
+    connection.close()
+
+    assert replies[0] == "RS0,0.5;RS1,0"
+    assert "current 0.500A" in replies[1]
+    assert replies[2] == "Err 1"
+    assert sim.amps[:2] == [0.5, 0.0]
+    assert sim.get_stats()["lines"] == 3
+
+
+def test_pipeline_futures_in_order(sim):
+    connection = GardasoftConnection(logger, sim.cfg.ip, sim.cfg.port_in, timeout=1.0)
+    pipeline = CommandPipeline(logger, connection, timeout=1.0)
+    futures = [pipeline.submit([f"RS{i % 4},{i / 100:.2f}"]) for i in range(40)]
+    replies = [f.result(timeout=5) for f in futures]
+    pipeline.close()
+    connection.close()
+
+    assert replies == [[f"RS{i % 4},{i / 100:.2f}"] for i in range(40)]
+    assert pipeline.get_stats()["completed"] == 40
+    assert sim.amps == [0.36, 0.37, 0.38, 0.39]
+
+
+def test_pipeline_timeout_on_dropped_reply(sim):
+    sim.sim.drop_rate = 1.0
+    connection = GardasoftConnection(logger, sim.cfg.ip, sim.cfg.port_in, timeout=1.0)
+    pipeline = CommandPipeline(logger, connection, timeout=0.1)
+    future = pipeline.submit(["RS0,1"])
+    with pytest.raises(TimeoutError):
+        future.result(timeout=5)
+    pipeline.close()
+    connection.close()
+    assert pipeline.get_stats()["timeouts"] == 1
@@ -18,6 +18,15 @@ class LightController(LightControllerAbstract):
         self.led_status = np.full((self.cfg.n_channels,), False, dtype=bool)
         self.loop_interval = self.cfg.loop_interval_ms / 1000.0
         self.lock = threading.Lock()
+
+        # state changes wake the writer up, versions tell when they are on the wire
+        self.condition = threading.Condition(self.lock)
+        self.state_version = 0
+        self.written_version = 0
+        self.changed_at = None
+        self.stop_event = threading.Event()
+        self.latency = {"calls": 0, "total": 0.0, "max": 0.0}
+        self.keepalives = 0
         self.__run_loop()
 
 
@@ -25,38 +34,96 @@ class LightController(LightControllerAbstract):
     def check_reachability(self) -> bool:
         ports = serial.tools.list_ports.comports()
         devices = [port.device for port in ports]
-        if self.cfg.port in devices:
+        # pseudo-terminals (simulator) are not listed among the serial ports
+        if self.cfg.port in devices or self.cfg.port.startswith("/dev/pts/"):
             self.logger.info(f"Using port {self.cfg.port} as light controller.")
             return True
         else:
             self.logger.error(f"Port {self.cfg.port} not found. Available ports: {devices}")
             return False
 
-    def __create_message(self) -> bytes:
+    def __create_message(self, led_status: np.ndarray) -> bytes:
         """
         Crea un messaggio di 7 byte con header FA04, 4 byte di dati, e 1 byte di CRC.
         output_mask: intero a 32 bit che rappresenta le 32 uscite.
         """
         header = [0xFA, 0x04]
 
-        with self.lock:
-            led_status = self.led_status.copy()
-
-        bit_string = ''.join(str(int(b)) for b in led_status[::-1])
-        value = int(bit_string, 2)
-        data_bytes = value.to_bytes(4, byteorder='little')
+        # channel i on bit i of the little endian 32-bit mask
+        mask = np.zeros(32, dtype=bool)
+        mask[: len(led_status)] = led_status
+        data_bytes = np.packbits(mask, bitorder="little").tolist()
 
-        first_six = header + list(data_bytes)
+        first_six = header + data_bytes
         crc = (~sum(first_six)) & 0xFF
         return bytes(first_six + [crc])
 
     # communication loop
     def __run_loop_aux(self, ser: serial.Serial):
         self.logger.info("Starting light controller loop.")
-        while True:
-            data = self.__create_message()
-            ser.write(data)
-            time.sleep(self.loop_interval)
+        while not self.stop_event.is_set():
+            # wake up on state changes, resend the state as keepalive when idle
+            with self.condition:
+                changed = self.condition.wait_for(
+                    lambda: self.state_version != self.written_version
+                    or self.stop_event.is_set(),
+                    timeout=self.loop_interval,
+                )
+                version = self.state_version
+                led_status = self.led_status.copy()
+                changed_at = self.changed_at
+
+            ser.write(self.__create_message(led_status))
+            ser.flush()
+
+            with self.condition:
+                if changed and changed_at is not None:
+                    elapsed = time.perf_counter() - changed_at
+                    self.latency["calls"] += 1
+                    self.latency["total"] += elapsed
+                    self.latency["max"] = max(self.latency["max"], elapsed)
+                else:
+                    self.keepalives += 1
+                self.written_version = version
+                self.condition.notify_all()
+        ser.close()
+
+    def __state_changed(self) -> None:
+        # called holding the lock
+        self.state_version += 1
+        self.changed_at = time.perf_counter()
+        self.condition.notify_all()
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """
+        wait until the current state has been written to the controller
+        """
+        with self.condition:
+            version = self.state_version
+            return self.condition.wait_for(
+                lambda: self.written_version >= version, timeout=timeout
+            )
+
+    def get_stats(self) -> Dict:
+        """
+        latency from a state change to its message written on the port, in milliseconds
+        """
+        with self.lock:
+            calls = self.latency["calls"]
+            return {
+                "latency": {
+                    "calls": calls,
+                    "mean_ms": round(1000 * self.latency["total"] / max(calls, 1), 3),
+                    "max_ms": round(1000 * self.latency["max"], 3),
+                },
+                "keepalives": self.keepalives,
+            }
+
+    def close(self) -> None:
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        self.loop_thread.join()
 
     def __run_loop(self):
 
@@ -92,18 +159,28 @@ class LightController(LightControllerAbstract):
     def leds_on(self) -> None:
         with self.lock:
             self.led_status[:] = True
+            self.__state_changed()
 
     def leds_off(self) -> None:
         with self.lock:
             self.led_status[:] = False
+            self.__state_changed()
 
     def led_on(self, channel, only=False) -> None:
         with self.lock:
             if only:
                 self.led_status[:] = False
             self.led_status[channel] = True
+            self.__state_changed()
+
+    def set_channels(self, channels) -> None:
+        with self.lock:
+            self.led_status[:] = False
+            self.led_status[list(channels)] = True
+            self.__state_changed()
 
     def led_off(self, channel) -> None:
         with self.lock:
             self.led_status[channel] = False
+            self.__state_changed()
 
@@ -0,0 +1,124 @@
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+import numpy as np
+from logging import Logger
+from typing import Dict, List, Tuple
+from omegaconf import DictConfig
+
+
+class Simulator:
+    """
+    Local stand-in for a Microtec controller: a pseudo-terminal decoding the
+    7-byte frames (0xFA 0x04, 32-bit little endian mask, CRC) written by the
+    controller. Frames are corrupted with error_rate probability (counted as
+    CRC errors). The pty has no line rate, so each frame is timed from its
+    reception as if sent at the configured baudrate (10 bits per byte, frames
+    queued behind the previous ones) and applied latency_ms (+ uniform
+    jitter_ms) after it is complete. Changes are timestamped at that simulated
+    output time, the reader never sleeps.
+    """
+
+    frame_size = 7
+
+    def __init__(self, logger: Logger, cfg: DictConfig):
+        self.logger = logger
+        self.cfg = cfg
+        self.sim = cfg.simulator
+        self.mask = np.zeros(32, dtype=bool)
+        self.lock = threading.Lock()
+        self.changes: List[Tuple[float, np.ndarray]] = []
+        self.counts = {"frames": 0, "crc_errors": 0, "resyncs": 0, "keepalives": 0}
+        self.stop_event = threading.Event()
+        self.master = None
+        self.thread = None
+        self.frame_time = self.frame_size * 10 / cfg.baudrate
+        self.line_free = 0.0
+        self.output_time = 0.0
+
+    def decode(self, frame: bytes, t_received: float) -> None:
+        # end of the frame on the wire, then the output switch, in order
+        self.line_free = max(self.line_free, t_received) + self.frame_time
+        delay = self.sim.latency_ms + random.uniform(0, self.sim.jitter_ms)
+        t_output = max(self.output_time, self.line_free + delay / 1000)
+
+        frame = bytearray(frame)
+        if random.random() < self.sim.error_rate:
+            frame[random.randrange(2, self.frame_size)] ^= 0xFF
+        crc = (~sum(frame[:6])) & 0xFF
+        if crc != frame[6]:
+            self.counts["crc_errors"] += 1
+            return
+
+        self.output_time = t_output
+        data = np.frombuffer(bytes(frame[2:6]), dtype=np.uint8)
+        mask = np.unpackbits(data, bitorder="little").astype(bool)
+        self.counts["frames"] += 1
+        with self.lock:
+            if np.array_equal(mask, self.mask):
+                self.counts["keepalives"] += 1
+                return
+            self.mask = mask
+            self.changes.append((t_output, mask))
+
+    def __run(self) -> None:
+        buffer = b""
+        while not self.stop_event.is_set():
+            # bounded wait, the descriptors are closed only once the reader exits
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+            t_received = time.monotonic()
+            while len(buffer) >= self.frame_size:
+                # resynchronize on the header
+                idx = buffer.find(b"\xfa\x04")
+                if idx < 0:
+                    buffer = buffer[-1:]
+                    self.counts["resyncs"] += 1
+                    break
+                if idx > 0:
+                    buffer = buffer[idx:]
+                    self.counts["resyncs"] += 1
+                    continue
+                frame, buffer = buffer[: self.frame_size], buffer[self.frame_size :]
+                self.decode(frame, t_received)
+
+    def start(self) -> None:
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+        # the controller opens the slave side as its serial port
+        self.cfg.port = os.ttyname(self.slave)
+        self.logger.info(f"Microtec simulator on {self.cfg.port}")
+
+    def first_on(self, channel: int, after: float):
+        """
+        monotonic time the channel was switched on after a given time, None if never
+        """
+        with self.lock:
+            for t, mask in self.changes:
+                if t >= after and mask[channel]:
+                    return t
+        return None
+
+    def get_stats(self) -> Dict:
+        return dict(self.counts)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
@@ -0,0 +1,96 @@
+import importlib.util
+import logging
+import os
+import time
+from pathlib import Path
+import numpy as np
+from omegaconf import DictConfig
+
+# simulator modules of the backends share their name, load this one by path
+spec = importlib.util.spec_from_file_location(
+    "microtec_simulator", Path(__file__).parent / "simulator.py"
+)
+simulator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(simulator)
+
+
+def frame(channel: int) -> bytes:
+    mask = np.zeros(32, dtype=bool)
+    mask[channel] = True
+    msg = bytes([0xFA, 0x04]) + np.packbits(mask, bitorder="little").tobytes()
+    return msg + bytes([(~sum(msg)) & 0xFF])
+
+
+def get_simulator(latency_ms: float = 0.5) -> "simulator.Simulator":
+    cfg = DictConfig(
+        {
+            "port": None,
+            "baudrate": 160000,
+            "simulator": {"latency_ms": latency_ms, "jitter_ms": 0.0, "error_rate": 0.0},
+        }
+    )
+    sim = simulator.Simulator(logging.getLogger("test"), cfg)
+    sim.start()
+    return sim
+
+
+def test_paced_switch_latency():
+    sim = get_simulator(latency_ms=0.5)
+    fd = os.open(sim.cfg.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        issued = []
+        for i in range(200):
+            issued.append(time.monotonic())
+            os.write(fd, frame(i % 2))
+            # slower than the line, frames never queue up
+            time.sleep(0.002)
+        time.sleep(0.1)
+        switched = [sim.first_on(i % 2, t) for i, t in enumerate(issued)]
+    finally:
+        os.close(fd)
+        sim.stop()
+
+    assert all(s is not None for s in switched)
+    latency = np.array([s - t for s, t in zip(switched, issued)])
+    # frame on the wire then output delay, not a growing backlog
+    expected = sim.frame_time + 0.5e-3
+    assert latency.min() >= expected - 1e-6
+    assert np.median(latency) < expected + 1e-3
+
+
+def test_burst_does_not_block_reader():
+    sim = get_simulator(latency_ms=0.5)
+    fd = os.open(sim.cfg.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        time_start = time.monotonic()
+        for i in range(2000):
+            os.write(fd, frame(i % 2))
+        # decoded right away, a sleeping reader would need 2000 x 0.5 ms
+        while sim.get_stats()["frames"] < 2000 and time.monotonic() - time_start < 5:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - time_start
+    finally:
+        os.close(fd)
+        sim.stop()
+
+    assert sim.get_stats()["frames"] == 2000
+    assert elapsed < 0.5
+    # outputs queued behind each other at the line rate
+    times = np.array([t for t, _ in sim.changes])
+    assert np.all(np.diff(times) >= sim.frame_time - 1e-9)
+
+
+def test_repeated_frames_are_keepalives():
+    sim = get_simulator(latency_ms=0.0)
+    fd = os.open(sim.cfg.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        os.write(fd, frame(3) * 3 + b"\x00" + frame(5))
+        time.sleep(0.2)
+    finally:
+        os.close(fd)
+        sim.stop()
+    stats = sim.get_stats()
+    assert stats["frames"] == 4
+    assert stats["keepalives"] == 2
+    assert stats["resyncs"] == 1
+    assert len(sim.changes) == 2
@@ -6,6 +6,7 @@ from pathlib import Path
 from logging import Logger
 from utils_ema.log import get_logger_default
 from collector import Collector
+from triggers import ChangeTrigger
 
 
 # load conf with hydra and run
@@ -55,6 +56,11 @@ def run(cfg: DictConfig, logger: Logger):
         elif cfg.mode.val == "light_sequence":
             # images_list, postprocessed = coll.capture_light_sequence()
             coll.capture_light_sequence()
+        elif cfg.mode.val == "automatic":
+            trigger = None
+            if cfg.mode.change_trigger.do:
+                trigger = ChangeTrigger(cfg.mode.change_trigger)
+            coll.capture_till_q(trigger_capture=trigger)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Hashable, Optional
+
+
+class PixelAccumulator:
+    """
+    Running per-pixel mean/variance (Welford), min and max of a stream of
+    same-shape images, in preallocated arrays. The float32 scratch buffers of
+    update are passed by the caller, shared by the accumulators of a shape.
+    """
+
+    def __init__(self, shape: tuple, dtype: np.dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else np.finfo(dtype)
+        self.min = np.full(shape, info.max, dtype=dtype)
+        self.max = np.full(shape, info.min, dtype=dtype)
+
+    def update(self, img: np.ndarray, delta: np.ndarray, tmp: np.ndarray) -> None:
+        """
+        delta, tmp: scratch buffers of the image shape
+        """
+        self.count += 1
+        # only the per-frame increments are float32, the sums stay float64
+        np.subtract(img, self.mean, out=delta)
+        np.divide(delta, self.count, out=tmp)
+        self.mean += tmp
+        np.subtract(img, self.mean, out=tmp)
+        tmp *= delta
+        self.m2 += tmp
+        np.minimum(self.min, img, out=self.min)
+        np.maximum(self.max, img, out=self.max)
+
+    def variance(self) -> np.ndarray:
+        if self.count < 2:
+            return np.zeros(self.shape, dtype=np.float64)
+        return self.m2 / (self.count - 1)
+
+    def save(self, path: Path) -> None:
+        np.savez(
+            path,
+            count=self.count,
+            mean=self.mean.astype(np.float32),
+            var=self.variance().astype(np.float32),
+            min=self.min,
+            max=self.max,
+        )
+
+
+class PixelStatistics:
+    """
+    Per-camera (and optionally per light channel) pixel accumulators, saved at
+    the end of the session as <cam_name>[_ch<channel>].npz with count, mean,
+    var, min and max, e.g. master dark and flat frames.
+    """
+
+    def __init__(self):
+        self.accumulators: Dict[Hashable, PixelAccumulator] = {}
+        self.skipped = 0
+        self.lock = threading.Lock()
+        # scratch buffers per image shape, per thread as cameras update in parallel
+        self.scratch = threading.local()
+
+    def get(self, key: Hashable, img: np.ndarray) -> Optional[PixelAccumulator]:
+        with self.lock:
+            acc = self.accumulators.get(key)
+            if acc is None:
+                acc = PixelAccumulator(img.shape, img.dtype)
+                self.accumulators[key] = acc
+            # placeholder of a missing camera, or resolution changed mid-session
+            if acc.shape != img.shape:
+                self.skipped += 1
+                return None
+            return acc
+
+    def update(self, img: np.ndarray, cam_id: int, channel: Optional[int] = None) -> None:
+        acc = self.get((cam_id, channel), img)
+        if acc is not None:
+            acc.update(img, *self.get_scratch(img.shape))
+
+    def get_scratch(self, shape: tuple):
+        buffers = self.scratch.__dict__.setdefault("buffers", {})
+        if shape not in buffers:
+            buffers[shape] = (
+                np.empty(shape, dtype=np.float32),
+                np.empty(shape, dtype=np.float32),
+            )
+        return buffers[shape]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.accumulators = {}
+            self.skipped = 0
+
+    def save(self, save_dir: str) -> None:
+        save_dir = Path(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        for (cam_id, channel), acc in self.accumulators.items():
+            name = "cam_" + str(cam_id).zfill(3)
+            if channel is not None:
+                name += f"_ch{channel}"
+            acc.save(save_dir / f"{name}.npz")
@@ -1,13 +1,50 @@
+import cv2
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from utils_ema.config_utils import DictConfig, load_yaml
 from utils_ema.image import Image
 from copy import deepcopy
+from pathlib import Path
+from utils_image import image_to_numpy
+from undistortion import UndistortionMaps
+from color_correction import ColorCorrectionLUT
+from pixel_statistics import PixelStatistics
+from flat_field import FlatFieldCorrection
 
 
 class Postprocessing:
+    """
+    Chain of functions applied to the frame sets.
+    A function `name(images, cam_ids, **kwargs)` works on a list of images; if
+    a `name_batch(stack, cam_ids, **kwargs)` variant exists, same-resolution
+    frame sets are stacked and processed with a single vectorized call; add
+    one only where it is measured faster than the per-image function.
+    With cfg.threads > 0, the chain of each camera runs on a thread pool
+    instead, relying on OpenCV/numpy kernels releasing the GIL.
+    """
+
     def __init__(self, cfg: DictConfig):
         self.functions = []
         self.kwargs = []
         self.cfg = cfg
+        self.devices_info = None
+        self.undistortion_maps = None
+        self.color_luts = None
+        self.pixel_stats = None
+        self.flat_field = None
+        self.light_channel = None
+        self.timings = {}
+        self.timings_lock = threading.Lock()
+        # lazy state of the functions, shared by the per-camera chains
+        self.init_lock = threading.Lock()
+        # images the running chain was called with, per thread
+        self.chain = threading.local()
+        self.executor = None
+        if self.cfg.get("threads", 0) > 0:
+            self.executor = ThreadPoolExecutor(max_workers=self.cfg.threads)
         self.init_postprocessings()
 
     def init_postprocessings(self) -> bool:
@@ -26,24 +63,211 @@ class Postprocessing:
                 self.kwargs.append(v)
         return True
 
-    def undistort(self, images):
-        pass
+    def set_devices_info(self, devices_info: dict) -> None:
+        """
+        devices info of the camera controller, kept by reference so runtime
+        crop changes are seen by the functions
+        """
+        self.devices_info = devices_info
+
+    def camera_info(self, cam_id: int) -> dict:
+        if self.devices_info is None:
+            raise ValueError("Devices info not set in postprocessing")
+        return self.devices_info["cam_" + str(cam_id).zfill(3)]
+
+    def undistort(
+        self,
+        images,
+        cam_ids=None,
+        intrinsics_dir: str = "data/intrinsics",
+        cache_dir: str = "data/cache",
+        alpha: Optional[float] = None,
+    ):
+        if cam_ids is None:
+            raise ValueError("undistort needs the camera ids of the images")
+        with self.init_lock:
+            if self.undistortion_maps is None:
+                self.undistortion_maps = UndistortionMaps(intrinsics_dir, cache_dir, alpha)
+
+        for i, (img, cam_id) in enumerate(zip(images, cam_ids)):
+            info = self.camera_info(cam_id)
+            arr = image_to_numpy(img)
+            crop_offset = info["crop_offset"]
+            crop_resolution = info["crop_resolution"]
+
+            # region kept by the worker preprocessing, in sensor ROI pixels
+            if "preprocessing" in info:
+                pre = info["preprocessing"]
+                crop_offset = [o + p for o, p in zip(crop_offset, pre["offset"])]
+                crop_resolution = pre["resolution"]
+
+            maps = self.undistortion_maps.get(
+                serial=str(info["SerialNumber"]),
+                resolution=(arr.shape[1], arr.shape[0]),
+                crop_offset=crop_offset,
+                crop_resolution=crop_resolution,
+            )
+            images[i] = Image(self.undistortion_maps.apply(arr, maps))
+        return images
+
+    def color_correction(
+        self, images, cam_ids=None, calibration_dir: str = "data/color_calibration"
+    ):
+        if cam_ids is None:
+            raise ValueError("color_correction needs the camera ids of the images")
+        with self.init_lock:
+            if self.color_luts is None:
+                self.color_luts = ColorCorrectionLUT(calibration_dir)
+
+        for i, (img, cam_id) in enumerate(zip(images, cam_ids)):
+            serial = str(self.camera_info(cam_id)["SerialNumber"])
+            images[i] = Image(self.color_luts.apply(image_to_numpy(img), serial))
+        return images
+
+    def flat_field_correction(
+        self,
+        images,
+        cam_ids=None,
+        calibration_dir: str = "data/flat_field",
+        cache_dir: str = "data/cache",
+    ):
+        if cam_ids is None:
+            raise ValueError("flat_field_correction needs the camera ids of the images")
+        with self.init_lock:
+            if self.flat_field is None:
+                self.flat_field = FlatFieldCorrection(calibration_dir, cache_dir)
+
+        for i, (img, cam_id) in enumerate(zip(images, cam_ids)):
+            info = self.camera_info(cam_id)
+            dark, gain = self.flat_field.get(
+                serial=str(info["SerialNumber"]),
+                crop_offset=info["crop_offset"],
+                crop_resolution=info["crop_resolution"],
+                exposure_time=info["ExposureTime"],
+                preprocessing=info.get("preprocessing"),
+            )
+            arr = image_to_numpy(img)
+            out = arr if self.owned(arr) else None
+            images[i] = Image(self.flat_field.apply(arr, dark, gain, out=out))
+        return images
+
+    def set_light_channel(self, channel: Optional[int]) -> None:
+        """
+        light channel lit for the next frame sets, None if several or unknown
+        """
+        self.light_channel = channel
 
-    def color_correction(self, images):
-        pass
+    def pixel_statistics(self, images, cam_ids=None, per_channel: bool = False):
+        """
+        accumulate per-pixel mean/variance/min/max, images are left untouched
+        """
+        with self.init_lock:
+            if self.pixel_stats is None:
+                self.pixel_stats = PixelStatistics()
+        if cam_ids is None:
+            cam_ids = list(range(len(images)))
+        channel = self.light_channel if per_channel else None
+        for img, cam_id in zip(images, cam_ids):
+            self.pixel_stats.update(image_to_numpy(img), cam_id, channel)
+        return images
+
+    def reset_results(self) -> None:
+        if self.pixel_stats is not None:
+            self.pixel_stats.reset()
 
-    def sobel(self, images):
+    def save_results(self, save_dir: str) -> None:
+        """
+        results accumulated by the stateful functions over the session
+        """
+        if self.pixel_stats is not None:
+            self.pixel_stats.save(str(Path(save_dir) / "pixel_statistics"))
+
+    def sobel(self, images, cam_ids=None):
+        """
+        per-channel gradient magnitude of the 3x3 Sobel kernels, edges replicated,
+        float32 normalized to [0, 1] by the largest response 4*sqrt(2); this
+        replaces Image.sobel() of utils_ema, whose scaling and dtype are not kept
+        """
         for i, img in enumerate(images):
-            images[i] = img.sobel()
+            arr = image_to_numpy(img)
+            x = arr.astype(np.float32)
+            x *= (1 / 255 if arr.dtype == np.uint8 else 1) / (4 * np.sqrt(2))
+            gx = cv2.Sobel(x, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+            gy = cv2.Sobel(x, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+            images[i] = Image(cv2.magnitude(gx, gy))
+        return images
+
+    def record_timing(self, name: str, elapsed: float) -> None:
+        with self.timings_lock:
+            t = self.timings.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+            t["calls"] += 1
+            t["total"] += elapsed
+            t["max"] = max(t["max"], elapsed)
+
+    def get_timings(self) -> Dict:
+        """
+        per-function timings in milliseconds
+        """
+        with self.timings_lock:
+            return {
+                name: {
+                    "calls": t["calls"],
+                    "mean_ms": round(1000 * t["total"] / t["calls"], 3),
+                    "max_ms": round(1000 * t["max"], 3),
+                }
+                for name, t in self.timings.items()
+            }
+
+    def run_function(self, fn, images, cam_ids: Optional[List[int]], kwargs):
+        time_start = time.perf_counter()
+        images = self.__run_function(fn, images, cam_ids, kwargs)
+        self.record_timing(fn.__name__, time.perf_counter() - time_start)
         return images
 
-    def postprocess(self, images):
+    def __run_function(self, fn, images, cam_ids: Optional[List[int]], kwargs):
+        fn_batch = getattr(self, fn.__name__ + "_batch", None)
+        if fn_batch is not None and len(images) > 1:
+            arrays = [image_to_numpy(img) for img in images]
+            shapes = set((a.shape, a.dtype) for a in arrays)
+
+            # identical sensors: one vectorized call for the whole frame set
+            if len(shapes) == 1:
+                stack = fn_batch(np.stack(arrays), cam_ids=cam_ids, **kwargs)
+                return [Image(s) for s in stack]
+
+        # functions write their outputs in the list, never in the caller's one
+        return fn(list(images), cam_ids=cam_ids, **kwargs)
+
+    def run_chain(self, images, cam_ids: Optional[List[int]] = None):
+        self.chain.inputs = [image_to_numpy(img) for img in images]
+        for fn, kwargs in zip(self.functions, self.kwargs):
+            images = self.run_function(fn, images, cam_ids, kwargs)
+        self.chain.inputs = []
+        return images
+
+    def owned(self, arr: np.ndarray) -> bool:
+        """
+        True if arr was written by an earlier function of the running chain,
+        so it can be modified in place; the caller's images are cached stages
+        """
+        inputs = getattr(self.chain, "inputs", [])
+        return arr.flags.writeable and not any(np.may_share_memory(arr, a) for a in inputs)
+
+    def postprocess(self, images, cam_ids: Optional[List[int]] = None):
         if self.functions == []:
             return None
-        else:
-            for fn in self.functions:
-                images = fn(images)
-            return images
+        if self.executor is None or len(images) == 1:
+            return self.run_chain(images, cam_ids)
+
+        # one chain per camera, in parallel
+        if cam_ids is None:
+            cam_ids = list(range(len(images)))
+        futures = [
+            self.executor.submit(self.run_chain, [img], [cam_id])
+            for img, cam_id in zip(images, cam_ids)
+        ]
+        return [f.result()[0] for f in futures]
 
-    def add_function(self, fn):
+    def add_function(self, fn, kwargs: Optional[dict] = None):
         self.functions.append(fn)
+        self.kwargs.append({} if kwargs is None else kwargs)
@@ -0,0 +1,162 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from omegaconf import DictConfig
+
+# positions of the red and blue samples in the 2x2 Bayer tile
+BAYER_POSITIONS = {
+    "RG": ((0, 0), (1, 1)),
+    "BG": ((1, 1), (0, 0)),
+    "GR": ((0, 1), (1, 0)),
+    "GB": ((1, 0), (0, 1)),
+}
+
+# full 2x2 tiles of the patterns, OpenCV demosaicing codes are named after them
+BAYER_TILES = {"RG": "RGGB", "BG": "BGGR", "GR": "GRBG", "GB": "GBRG"}
+
+
+def bin_image(img: np.ndarray, factor: int) -> np.ndarray:
+    """
+    box binning by an integer factor, borders not multiple of factor dropped
+    """
+    h, w = img.shape[:2]
+    h, w = h - h % factor, w - w % factor
+    return cv2.resize(
+        img[:h, :w],
+        (w // factor, h // factor),
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+def debayer_downsample(raw: np.ndarray, factor: int = 2, pattern: str = "RG") -> np.ndarray:
+    """
+    demosaic and bin a raw Bayer image in one pass: each output RGB pixel
+    averages the samples of a factor x factor block (2 = superpixel)
+    """
+    if factor < 2 or factor % 2 != 0:
+        raise ValueError(f"Preview factor must be even, got {factor}")
+    if pattern not in BAYER_POSITIONS:
+        raise ValueError(f"Unknown Bayer pattern {pattern}")
+    k = factor // 2
+    h, w = raw.shape[:2]
+    h, w = h - h % factor, w - w % factor
+
+    # sum the k x k Bayer tiles of each block: (H/f, 2, W/f, 2)
+    tiles = raw[:h, :w].reshape(h // factor, k, 2, w // factor, k, 2)
+    quads = tiles.sum(axis=(1, 4), dtype=np.uint32)
+
+    (ry, rx), (by, bx) = BAYER_POSITIONS[pattern]
+    g0, g1 = [
+        (y, x) for y in (0, 1) for x in (0, 1) if (y, x) not in [(ry, rx), (by, bx)]
+    ]
+    n = k * k
+    out = np.empty((h // factor, w // factor, 3), dtype=raw.dtype)
+    out[..., 0] = quads[:, ry, :, rx] // n
+    out[..., 1] = (quads[:, g0[0], :, g0[1]] + quads[:, g1[0], :, g1[1]]) // (2 * n)
+    out[..., 2] = quads[:, by, :, bx] // n
+    return out
+
+
+def convert_raw(raw: np.ndarray, pattern: Optional[str], output: str) -> np.ndarray:
+    """
+    8-bit raw buffer (Bayer pattern, or None for mono) to output "RGB", "GRAY"
+    or "RAW", bilinear demosaicing; always a new array
+    """
+    if output == "RAW" or (pattern is None and output == "GRAY"):
+        return raw.copy()
+    if pattern is None:
+        return cv2.cvtColor(raw, cv2.COLOR_GRAY2RGB)
+    code = getattr(cv2, f"COLOR_Bayer{BAYER_TILES[pattern]}2{output}")
+    return cv2.cvtColor(raw, code)
+
+
+class Preprocessing:
+    """
+    Reducing operations applied by the camera worker on each frame, before
+    it is copied into shared memory. Functions work on numpy arrays and are
+    applied in config order:
+        crop: roi [x, y, w, h]
+        downscale: factor (box binning)
+        mono: single channel luminance
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.functions = []
+        self.kwargs = []
+        self.cfg = cfg
+        self.init_preprocessings()
+
+    def init_preprocessings(self) -> bool:
+        if "functions" not in self.cfg:
+            raise ValueError("No functions in preprocessing config")
+        if self.cfg.functions is None:
+            return False
+
+        for k, v in self.cfg.functions.items():
+            if k not in ["crop", "downscale", "mono"]:
+                raise ValueError(f"Function {k} not found in preprocessing class")
+            self.functions.append(getattr(self, k))
+            if v is None:
+                self.kwargs.append({})
+            else:
+                self.kwargs.append(v)
+        return True
+
+    def crop(self, img: np.ndarray, roi: List[int]) -> np.ndarray:
+        x, y, w, h = roi
+        return img[y : y + h, x : x + w]
+
+    def crops_first(self) -> bool:
+        return len(self.functions) > 0 and self.functions[0].__name__ == "crop"
+
+    def crop_raw(self, raw: np.ndarray, bayer: bool) -> Tuple[np.ndarray, List[int]]:
+        """
+        raw buffer cut to the first crop function, before conversion. Bayer
+        cuts are aligned to the 2x2 tile, with a margin so the demosaicing
+        sees the same neighbours as on the full frame. Returns the cut buffer
+        and the roi left to crop once converted.
+        """
+        x, y, w, h = self.kwargs[0]["roi"]
+        if not bayer:
+            return raw[y : y + h, x : x + w], [0, 0, w, h]
+        margin = 2
+        x0 = max(x - margin, 0) // 2 * 2
+        y0 = max(y - margin, 0) // 2 * 2
+        x1 = min((x + w + margin + 1) // 2 * 2, raw.shape[1])
+        y1 = min((y + h + margin + 1) // 2 * 2, raw.shape[0])
+        return raw[y0:y1, x0:x1], [x - x0, y - y0, w, h]
+
+    def downscale(self, img: np.ndarray, factor: int = 2) -> np.ndarray:
+        return bin_image(img, factor)
+
+    def mono(self, img: np.ndarray) -> np.ndarray:
+        if img.ndim == 3 and img.shape[2] == 3:
+            return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        return img
+
+    def preprocess(self, img: Optional[np.ndarray], start: int = 0) -> Optional[np.ndarray]:
+        """
+        start: index of the first function applied, the earlier ones already were
+        """
+        if img is None or self.functions == []:
+            return img
+        for fn, kwargs in zip(self.functions[start:], self.kwargs[start:]):
+            img = fn(img, **kwargs)
+        return img
+
+    def get_info(self, resolution: List[int]) -> Dict:
+        """
+        region of the sensor ROI kept by the functions, and its scale:
+        image pixel = (sensor ROI pixel - offset) * scale
+        """
+        offset = [0, 0]
+        size = list(resolution)
+        scale = 1.0
+        for fn, kwargs in zip(self.functions, self.kwargs):
+            if fn.__name__ == "crop":
+                x, y, w, h = kwargs["roi"]
+                offset = [offset[0] + x / scale, offset[1] + y / scale]
+                size = [w / scale, h / scale]
+            elif fn.__name__ == "downscale":
+                scale /= kwargs.get("factor", 2)
+        return {"offset": offset, "resolution": size, "scale": scale}
@@ -0,0 +1,73 @@
+import numpy as np
+from omegaconf import DictConfig
+from typing import Dict, List, Optional
+from utils_ema.image import Image
+from utils_image import image_to_numpy
+
+
+def quality_scores(img: Image, stride: int = 8) -> Dict[str, float]:
+    """
+    focus and exposure scores on a strided subset of pixel pairs:
+        sharpness: mean squared gradient between neighbours, 8-bit gray levels
+        clipped: ratio of saturated samples
+        black: ratio of zero samples
+    """
+    arr = image_to_numpy(img)
+    if arr.ndim == 3:
+        # green channel (or the only one), no color conversion of the full frame
+        arr = arr[..., min(1, arr.shape[2] - 1)]
+    if np.issubdtype(arr.dtype, np.integer):
+        top = np.iinfo(arr.dtype).max
+    else:
+        top = 1.0
+    scale = 255 / top
+
+    # neighbour pairs sampled every stride pixels, horizontal and vertical
+    x = arr[::stride, 0:-1:stride].astype(np.float32)
+    gx = arr[::stride, 1::stride][:, : x.shape[1]] - x
+    y = arr[0:-1:stride, ::stride].astype(np.float32)
+    gy = arr[1::stride, ::stride][: y.shape[0]] - y
+    sharpness = (np.mean(gx * gx) + np.mean(gy * gy)) * scale * scale / 2
+
+    samples = arr[::stride, ::stride]
+    return {
+        "sharpness": float(sharpness),
+        "clipped": float(np.count_nonzero(samples >= top) / samples.size),
+        "black": float(np.count_nonzero(samples <= 0) / samples.size),
+    }
+
+
+class QualityGate:
+    """
+    Per-camera quality scores of the frame sets, and acceptance against
+    min_sharpness and max_clipped (a value or a list indexed by camera id,
+    null to skip).
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.cfg = cfg
+
+    def threshold(self, value, cam_id: int):
+        if value is None or isinstance(value, (int, float)):
+            return value
+        return value[cam_id]
+
+    def score(self, images: List[Image]) -> List[Dict[str, float]]:
+        return [quality_scores(img, self.cfg.stride) for img in images]
+
+    def accept(
+        self, scores: List[Dict[str, float]], cam_ids: Optional[List[int]] = None
+    ) -> bool:
+        """
+        scores of the cameras cam_ids (all cameras in order if None)
+        """
+        if cam_ids is None:
+            cam_ids = list(range(len(scores)))
+        for cam_id, s in zip(cam_ids, scores):
+            min_sharpness = self.threshold(self.cfg.min_sharpness, cam_id)
+            max_clipped = self.threshold(self.cfg.max_clipped, cam_id)
+            if min_sharpness is not None and s["sharpness"] < min_sharpness:
+                return False
+            if max_clipped is not None and s["clipped"] > max_clipped:
+                return False
+        return True
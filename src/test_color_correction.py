@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+import pytest
+from color_correction import ColorCorrectionLUT
+
+
+def identity_lut(n: int) -> np.ndarray:
+    grid = np.linspace(0, 255, n)
+    r, g, b = np.meshgrid(grid, grid, grid, indexing="ij")
+    return np.stack([r, g, b], axis=-1)
+
+
+def random_image(seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("n", [17, 32, 33])
+def test_identity_lut3d(tmp_path, n):
+    np.save(tmp_path / "1234.npy", np.rint(identity_lut(n)).astype(np.uint8))
+    luts = ColorCorrectionLUT(str(tmp_path))
+    img = random_image()
+    # nodes are not integers for most N, interpolation error stays within rounding
+    assert np.abs(luts.apply(img, "1234").astype(int) - img).max() <= 1
+
+
+def test_cube_lut(tmp_path):
+    n = 17
+    # red fastest, then green, then blue; swaps red and blue
+    lines = ["TITLE \"swap\"", f"LUT_3D_SIZE {n}"]
+    grid = np.linspace(0, 1, n)
+    for b in grid:
+        for g in grid:
+            for r in grid:
+                lines.append(f"{b:.6f} {g:.6f} {r:.6f}")
+    (tmp_path / "1234.cube").write_text("\n".join(lines))
+    luts = ColorCorrectionLUT(str(tmp_path))
+    img = random_image(1)
+    out = luts.apply(img, "1234").astype(int)
+    assert np.abs(out - img[..., ::-1]).max() <= 1
+
+
+def test_matrix(tmp_path):
+    (tmp_path / "1234.yaml").write_text("matrix: [0, 0, 1, 0, 1, 0, 1, 0, 0]\n")
+    luts = ColorCorrectionLUT(str(tmp_path))
+    img = random_image(2)
+    assert np.array_equal(luts.apply(img, "1234"), img[..., ::-1])
@@ -0,0 +1,58 @@
+import logging
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from omegaconf import DictConfig
+from exposure_controller import MIN_RATIO, ExposureController
+
+
+class CameraControllerStub:
+    num_cameras = 2
+
+    def __init__(self):
+        self.calls = []
+
+    def set_camera_params(self, cam_ids, wait, **params):
+        self.calls.append((cam_ids, params))
+
+
+def get_controller():
+    cfg = DictConfig(
+        {
+            "exposure_time": 10000,
+            "gain": 0,
+            "auto_exposure": {
+                "target": 0.45,
+                "tolerance": 0.05,
+                "max_clipped": 0.01,
+                "stride": 8,
+                "damping": 1.0,
+                "settle_frames": 0,
+                "exposure_range": [100, 100000],
+                "gain_range": [0, 24],
+                "presets": None,
+            },
+        }
+    )
+    cameras = CameraControllerStub()
+    return ExposureController(logging.getLogger("test"), cfg, cameras), cameras
+
+
+def test_saturated_frame():
+    controller, cameras = get_controller()
+    saturated = np.full((64, 64, 3), 255, dtype=np.uint8)
+    analysis = controller.update([saturated], [1])
+    assert analysis[1]["clipped"] == 1
+    # pulled down by the floor ratio, gain already at its min
+    assert cameras.calls == [([1], {"exposure_time": 10000 * MIN_RATIO})]
+    assert controller.exposure == [10000, 10000 * MIN_RATIO]
+
+
+def test_dark_frame():
+    controller, cameras = get_controller()
+    dark = np.full((64, 64), 45, dtype=np.uint8)
+    controller.update([dark], [0])
+    # exposure first, up to 10x
+    assert np.isclose(controller.exposure[0], 10000 * 0.45 * 255 / 45)
+    assert controller.gain[0] == 0
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from flat_field import FlatFieldCorrection
+from preprocessing import bin_image
+
+
+def calibration(tmp_path, shape=(8, 12)):
+    path = tmp_path / "calib" / "1234" / f"{shape[1]}x{shape[0]}_0_0"
+    path.mkdir(parents=True)
+    # vignetting: right half of the sensor at half response
+    flat = np.full(shape, 100.0)
+    flat[:, shape[1] // 2 :] = 50.0
+    np.save(path / "flat.npy", flat)
+    np.save(path / "dark_1000.npy", np.full(shape, 10, dtype=np.uint8))
+    np.save(path / "dark_8000.npy", np.full(shape, 20, dtype=np.uint8))
+    return FlatFieldCorrection(str(tmp_path / "calib"), str(tmp_path / "cache")), flat
+
+
+def test_dark_and_gain(tmp_path):
+    ff, flat = calibration(tmp_path)
+    dark, gain = ff.get("1234", [0, 0], [12, 8], exposure_time=7000)
+    assert dark[0, 0] == 20
+    img = (20 + flat * 0.5).astype(np.uint8)
+    out = ff.apply(img, dark, gain)
+    # uniform after correction, at the mean response
+    assert np.abs(out.astype(int) - flat.mean() * 0.5).max() <= 1
+
+    # gain map cached on disk and reused
+    assert len(list((tmp_path / "cache").glob("flatfield_*.npy"))) == 1
+    ff_cached = FlatFieldCorrection(str(tmp_path / "calib"), str(tmp_path / "cache"))
+    _, gain_cached = ff_cached.get("1234", [0, 0], [12, 8], exposure_time=7000)
+    assert np.array_equal(gain, gain_cached)
+
+
+def test_worker_preprocessing(tmp_path):
+    ff, flat = calibration(tmp_path)
+    # crop [2, 0, 8, 8] then downscale by 2
+    pre = {"offset": [2, 0], "resolution": [8, 8], "scale": 0.5}
+    dark, gain = ff.get("1234", [0, 0], [12, 8], exposure_time=1000, preprocessing=pre)
+    raw = (10 + flat * 0.5).astype(np.uint8)
+    img = bin_image(raw[0:8, 2:10], 2)
+    assert dark.shape == img.shape and gain.shape == img.shape
+    out = ff.apply(img, dark, gain)
+    assert np.abs(out.astype(int) - flat.mean() * 0.5).max() <= 1
+
+    # reduced maps cached on disk and memory-mapped, shared across processes
+    assert isinstance(dark, np.memmap) and isinstance(gain, np.memmap)
+    assert len(list((tmp_path / "cache").glob("reduced_*.npy"))) == 2
+
+
+def test_in_place(tmp_path):
+    ff, flat = calibration(tmp_path)
+    dark, gain = ff.get("1234", [0, 0], [12, 8], exposure_time=1000)
+    img = (10 + flat * 0.5).astype(np.uint8)
+    expected = ff.apply(img, dark, gain)
+    out = ff.apply(img, dark, gain, out=img)
+    assert out is img
+    assert np.array_equal(img, expected)
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import pytest
+from frame_cache import FrameCache
+
+
+def test_computed_once():
+    cache = FrameCache(capacity=4)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "preview"
+
+    assert cache.get(7, "preview", compute) == "preview"
+    assert cache.get(7, "preview", compute) == "preview"
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    with pytest.raises(KeyError):
+        cache.get(7, "postprocessed")
+
+
+def test_eviction():
+    cache = FrameCache(capacity=3)
+    for frame_id in range(5):
+        cache.put(frame_id, "raw", frame_id)
+    # only the frame sets still in the ring
+    assert list(cache.entries.keys()) == [2, 3, 4]
+    assert cache.contains(4, "raw") and not cache.contains(1, "raw")
+
+    # index reset of the ring, later ids are stale
+    cache.put(0, "raw", 0)
+    assert list(cache.entries.keys()) == [0]
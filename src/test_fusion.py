@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from omegaconf import DictConfig
+from fusion import FrameFusion
+
+
+def get_fusion(mode: str) -> FrameFusion:
+    cfg = DictConfig(
+        {
+            "mode": {"val": mode, "valid_options": ["average", "hdr"]},
+            "frames": 4,
+            "exposures": [1000, 2000],
+        }
+    )
+    return FrameFusion(cfg)
+
+
+def event(fusion: FrameFusion, frames, exposures=None):
+    fusion.clear()
+    exposures = [None] * len(frames) if exposures is None else exposures
+    for images, exposure_time in zip(frames, exposures):
+        fusion.add(images, exposure_time)
+    result = fusion.result()
+    fusion.clear()
+    return result
+
+
+def test_average_events_independent():
+    fusion = get_fusion("average")
+    shapes = [(4, 6, 3), (2, 3)]
+    frames = [[np.full(s, v, dtype=np.uint8) for s in shapes] for v in (10, 20, 30, 40)]
+    result = event(fusion, frames)
+    for img in result:
+        assert img.dtype == np.uint8
+        assert np.all(img == 25)
+
+    frames = [[np.full(s, 200, dtype=np.uint8) for s in shapes] for _ in range(4)]
+    result = event(fusion, frames)
+    assert fusion.count == 0
+    for img in result:
+        assert np.all(img == 200)
+
+
+def test_aborted_event_discarded():
+    fusion = get_fusion("average")
+    fusion.add([np.full((2, 2), 100, dtype=np.uint8)])
+    fusion.clear()
+    result = event(fusion, [[np.full((2, 2), 7, dtype=np.uint8)]])
+    assert np.all(result[0] == 7)
+
+
+def test_hdr_events_independent():
+    fusion = get_fusion("hdr")
+    exposures = [1000, 2000]
+    for radiance in (50, 80):
+        # same scene radiance in both brackets
+        frames = [
+            [np.full((3, 5), radiance * e // 1000, dtype=np.uint8)] for e in exposures
+        ]
+        result = event(fusion, frames, exposures)
+        assert result[0].dtype == np.uint16
+        # radiance in units of the shortest exposure, 8 fraction bits
+        assert np.all(result[0] == radiance * 256)
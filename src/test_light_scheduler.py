@@ -0,0 +1,50 @@
+import logging
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from omegaconf import DictConfig
+from light_scheduler import LightScheduler, compile_light_plan
+
+
+cfg = DictConfig(
+    {
+        "sequence": [1, {"channels": [2, 3], "duration_ms": 100}],
+        "rounds": 2,
+        "step_ms": 200,
+    }
+)
+
+
+def get_scheduler(t0: float) -> LightScheduler:
+    scheduler = LightScheduler(logging.getLogger("test"), None, compile_light_plan(cfg))
+    # fake clock, the scheduler thread is not started
+    scheduler.t0 = t0
+    return scheduler
+
+
+def test_plan():
+    timeline = compile_light_plan(cfg)
+    assert timeline.channels == [(1,), (2, 3), (1,), (2, 3)]
+    assert np.allclose(timeline.starts, [0.0, 0.2, 0.3, 0.5])
+    assert timeline.step_at(0.25) == 1 and timeline.step_at(0.6) == -1
+
+
+def test_frame_step():
+    scheduler = get_scheduler(t0=100.0)
+    settle = 0.02
+    delay = 0.06
+    # exposed in the settled part of step 0
+    assert scheduler.frame_step(100.05 - delay, 100.05, settle) == -1
+    assert scheduler.frame_step(100.09 - delay, 100.09, settle) == 0
+    # stamped in step 1 but exposed during step 0: not step 1
+    assert scheduler.frame_step(100.21 - delay, 100.21, settle) == -1
+    # exposed before the settle time of step 1
+    assert scheduler.frame_step(100.235 - delay, 100.235, settle) == -1
+    assert scheduler.frame_step(100.29 - delay, 100.29, settle) == 1
+    # exposure running past the end of step 1
+    assert scheduler.frame_step(100.25, 100.31, settle) == -1
+    # before the start and after the end of the plan
+    assert scheduler.frame_step(99.9, 99.95, settle) == -1
+    assert scheduler.frame_step(100.7, 100.75, settle) == -1
+    assert get_scheduler(t0=None).frame_step(0.0, 1.0, settle) == -1
@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from pixel_statistics import PixelStatistics
+
+
+def test_statistics(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 4096, (50, 16, 24), dtype=np.uint16)
+    stats = PixelStatistics()
+    for img in frames:
+        stats.update(img, cam_id=0)
+        stats.update(img[::-1], cam_id=1, channel=2)
+    stats.update(np.zeros((1, 1, 3), dtype=np.uint8), cam_id=0)
+    assert stats.skipped == 1
+    # one scratch pair for the two accumulators of the shape
+    assert len(stats.scratch.buffers) == 1
+
+    stats.save(str(tmp_path))
+    res = np.load(tmp_path / "cam_000.npz")
+    assert res["count"] == 50
+    assert np.allclose(res["mean"], frames.mean(axis=0), rtol=1e-6)
+    assert np.allclose(res["var"], frames.var(axis=0, ddof=1), rtol=1e-4)
+    assert np.array_equal(res["min"], frames.min(axis=0))
+    assert np.array_equal(res["max"], frames.max(axis=0))
+    res = np.load(tmp_path / "cam_001_ch2.npz")
+    assert np.allclose(res["mean"], frames[:, ::-1].mean(axis=0), rtol=1e-6)
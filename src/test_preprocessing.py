@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+import pytest
+from omegaconf import DictConfig
+from preprocessing import Preprocessing, convert_raw
+
+
+def get_preprocessing(roi) -> Preprocessing:
+    functions = {"crop": {"roi": roi}, "downscale": {"factor": 2}}
+    return Preprocessing(DictConfig({"functions": functions}))
+
+
+@pytest.mark.parametrize("roi", [[10, 6, 40, 20], [3, 5, 41, 21], [0, 0, 64, 48]])
+@pytest.mark.parametrize("pattern", ["RG", "GB"])
+def test_crop_raw_before_demosaic(roi, pattern):
+    raw = np.random.default_rng(0).integers(0, 256, (48, 64), dtype=np.uint8)
+    preprocessing = get_preprocessing(roi)
+    assert preprocessing.crops_first()
+
+    # full frame demosaiced, then preprocessed
+    expected = preprocessing.preprocess(convert_raw(raw, pattern, "RGB"))
+
+    cut, roi_left = preprocessing.crop_raw(raw, bayer=True)
+    assert cut.size < raw.size or roi == [0, 0, 64, 48]
+    img = preprocessing.crop(convert_raw(cut, pattern, "RGB"), roi_left)
+    assert np.array_equal(preprocessing.preprocess(img, start=1), expected)
+
+
+def test_crop_raw_mono():
+    raw = np.arange(48 * 64, dtype=np.uint16).reshape(48, 64).astype(np.uint8)
+    preprocessing = get_preprocessing([3, 5, 41, 21])
+    cut, roi_left = preprocessing.crop_raw(raw, bayer=False)
+    img = preprocessing.crop(convert_raw(cut, None, "GRAY"), roi_left)
+    assert np.array_equal(img, raw[5:26, 3:44])
+    assert not np.shares_memory(img, raw)
@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from omegaconf import DictConfig
+from quality import QualityGate, quality_scores
+
+
+def test_scores():
+    flat = np.full((64, 64), 128, dtype=np.uint8)
+    scores = quality_scores(flat, stride=4)
+    assert scores["sharpness"] == 0
+    assert scores["clipped"] == 0 and scores["black"] == 0
+
+    # checkerboard of 0 and 255, every neighbour pair differs by 255
+    checker = (np.indices((64, 64)).sum(axis=0) % 2 * 255).astype(np.uint8)
+    scores = quality_scores(checker, stride=3)
+    assert scores["sharpness"] == 255 * 255
+    assert 0 < scores["clipped"] < 1 and scores["clipped"] + scores["black"] == 1
+
+    # float images in [0, 1] on the same 8-bit scale
+    scores = quality_scores(checker.astype(np.float32) / 255, stride=3)
+    assert np.isclose(scores["sharpness"], 255 * 255)
+
+
+def test_accept_by_camera_id():
+    cfg = DictConfig(
+        {"stride": 8, "min_sharpness": [0.0, 50.0, 10.0], "max_clipped": None}
+    )
+    gate = QualityGate(cfg)
+    scores = [{"sharpness": 20.0, "clipped": 0.0}]
+    assert gate.accept(scores, cam_ids=[2])
+    assert not gate.accept(scores, cam_ids=[1])
+    # without camera ids, the frame set holds all cameras in order
+    assert gate.accept(scores)
+    assert not gate.accept(scores * 2)
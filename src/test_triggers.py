@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+sys.path.append(Path(__file__).parent.as_posix())
+import numpy as np
+from omegaconf import DictConfig
+from triggers import ChangeTrigger
+
+
+def get_trigger(change_threshold=8.0, still_threshold=2.0) -> ChangeTrigger:
+    cfg = DictConfig(
+        {
+            "thumb_width": 16,
+            "change_threshold": change_threshold,
+            "still_threshold": still_threshold,
+            "stillness_window": 2,
+        }
+    )
+    return ChangeTrigger(cfg)
+
+
+def frame(level: int) -> np.ndarray:
+    return np.full((32, 48), level, dtype=np.uint8)
+
+
+def test_fires_once_settled_after_change():
+    trigger = get_trigger()
+    # first still frame sets, nothing captured yet
+    assert [trigger([frame(10), frame(10)]) for _ in range(3)] == [False, False, True]
+    # same scene, no capture
+    assert not any(trigger([frame(10), frame(10)]) for _ in range(5))
+    # scene changed, moving then settled
+    assert not trigger([frame(30), frame(10)])
+    assert not trigger([frame(50), frame(10)])
+    assert not trigger([frame(50), frame(10)])
+    assert trigger([frame(50), frame(10)])
+
+
+def test_thresholds_by_camera_id():
+    # camera 1 is noisy, only a large change counts there
+    trigger = get_trigger(change_threshold=[8.0, 100.0, 8.0])
+    trigger.set_camera_ids([1])
+    for _ in range(3):
+        trigger([frame(10)])
+    assert not any(trigger([frame(50)]) for _ in range(5))
+
+    # camera 2 alone, its own threshold and not the first of the list
+    trigger = get_trigger(change_threshold=[100.0, 100.0, 8.0])
+    trigger.set_camera_ids([2])
+    for _ in range(3):
+        trigger([frame(10)])
+    assert any(trigger([frame(50)]) for _ in range(5))
+
+
+def test_reset_on_other_cameras():
+    trigger = get_trigger()
+    trigger.set_camera_ids([0])
+    for _ in range(3):
+        trigger([frame(10)])
+    # same cameras, the reference is kept and the scene did not change
+    trigger.set_camera_ids([0])
+    assert not any(trigger([frame(10)]) for _ in range(5))
+    # other camera, its frames are not compared to camera 0
+    trigger.set_camera_ids([1])
+    assert [trigger([frame(10)]) for _ in range(3)] == [False, False, True]
@@ -0,0 +1,95 @@
+import numpy as np
+from omegaconf import DictConfig
+from typing import List, Optional
+from utils_ema.image import Image
+from utils_image import image_to_numpy
+
+
+def thumbnail(img: Image, width: int) -> np.ndarray:
+    """
+    strided grayscale thumbnail in [0, 255], about width pixels wide
+    """
+    arr = image_to_numpy(img)
+    stride = max(1, arr.shape[1] // width)
+    thumb = arr[::stride, ::stride]
+    if thumb.ndim == 3:
+        thumb = thumb.mean(axis=2, dtype=np.float32)
+    else:
+        thumb = thumb.astype(np.float32)
+    if arr.dtype == np.uint16:
+        thumb *= 1 / 257
+    elif arr.dtype != np.uint8:
+        thumb *= 255
+    return thumb
+
+
+class ChangeTrigger:
+    """
+    Capture trigger firing when the scene has changed with respect to the last
+    captured frame set and then stayed still for stillness_window frame sets.
+    Change and motion are mean absolute differences of thumbnails, in gray
+    levels, with per-camera thresholds (a value, or a list indexed by camera id).
+    """
+
+    # thumbnails only, the low-res preview is enough
+    use_preview = True
+
+    def __init__(self, cfg: DictConfig):
+        self.cfg = cfg
+        self.cam_ids = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.reference: Optional[List[np.ndarray]] = None
+        self.previous: Optional[List[np.ndarray]] = None
+        self.still_count = 0
+
+    def set_camera_ids(self, cam_ids: Optional[List[int]]) -> None:
+        """
+        cameras of the next frame sets, all cameras in order if None
+        """
+        cam_ids = None if cam_ids is None else list(cam_ids)
+        # other cameras, nothing to compare with
+        if cam_ids != self.cam_ids:
+            self.reset()
+            self.cam_ids = cam_ids
+
+    def threshold(self, value, cam_id: int) -> float:
+        if isinstance(value, (int, float)):
+            return value
+        return value[cam_id]
+
+    def __call__(self, images: List[Image]) -> bool:
+        cam_ids = self.cam_ids
+        if cam_ids is None:
+            cam_ids = list(range(len(images)))
+        thumbs = [thumbnail(img, self.cfg.thumb_width) for img in images]
+
+        # motion with respect to the previous frame set
+        if self.previous is not None and [t.shape for t in thumbs] == [
+            t.shape for t in self.previous
+        ]:
+            still = all(
+                np.abs(t - p).mean() < self.threshold(self.cfg.still_threshold, cam_id)
+                for cam_id, t, p in zip(cam_ids, thumbs, self.previous)
+            )
+            self.still_count = self.still_count + 1 if still else 0
+        self.previous = thumbs
+
+        if self.still_count < self.cfg.stillness_window:
+            return False
+
+        # change with respect to the last captured frame set
+        if self.reference is not None and [t.shape for t in thumbs] == [
+            t.shape for t in self.reference
+        ]:
+            changed = any(
+                np.abs(t - r).mean() > self.threshold(self.cfg.change_threshold, cam_id)
+                for cam_id, t, r in zip(cam_ids, thumbs, self.reference)
+            )
+            if not changed:
+                return False
+
+        self.reference = thumbs
+        self.still_count = 0
+        return True
@@ -0,0 +1,84 @@
+import cv2
+import hashlib
+import numpy as np
+import omegaconf
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class UndistortionMaps:
+    """
+    Per-camera fixed-point remap tables, computed once per camera, resolution
+    and crop, cached in memory and on disk.
+
+    Intrinsics are read from <intrinsics_dir>/<serial>.yaml:
+        K: 3x3 camera matrix at full sensor resolution
+        dist: distortion coefficients (OpenCV order)
+    """
+
+    def __init__(self, intrinsics_dir: str, cache_dir: str, alpha: Optional[float] = None):
+        self.intrinsics_dir = Path(intrinsics_dir)
+        self.cache_dir = Path(cache_dir)
+        self.alpha = alpha
+        self.maps = {}
+        self.intrinsics = {}
+
+    def load_intrinsics(self, serial: str) -> Tuple[np.ndarray, np.ndarray, str]:
+        if serial not in self.intrinsics:
+            path = self.intrinsics_dir / f"{serial}.yaml"
+            if not path.exists():
+                raise FileNotFoundError(f"Intrinsics of camera {serial} not found: {path}")
+            text = path.read_text()
+            data = omegaconf.OmegaConf.create(text)
+            K = np.array(data.K, dtype=np.float64).reshape(3, 3)
+            dist = np.array(data.dist, dtype=np.float64).ravel()
+            digest = hashlib.md5(text.encode()).hexdigest()[:8]
+            self.intrinsics[serial] = (K, dist, digest)
+        return self.intrinsics[serial]
+
+    def get(
+        self,
+        serial: str,
+        resolution: Tuple[int, int],
+        crop_offset: Tuple[int, int],
+        crop_resolution: Tuple[int, int],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        resolution: (w, h) of the images, crop_*: sensor ROI from devices info
+        """
+        key = (serial, tuple(resolution), tuple(crop_offset), tuple(crop_resolution))
+        if key in self.maps:
+            return self.maps[key]
+
+        K, dist, digest = self.load_intrinsics(serial)
+        w, h = resolution
+        name = f"undistort_{serial}_{w}x{h}_{crop_offset[0]}_{crop_offset[1]}_{crop_resolution[0]}x{crop_resolution[1]}_{self.alpha}_{digest}.npz"
+        path = self.cache_dir / name
+        if path.exists():
+            data = np.load(path)
+            self.maps[key] = (data["map1"], data["map2"])
+            return self.maps[key]
+
+        # intrinsics of the cropped (and possibly rescaled) image
+        K = K.copy()
+        K[0, 2] -= crop_offset[0]
+        K[1, 2] -= crop_offset[1]
+        scale = np.diag([w / crop_resolution[0], h / crop_resolution[1], 1])
+        K = scale @ K
+
+        if self.alpha is None:
+            K_new = K
+        else:
+            K_new, _ = cv2.getOptimalNewCameraMatrix(K, dist, (w, h), self.alpha)
+
+        # fixed-point tables: int16 coordinates + uint16 interpolation weights
+        map1, map2 = cv2.initUndistortRectifyMap(
+            K, dist, None, K_new, (w, h), cv2.CV_16SC2
+        )
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(path, map1=map1, map2=map2)
+        self.maps[key] = (map1, map2)
+        return self.maps[key]
+
+    def apply(self, img: np.ndarray, maps: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        return cv2.remap(img, maps[0], maps[1], cv2.INTER_LINEAR)
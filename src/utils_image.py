@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def image_to_numpy(image) -> np.ndarray:
+    """
+    numpy array of an Image (or of an array/tensor), without copies when possible
+    """
+    img = image.img if hasattr(image, "img") else image
+    if hasattr(img, "detach"):
+        img = img.detach().cpu().numpy()
+    return np.asarray(img)
+
+
+def to_uint8(img: np.ndarray) -> np.ndarray:
+    """
+    float images are expected in [0, 1]
+    """
+    if img.dtype == np.uint8:
+        return img
+    if np.issubdtype(img.dtype, np.floating):
+        return (np.clip(img, 0, 1) * 255).astype(np.uint8)
+    return (img >> (8 * (img.dtype.itemsize - 1))).astype(np.uint8)